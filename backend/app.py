@@ -1,13 +1,35 @@
 import os
 import json
+import time
 import base64
 import uuid
-from flask import Flask, request, jsonify
-# from flask_sqlalchemy import SQLAlchemy
+import atexit
+import functools
+import threading
+from flask import Flask, request, jsonify, Response, stream_with_context, g, send_file, abort
 from flask_cors import CORS
 from dotenv import load_dotenv
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, wait
 import requests
+from recipe_index import RecipeIndex
+from search_index import SearchIndexCache, bm25_search, query_terms
+from user_index import PartitionedUserIndex, encode_cursor, decode_cursor
+from storage_backend import JsonFileBackend, USER_COLLECTIONS, LEGACY_USER_ID, partition_name, split_partition
+from sqlite_backend import SQLiteBackend
+from group_commit import GroupCommitter
+from token_manager import TokenManager
+from upstream import UpstreamClient, SizedStream
+from llm_cache import LLMCache, make_cache_key
+from swr_cache import StaleWhileRevalidate
+from json_stream import StreamingObjectParser, parse_model_json
+import audio_preprocess
+from audio_preprocess import preprocess_pcm
+from metrics import Registry
+from blob_store import BlobStore, IMAGE_CONTENT_TYPES, UnsupportedImageType, parse_data_url
+from http_cache import EncodedResponseCache, FastJSONProvider, make_etag, choose_encoding, available_encodings, compress
+from batch_dispatch import parse_batch, run_batch, dispatch, is_sub_request
+from job_queue import JobQueue, JobConflict, FINISHED
 
 # 语音识别功能使用百度智能云API，不需要本地语音识别库
 
@@ -15,10 +37,12 @@ import requests
 
 load_dotenv()
 app = Flask(__name__)
+# jsonify 在安装了orjson时使用orjson序列化
+app.json = FastJSONProvider(app)
 CORS(app, resources={r"/api/*": {"origins": "*"}})
 
-# 确保数据目录存在
-DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
+# 确保数据目录存在（可通过 DATA_DIR 环境变量指定，如压测时使用生成的数据集）
+DATA_DIR = os.getenv('DATA_DIR') or os.path.join(os.path.dirname(__file__), 'data')
 os.makedirs(DATA_DIR, exist_ok=True)
 
 # 数据文件路径配置
@@ -33,112 +57,664 @@ DATA_FILES = {
     'recipe_filters': os.path.join(DATA_DIR, 'recipe_filters.json')
 }
 
+# 使用追加日志存储的集合（逗号分隔，如 knowledge_items,user_ingredients）
+# 这些集合写入时只追加差异记录，日志过大时后台压缩为快照
+JOURNAL_COLLECTIONS = [
+    key.strip() for key in os.getenv('JOURNAL_COLLECTIONS', '').split(',')
+    if key.strip() in DATA_FILES
+]
+JOURNAL_COMPACT_RECORDS = int(os.getenv('JOURNAL_COMPACT_RECORDS', '1000'))
+
+# 存储后端：json（默认，data/*.json）或 sqlite（生产环境）
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'json').lower()
+SQLITE_PATH = os.getenv('SQLITE_PATH') or os.path.join(DATA_DIR, 'forbites.db')
+
+# 组提交窗口（毫秒），大于0时同一集合在窗口内到达的修改合并为一次写入
+GROUP_COMMIT_MS = float(os.getenv('GROUP_COMMIT_MS', '0'))
+
+# --- 指标统计 ---
+
+metrics = Registry()
+HTTP_REQUESTS = metrics.counter('forbites_http_requests_total', 'HTTP请求数', ('endpoint', 'method', 'status'))
+HTTP_ERRORS = metrics.counter('forbites_http_request_errors_total', 'HTTP请求错误数（5xx）', ('endpoint',))
+HTTP_LATENCY = metrics.histogram('forbites_http_request_duration_seconds', 'HTTP请求处理耗时（秒）', ('endpoint',))
+UPSTREAM_REQUESTS = metrics.counter('forbites_upstream_requests_total', '上游调用次数', ('upstream', 'outcome'))
+UPSTREAM_LATENCY = metrics.histogram('forbites_upstream_request_duration_seconds', '上游调用耗时（秒，含重试）', ('upstream',))
+STORAGE_LATENCY = metrics.histogram('forbites_storage_operation_duration_seconds', '数据集合读写耗时（秒）', ('collection', 'operation'))
+STORAGE_BYTES_READ = metrics.counter('forbites_storage_bytes_read_total', '从数据文件读取的字节数', ('collection',))
+STORAGE_BYTES_WRITTEN = metrics.counter('forbites_storage_bytes_written_total', '写入数据文件的字节数', ('collection',))
+STORAGE_CACHE_HITS = metrics.counter('forbites_storage_cache_hits_total', 'load_data命中内存缓存次数', ('collection',))
+RESPONSE_CACHE_HITS = metrics.counter('forbites_response_cache_hits_total', '只读接口直接返回缓存响应体的次数', ('endpoint',))
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    """记录每个接口的请求数、错误数和耗时（流式响应只统计到开始返回为止）"""
+    start = g.pop('request_start', None)
+    if start is not None:
+        endpoint = request.endpoint or 'unmatched'
+        HTTP_LATENCY.observe(time.perf_counter() - start, endpoint=endpoint)
+        HTTP_REQUESTS.inc(endpoint=endpoint, method=request.method, status=response.status_code)
+        if response.status_code >= 500:
+            HTTP_ERRORS.inc(endpoint=endpoint)
+    return response
+
+def record_upstream_call(name, seconds, outcome):
+    UPSTREAM_LATENCY.observe(seconds, upstream=name)
+    UPSTREAM_REQUESTS.inc(upstream=name, outcome=outcome)
+
+# --- 用户身份 ---
+
+# 请求通过 X-User-Id 请求头指明用户；未携带时视为默认用户（兼容尚未传递用户标识的前端）
+USER_ID_HEADER = 'X-User-Id'
+DEFAULT_USER_ID = LEGACY_USER_ID
+
+@app.before_request
+def identify_user():
+    raw = request.headers.get(USER_ID_HEADER)
+    if raw is None:
+        g.user_id = DEFAULT_USER_ID
+        return None
+    try:
+        user_id = int(raw)
+    except ValueError:
+        user_id = 0
+    if user_id <= 0:
+        return jsonify({'error': f'无效的 {USER_ID_HEADER} 请求头'}), 400
+    g.user_id = user_id
+    return None
+
+def current_user_id():
+    """当前请求的用户"""
+    return g.user_id
+
 # --- 数据操作工具函数 ---
 
-def load_data(file_key):
-    """加载JSON数据"""
-    file_path = DATA_FILES[file_key]
-    if not os.path.exists(file_path):
-        return []
-    try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except json.JSONDecodeError:
-        app.logger.error(f"JSON解码错误: {file_path}")
-        return []
-    except Exception as e:
-        app.logger.error(f"加载数据失败: {str(e)}")
-        return []
+def record_storage_read(key, cache_hit, bytes_read):
+    collection, _ = split_partition(key)
+    if cache_hit:
+        STORAGE_CACHE_HITS.inc(collection=collection)
+    else:
+        STORAGE_BYTES_READ.inc(bytes_read, collection=collection)
 
-def save_data(file_key, data):
-    """保存数据到JSON文件"""
-    file_path = DATA_FILES[file_key]
-    try:
-        with open(file_path, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+def create_storage():
+    """
+    按 STORAGE_BACKEND 创建存储后端
+    - json（默认）：data/*.json 文件，开发环境使用
+    - sqlite：WAL模式的SQLite数据库（SQLITE_PATH，默认 data/forbites.db），
+      先用 python migrate_storage.py 从JSON文件迁移数据
+    USER_COLLECTIONS 中的集合按用户分区存储
+    """
+    if STORAGE_BACKEND == 'sqlite':
+        return SQLiteBackend(SQLITE_PATH, DATA_FILES, DATA_DIR, partitioned=USER_COLLECTIONS)
+    return JsonFileBackend(
+        DATA_FILES,
+        DATA_DIR,
+        journal_collections=JOURNAL_COLLECTIONS,
+        compact_records=JOURNAL_COMPACT_RECORDS,
+        observer=record_storage_read,
+        partitioned=USER_COLLECTIONS
+    )
+
+storage = create_storage()
+
+@app.teardown_request
+def release_storage(exc):
+    """请求结束时归还存储连接（gevent模式下每个请求一个协程，连接不随协程泄漏）"""
+    storage.release()
+
+# 保存成功后的回调，在集合锁内调用：
+# 共享集合为 listener(data, 保存前版本号, 保存后版本号)，分区集合额外以 user_id 作为第一个参数
+save_listeners = {}
+
+def storage_key(file_key, user_id=None):
+    """集合名 -> 存储键；USER_COLLECTIONS 中的集合按用户分区，必须指定user_id（共享集合忽略user_id）"""
+    if file_key not in USER_COLLECTIONS:
+        return file_key
+    if user_id is None:
+        raise ValueError(f'{file_key} 按用户分区存储，需要指定 user_id')
+    return partition_name(file_key, user_id)
+
+def load_data(file_key, user_id=None):
+    """
+    加载集合数据（分区集合只加载user_id的分区；JSON后端优先使用内存缓存）
+    返回列表的浅拷贝，调用方可以增删元素；修改元素时应替换为新字典后调用save_data保存
+    """
+    with STORAGE_LATENCY.time(collection=file_key, operation='load'):
+        return storage.load(storage_key(file_key, user_id))
+
+def save_data(file_key, data, user_id=None):
+    """保存集合数据（持有集合锁，分区集合只保存user_id的分区）"""
+    key = storage_key(file_key, user_id)
+    with storage.lock(key):
+        from_version = get_data_version(file_key, user_id)
+        try:
+            with STORAGE_LATENCY.time(collection=file_key, operation='save'):
+                written = storage.save(key, data)
+        except Exception as e:
+            app.logger.error(f"保存数据失败: {str(e)}")
+            return False
+        STORAGE_BYTES_WRITTEN.inc(written, collection=file_key)
+        to_version = get_data_version(file_key, user_id)
+        partition = (user_id,) if key != file_key else ()
+        for listener in save_listeners.get(file_key, ()):
+            try:
+                listener(*partition, data, from_version, to_version)
+            except Exception as e:
+                app.logger.error(f"保存回调执行失败: {str(e)}")
         return True
-    except Exception as e:
-        app.logger.error(f"保存数据失败: {str(e)}")
-        return False
+
+def get_data_version(file_key, user_id=None):
+    """获取集合（分区）数据版本号，数据变化（包括其他进程写入）后版本号改变"""
+    return storage.version(storage_key(file_key, user_id))
+
+def find_data(file_key, where=None, user_id=None, **options):
+    """按等值条件查询集合或用户分区（SQLite后端走索引，JSON后端在内存中过滤），options同 StorageBackend.find"""
+    with STORAGE_LATENCY.time(collection=file_key, operation='find'):
+        return storage.find(storage_key(file_key, user_id), where, **options)
+
+def list_user_ids(file_key):
+    """分区集合中有数据的全部user_id"""
+    return storage.partitions(file_key)
+
+def _commit_mutations(file_key, user_id, mutations):
+    """
+    在集合（分区）锁内加载最新数据，依次执行修改，最后只保存一次
+    单个修改抛出异常时撤销它对列表的增删，不影响同批次的其他修改
+    返回 (是否保存成功, [(结果, 异常), ...])
+    """
+    with storage.lock(storage_key(file_key, user_id)):
+        data = load_data(file_key, user_id)
+        outcomes = []
+        for mutate in mutations:
+            snapshot = list(data)
+            try:
+                outcomes.append((mutate(data), None))
+            except Exception as e:
+                data[:] = snapshot
+                outcomes.append((None, e))
+        saved = any(error is None for _, error in outcomes) and save_data(file_key, data, user_id)
+        return saved, outcomes
+
+# 启用组提交时每个存储键（集合或用户分区）一个提交器，首次写入时创建
+group_committers = {}
+_group_committers_lock = threading.Lock()
+
+def get_group_committer(file_key, user_id=None):
+    if GROUP_COMMIT_MS <= 0:
+        return None
+    key = storage_key(file_key, user_id)
+    with _group_committers_lock:
+        committer = group_committers.get(key)
+        if committer is None:
+            committer = group_committers[key] = GroupCommitter(
+                lambda mutations: _commit_mutations(file_key, user_id, mutations), GROUP_COMMIT_MS / 1000
+            )
+        return committer
+
+def modify_data(file_key, mutate, user_id=None):
+    """
+    读取-修改-保存事务（分区集合只读写user_id的分区）
+    mutate(data) 在集合锁内被调用，原地增删列表元素并返回结果
+    返回 (是否保存成功, mutate的返回值)；mutate抛出的异常会原样抛出
+    """
+    committer = get_group_committer(file_key, user_id)
+    if committer is not None:
+        saved, (result, error) = committer.submit(mutate)
+    else:
+        saved, [(result, error)] = _commit_mutations(file_key, user_id, [mutate])
+    if error is not None:
+        raise error
+    return saved, result
+
+def _remove_item(items, item_id):
+    """从用户分区中删除一条记录，记录不存在时抛出LookupError（不写盘）"""
+    filtered = [item for item in items if item.get('id') != item_id]
+    if len(filtered) == len(items):
+        raise LookupError(item_id)
+    items[:] = filtered
 
 def get_next_id(file_key):
-    """获取下一个ID"""
-    data = load_data(file_key)
-    if not data:
-        return 1
-    return max(item['id'] for item in data) + 1
+    """获取下一个ID（分区集合的ID在所有用户之间唯一）"""
+    return storage.next_id(file_key)
+
+def reserve_ids(file_key, count):
+    """批量分配count个ID，返回range"""
+    return storage.reserve_ids(file_key, count)
+
+
+# 菜谱食材倒排索引，保存recipes后增量更新，集合被外部修改时重建
+recipe_index = RecipeIndex()
+save_listeners.setdefault('recipes', []).append(recipe_index.sync)
+
+def get_recipe_index():
+    """返回与recipes集合当前版本一致的倒排索引"""
+    version = get_data_version('recipes')
+    if recipe_index.version != version:
+        recipe_index.rebuild(load_data('recipes'), version)
+    return recipe_index
+
+# 全文搜索索引（每个存储键一个，持久化在 DATA_DIR/search_index）：集合 -> 检索字段及权重
+SEARCH_FIELDS = {
+    'recipes': {'name': 3, 'ingredients': 2, 'steps': 1},
+    'hometown_recipes': {'name': 3, 'ingredients': 2, 'steps': 1},
+    'knowledge_items': {'title': 3, 'content': 1}
+}
+search_indexes = SearchIndexCache(
+    os.path.join(DATA_DIR, 'search_index'),
+    persist_delay=float(os.getenv('SEARCH_INDEX_PERSIST_SECONDS', '30'))
+)
+# 退出前写盘，下次启动时直接加载
+atexit.register(search_indexes.persist_all)
+
+def _search_index_listener(file_key):
+    """保存后增量更新内存中的搜索索引（未加载的索引下次使用时从磁盘加载或重建）"""
+    def sync(*args):
+        *partition, data, from_version, to_version = args
+        user_id = partition[0] if partition else None
+        index = search_indexes.peek(storage_key(file_key, user_id))
+        if index is not None:
+            index.sync(data, from_version, to_version, get_data_signature(file_key, user_id))
+    return sync
+
+for key in SEARCH_FIELDS:
+    save_listeners.setdefault(key, []).append(_search_index_listener(key))
+
+def get_search_index(file_key, user_id=None):
+    """返回与集合（分区）当前版本一致的搜索索引：优先加载签名一致的持久化索引，否则重建"""
+    key = storage_key(file_key, user_id)
+    index = search_indexes.get(key, SEARCH_FIELDS[file_key])
+    if index.version == get_data_version(file_key, user_id):
+        return index
+    # 在集合锁内读取版本、签名和数据，保证三者一致
+    with storage.lock(key):
+        version = get_data_version(file_key, user_id)
+        if index.version != version:
+            records = load_data(file_key, user_id)
+            signature = get_data_signature(file_key, user_id)
+            if not index.restore(records, version, signature):
+                index.rebuild(records, version, signature)
+    return index
+
+# 列表接口的有序索引（每个用户分区一个）：集合 -> 排序时间字段
+user_indexes = {
+    'knowledge_items': PartitionedUserIndex('created_at'),
+    'hometown_recipes': PartitionedUserIndex('created_at'),
+    'user_ingredients': PartitionedUserIndex('added_at'),
+    'recipe_filters': PartitionedUserIndex('created_at')
+}
+for key, index in user_indexes.items():
+    save_listeners.setdefault(key, []).append(index.sync)
+
+# 分页接口单页最多返回的记录数
+MAX_PAGE_SIZE = 100
+
+def get_user_index(file_key, user_id):
+    """返回与用户分区当前版本一致的有序索引"""
+    index = user_indexes[file_key].get(user_id)
+    version = get_data_version(file_key, user_id)
+    if index.version != version:
+        index.rebuild(load_data(file_key, user_id), version)
+    return index
+
+def user_items_page(file_key, user_id, limit=None, cursor=None):
+    """
+    按时间倒序返回用户的一页记录和下一页游标
+    SQLite后端直接用 (user_id, 时间, id) 索引查询，JSON后端使用内存中的有序索引
+    游标格式不正确时抛出 ValueError
+    """
+    if not storage.indexed_queries:
+        return get_user_index(file_key, user_id).page(user_id, limit, cursor)
+    sort_field = user_indexes[file_key].sort_field
+    after = decode_cursor(cursor) if cursor is not None else None
+    # 多取一条判断是否还有下一页
+    items = find_data(
+        file_key, user_id=user_id,
+        order_by=(sort_field, 'id'), descending=True,
+        limit=limit + 1 if limit is not None else None, after=after
+    )
+    if limit is None or len(items) <= limit:
+        return items, None
+    items = items[:limit]
+    return items, encode_cursor((items[-1].get(sort_field) or '', items[-1]['id']))
+
+def user_items_response(file_key):
+    """
+    按时间倒序返回当前用户的记录
+    带 ?limit= 或 ?cursor= 时分页，返回 {"items": [...], "next_cursor": 下一页游标或null}；
+    否则返回全部记录的列表（兼容旧接口）
+    """
+    limit = request.args.get('limit', type=int)
+    cursor = request.args.get('cursor')
+    paginated = limit is not None or cursor is not None
+    if paginated:
+        limit = max(1, min(limit or MAX_PAGE_SIZE, MAX_PAGE_SIZE))
+    try:
+        items, next_cursor = user_items_page(file_key, current_user_id(), limit, cursor)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if paginated:
+        return jsonify({'items': items, 'next_cursor': next_cursor})
+    return jsonify(items)
+
+# --- 条件请求与响应压缩 ---
+
+# 响应格式变化时修改，使客户端缓存的旧ETag失效
+RESPONSE_FORMAT_VERSION = '1'
+# 小于该字节数的响应不压缩
+COMPRESS_MIN_BYTES = int(os.getenv('COMPRESS_MIN_BYTES', '1024'))
+encoded_responses = EncodedResponseCache(int(os.getenv('ENCODED_RESPONSE_CACHE_BYTES', str(32 * 1024 * 1024))))
+
+def _response_cache_listener(file_key):
+    """集合（分区）写入后立即清除读取它的缓存响应（ETag已随数据变化，这里只是尽早释放内存）"""
+    def invalidate(*args):
+        *partition, _, _, _ = args
+        encoded_responses.invalidate(storage_key(file_key, *partition))
+    return invalidate
+
+for key in DATA_FILES:
+    save_listeners.setdefault(key, []).append(_response_cache_listener(key))
+
+def get_data_signature(file_key, user_id=None):
+    """集合（分区）的数据签名（不加载数据），与进程无关，用于计算ETag"""
+    return storage.signature(storage_key(file_key, user_id))
+
+def _conditional_headers(response, etag):
+    response.set_etag(etag)
+    response.vary.add('Accept-Encoding')
+    response.vary.add(USER_ID_HEADER)
+    # 允许浏览器缓存，但每次使用前都要用ETag向服务器确认
+    response.cache_control.no_cache = True
+    return response
+
+def _encoded_response(body, content_type, etag, encoding):
+    """返回压缩后的响应体，使用带编码后缀的ETag"""
+    response = Response(body, content_type=content_type)
+    response.headers['Content-Encoding'] = encoding
+    return _conditional_headers(response, f'{etag}-{encoding}')
+
+def conditional_json(*file_keys):
+    """
+    只读JSON接口的装饰器，file_keys为接口读取的集合（分区集合取当前用户的分区）
+    - ETag由数据签名、用户、接口名、路径参数和查询参数计算，If-None-Match匹配时直接返回304，不加载数据
+    - 序列化后的响应体按ETag缓存，数据不变时不再执行接口函数，只做一次字典查找
+    - 响应体不小于 COMPRESS_MIN_BYTES 且客户端支持时用br/gzip压缩，缓存压缩后的结果
+    - 进程内子请求（batch_dispatch）只做ETag判断，不读写响应缓存
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            user_id = current_user_id() if any(key in USER_COLLECTIONS for key in file_keys) else None
+            signatures = [get_data_signature(key, user_id) for key in file_keys]
+            etag = make_etag(
+                RESPONSE_FORMAT_VERSION, request.endpoint, user_id, sorted(kwargs.items()),
+                sorted(request.args.items(multi=True)), signatures
+            )
+            # 压缩后的表示使用带编码后缀的ETag，任一表示匹配都说明数据未变
+            variants = [etag] + [f'{etag}-{encoding}' for encoding in available_encodings()]
+            matched = next((v for v in variants if request.if_none_match.contains_weak(v)), None)
+            if matched is not None:
+                return _conditional_headers(Response(status=304), matched)
+
+            if is_sub_request(request.environ):
+                # 进程内子请求（批量请求、后台任务）不读写压缩响应缓存，缓存只服务浏览器的直接请求
+                response = app.make_response(view(*args, **kwargs))
+                if response.status_code != 200 or [get_data_signature(key, user_id) for key in file_keys] != signatures:
+                    return response
+                return _conditional_headers(response, etag)
+
+            encoding = choose_encoding(request.accept_encodings)
+            tags = [storage_key(key, user_id) for key in file_keys]
+            # 先找压缩后的响应体，再找未压缩的
+            cached = encoded_responses.get(etag, encoding) if encoding else None
+            if cached is not None:
+                RESPONSE_CACHE_HITS.inc(endpoint=request.endpoint)
+                return _encoded_response(cached[0], cached[1], etag, encoding)
+            cached = encoded_responses.get(etag, None)
+            if cached is not None:
+                RESPONSE_CACHE_HITS.inc(endpoint=request.endpoint)
+                body, content_type = cached
+                if encoding and len(body) >= COMPRESS_MIN_BYTES:
+                    # 未压缩的条目由不接受压缩的客户端写入，大响应压缩后另存一份再返回
+                    body = compress(body, encoding)
+                    encoded_responses.set(etag, encoding, body, content_type, tags)
+                    return _encoded_response(body, content_type, etag, encoding)
+                return _conditional_headers(Response(body, content_type=content_type), etag)
+
+            response = app.make_response(view(*args, **kwargs))
+            if response.status_code != 200 or response.is_streamed:
+                return response
+            if [get_data_signature(key, user_id) for key in file_keys] != signatures:
+                # 生成响应期间数据被修改，内容与ETag可能不一致，不打标签也不缓存
+                return response
+
+            body = response.get_data()
+            if encoding and len(body) >= COMPRESS_MIN_BYTES:
+                body = compress(body, encoding)
+                encoded_responses.set(etag, encoding, body, response.content_type, tags)
+                response.set_data(body)
+                response.headers['Content-Encoding'] = encoding
+                etag = f'{etag}-{encoding}'
+            else:
+                encoded_responses.set(etag, None, body, response.content_type, tags)
+            return _conditional_headers(response, etag)
+        return wrapper
+    return decorator
+
+def append_recipe(recipe):
+    """追加保存一个菜谱（倒排索引通过保存回调增量更新）"""
+    saved, _ = modify_data('recipes', lambda recipes: recipes.append(recipe))
+    return saved
 
 
 # --- 云服务客户端配置 ---
 DOUBAO_API_KEY = os.getenv("DOUBAO_API_KEY")
-DOUBAO_API_URL = "https://ark.cn-beijing.volces.com/api/v3/chat/completions"  # 豆包API实际地址可能需要调整
+DOUBAO_API_URL = os.getenv("DOUBAO_API_URL", "https://ark.cn-beijing.volces.com/api/v3/chat/completions")  # 豆包API实际地址可能需要调整
+DOUBAO_MODEL = "doubao-seed-1-6-flash-250715"
 
 # 百度语音识别配置
 BAIDU_ASR_API_KEY = os.getenv("BAIDU_ASR_API_KEY")
 BAIDU_ASR_SECRET_KEY = os.getenv("BAIDU_ASR_SECRET_KEY")
-BAIDU_ASR_TOKEN_URL = "https://aip.baidubce.com/oauth/2.0/token"
-BAIDU_ASR_URL = "https://vop.baidu.com/server_api"
-BAIDU_ASR_SERVER_URL = "https://vop.baidu.com/server_api"
+BAIDU_ASR_TOKEN_URL = os.getenv("BAIDU_ASR_TOKEN_URL", "https://aip.baidubce.com/oauth/2.0/token")
+BAIDU_ASR_URL = os.getenv("BAIDU_ASR_URL", "https://vop.baidu.com/server_api")
+BAIDU_ASR_SERVER_URL = BAIDU_ASR_URL
+
+# 上游HTTP客户端：共享keep-alive连接池、显式超时和退避重试
+UPSTREAM_READ_TIMEOUT = float(os.getenv('UPSTREAM_READ_TIMEOUT', '60'))
+upstream = UpstreamClient(
+    pool_connections=int(os.getenv('UPSTREAM_POOL_CONNECTIONS', '10')),
+    pool_maxsize=int(os.getenv('UPSTREAM_POOL_MAXSIZE', '20')),
+    connect_timeout=float(os.getenv('UPSTREAM_CONNECT_TIMEOUT', '3.05')),
+    read_timeout=UPSTREAM_READ_TIMEOUT,
+    retries=int(os.getenv('UPSTREAM_RETRIES', '2')),
+    backoff=float(os.getenv('UPSTREAM_BACKOFF', '0.3')),
+    observer=record_upstream_call
+)
+# 大模型调用线程池，限制同时进行的上游请求数
+llm_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv('LLM_CONCURRENCY', '8')),
+    thread_name_prefix='llm'
+)
+# 存储建议：每次大模型调用包含的食材数（1为逐个请求）和整个请求的截止时间（秒）
+STORAGE_TIPS_BATCH_SIZE = int(os.getenv('STORAGE_TIPS_BATCH_SIZE', '1'))
+STORAGE_TIPS_DEADLINE = float(os.getenv('STORAGE_TIPS_DEADLINE', '20'))
+
+# 存储建议缓存（data/llm_cache/storage_tips），与用户无关，按食材名+提示词版本+模型缓存
+STORAGE_TIP_PROMPT_VERSION = 'v1'  # 修改存储建议提示词时递增，旧缓存自动失效
+storage_tip_cache = LLMCache(
+    os.path.join(DATA_DIR, 'llm_cache', 'storage_tips'),
+    max_entries=int(os.getenv('LLM_CACHE_MAX_ENTRIES', '1000')),
+    ttl=float(os.getenv('LLM_CACHE_TTL', str(30 * 86400))),
+    negative_ttl=float(os.getenv('LLM_CACHE_NEGATIVE_TTL', '300'))
+)
+
+# 语音识别前的音频预处理（需要安装NumPy），设置 ASR_PREPROCESS=0 关闭
+ASR_PREPROCESS = os.getenv('ASR_PREPROCESS', '1') == '1' and audio_preprocess.is_available()
+
+# 百度接口的读取超时（秒）
+BAIDU_TOKEN_TIMEOUT = 10
+BAIDU_ASR_TIMEOUT = 30
+
+def doubao_chat(messages, **options):
+    """调用豆包对话补全接口，返回模型回复的文本内容"""
+    response = upstream.post(
+        DOUBAO_API_URL,
+        idempotent=True,
+        name=f"doubao:{DOUBAO_MODEL}",
+        headers={
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {DOUBAO_API_KEY}"
+        },
+        json={
+            "model": DOUBAO_MODEL,
+            "messages": messages,
+            **options
+        }
+    )
+    response.raise_for_status()
+    return response.json()['choices'][0]['message']['content']
+
+def doubao_chat_stream(messages, **options):
+    """以流式方式调用豆包对话补全接口，逐段产出模型回复的文本"""
+    response = upstream.post(
+        DOUBAO_API_URL,
+        idempotent=True,
+        name=f"doubao:{DOUBAO_MODEL}",
+        stream=True,
+        headers={
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {DOUBAO_API_KEY}"
+        },
+        json={
+            "model": DOUBAO_MODEL,
+            "messages": messages,
+            "stream": True,
+            **options
+        }
+    )
+    response.raise_for_status()
+    with response:
+        # chunk_size=None：数据到达即处理，不等待凑满缓冲区
+        for line in response.iter_lines(chunk_size=None):
+            # 上游同样使用SSE格式：每个事件一行 "data: {...}"，以 "data: [DONE]" 结束
+            if not line.startswith(b'data:'):
+                continue
+            payload = line[5:].strip()
+            if payload == b'[DONE]':
+                break
+            choices = json.loads(payload).get('choices') or []
+            content = choices[0].get('delta', {}).get('content') if choices else None
+            if content:
+                yield content
+
+def sse_event(event, data):
+    """格式化一条Server-Sent Events消息"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
 
 # --- 2. 数据库模型定义 ---
 
-# 原SQLAlchemy模型已转换为JSON数据结构，通过工具函数进行操作
+# 每个集合是带 'id' 字段的字典列表，通过 load_data/save_data/modify_data 读写；
+# 存储后端见 storage_backend.py（JSON文件）和 sqlite_backend.py（SQLite，索引见 COLLECTION_SCHEMAS）
 
 
 # --- 3. 百度语音识别工具函数 ---
 
+def _fetch_baidu_access_token():
+    """向百度OAuth接口请求新令牌，返回 (access_token, expires_in)"""
+    params = {
+        "grant_type": "client_credentials",
+        "client_id": BAIDU_ASR_API_KEY,
+        "client_secret": BAIDU_ASR_SECRET_KEY
+    }
+    response = upstream.post(BAIDU_ASR_TOKEN_URL, params=params, idempotent=True, timeout=BAIDU_TOKEN_TIMEOUT, name='baidu_token')
+    response.raise_for_status()
+    result = json.loads(response.text)
+    # 百度令牌有效期为30天，缺省时按1天处理
+    return result["access_token"], int(result.get("expires_in", 86400))
+
+# 百度令牌缓存（data/baidu_token.json），过期前后台刷新
+baidu_token_manager = TokenManager(
+    _fetch_baidu_access_token,
+    cache_path=os.path.join(DATA_DIR, 'baidu_token.json')
+)
+
 def get_baidu_access_token():
-    """获取百度API访问令牌"""
+    """获取百度API访问令牌（使用缓存）"""
     try:
-        params = {
-            "grant_type": "client_credentials",
-            "client_id": BAIDU_ASR_API_KEY,
-            "client_secret": BAIDU_ASR_SECRET_KEY
-        }
-        response = requests.post(BAIDU_ASR_TOKEN_URL, params=params)
-        response.raise_for_status()
-        return json.loads(response.text)["access_token"]
+        return baidu_token_manager.get_token()
     except Exception as e:
         app.logger.error(f"获取百度访问令牌失败: {e}")
         raise Exception(f"获取访问令牌失败: {str(e)}")
 
-def baidu_speech_recognition(audio_data, sample_rate):
+def base64_decoded_length(speech):
+    """不解码直接由Base64字符串计算原始数据长度"""
+    speech = speech.rstrip()
+    return len(speech) * 3 // 4 - (len(speech) - len(speech.rstrip('=')))
+
+def baidu_speech_recognition(audio_data, sample_rate, speech_base64=None):
     """
     使用百度语音识别API识别音频
-    audio_data: 音频二进制数据
+    audio_data: 音频二进制数据（bytes或SizedStream），以原始PCM请求体上传（百度raw模式），不做Base64编码
     sample_rate: 采样率，百度推荐8000
+    speech_base64: 客户端已经是Base64编码的音频时传入，原样转发（百度JSON模式），audio_data可为None
     """
     try:
         # 获取访问令牌
         token = get_baidu_access_token()
         app.logger.info("成功获取百度访问令牌")
-        
-        # 对音频数据进行Base64编码
-        speech = base64.b64encode(audio_data).decode("utf-8")
-        length = len(audio_data)
+
+        if speech_base64 is not None:
+            length = base64_decoded_length(speech_base64)
+        else:
+            length = len(audio_data)
+        # 流式上传的请求体只能发送一次，不能重试
+        can_resend = speech_base64 is not None or isinstance(audio_data, bytes)
         
         app.logger.info(f"音频数据长度: {length} 字节")
-        
-        # 构造请求参数
-        params = {
-            "format": "pcm",  # PCM格式
-            "rate": sample_rate,  # 采样率
-            "channel": 1,  # 单声道
-            "cuid": "cooking_app",  # 设备唯一标识，可自定义
-            "token": token,
-            "speech": speech,
-            "len": length,
-            "dev_pid": 1537  # 普通话识别模型，提高识别准确率
-        }
-        
-        app.logger.info(f"发送请求到百度API，参数: {list(params.keys())}")
+
+        def send(token):
+            if speech_base64 is not None:
+                # 构造请求参数
+                params = {
+                    "format": "pcm",  # PCM格式
+                    "rate": sample_rate,  # 采样率
+                    "channel": 1,  # 单声道
+                    "cuid": "cooking_app",  # 设备唯一标识，可自定义
+                    "token": token,
+                    "speech": speech_base64,
+                    "len": length,
+                    "dev_pid": 1537  # 普通话识别模型，提高识别准确率
+                }
+                return upstream.post(BAIDU_ASR_URL, json=params, idempotent=True, timeout=BAIDU_ASR_TIMEOUT, name='baidu_asr')
+            # raw模式：参数放在URL中，音频作为请求体
+            return upstream.post(
+                BAIDU_ASR_URL,
+                params={"cuid": "cooking_app", "token": token, "dev_pid": 1537},
+                data=audio_data,
+                headers={"Content-Type": f"audio/pcm;rate={sample_rate}"},
+                idempotent=can_resend,
+                timeout=BAIDU_ASR_TIMEOUT,
+                name='baidu_asr'
+            )
         
         # 发送识别请求
-        response = requests.post(BAIDU_ASR_URL, json=params, timeout=30)
+        response = send(token)
         response.raise_for_status()
         result = json.loads(response.text)
+
+        # 缓存的令牌被百度判定无效（3302 鉴权失败）时重新获取令牌再试一次
+        if result.get("err_no") == 3302:
+            baidu_token_manager.invalidate()
+            if can_resend:
+                app.logger.warning("百度令牌鉴权失败，刷新令牌后重试")
+                response = send(get_baidu_access_token())
+                response.raise_for_status()
+                result = json.loads(response.text)
         
-        app.logger.info(f"百度API响应: {result}")
+        app.logger.debug(f"百度API响应: {result}")
         
         # 处理识别结果
         if result.get("err_no") == 0 and "result" in result:
@@ -170,7 +746,6 @@ def create_manual_recipe():
     data = request.get_json()
     if not all(k in data for k in ['name', 'ingredients', 'steps']):
         return jsonify({'error': '缺少必要字段'}), 400
-    recipes = load_data('recipes')
     new_recipe = {
         'id': get_next_id('recipes'),
         'name': data['name'],
@@ -180,47 +755,77 @@ def create_manual_recipe():
         'created_at': datetime.utcnow().isoformat()
     }
     
-    recipes.append(new_recipe)
-    if save_data('recipes', recipes):
+    if append_recipe(new_recipe):
         return jsonify({'message': '菜谱创建成功!', 'recipe': new_recipe}), 201
     else:
         return jsonify({'error': '保存菜谱失败'}), 500
 
+def ai_recipe_messages(ingredients):
+    """AI菜谱生成的提示词"""
+    ingredients_text = ", ".join(ingredients)
+    return [
+        {"role": "system", "content": "你是一位富有创意但又注重安全的美食家。你的任务是根据用户提供的食材，创作一个“能吃且略带荒诞感”的创意菜谱。你的回答必须是一个结构完整的 JSON 对象，包含 `name`, `ingredients`, `steps` 三个字段，不要在 JSON 对象之外添加任何说明、注释或 Markdown 标记。"},
+        {"role": "user", "content": f"请根据以下食材：[{ingredients_text}]，创作一个菜谱。"}
+    ]
+
+def wants_event_stream():
+    """客户端是否请求SSE流式响应（?stream=1 或 Accept: text/event-stream）"""
+    return (request.args.get('stream') in ('1', 'true')
+            or 'text/event-stream' in request.headers.get('Accept', ''))
+
+def stream_ai_recipe(messages):
+    """
+    以SSE转发豆包的流式输出并增量解析菜谱JSON：
+    - field: 顶层字段完整时发送 {"field": 字段名, "value": 值}
+    - item: 数组字段（如steps）每完成一个元素发送 {"field", "index", "value"}
+    - done: 生成结束并保存到recipes.json后发送完整菜谱
+    - error: 调用或解析失败
+    """
+    def generate():
+        parser = StreamingObjectParser()
+        try:
+            for content in doubao_chat_stream(messages):
+                for event in parser.feed(content):
+                    if event[0] == 'field':
+                        yield sse_event('field', {'field': event[1], 'value': event[2]})
+                    else:
+                        yield sse_event('item', {'field': event[1], 'index': event[2], 'value': event[3]})
+
+            # 保存生成的菜谱
+            recipe_data = parse_model_json(parser.text)
+            recipe_data['id'] = get_next_id('recipes')
+            recipe_data['source'] = 'ai'
+            recipe_data['created_at'] = datetime.utcnow().isoformat()
+            append_recipe(recipe_data)
+            yield sse_event('done', recipe_data)
+        except Exception as e:
+            app.logger.error(f"豆包模型流式调用失败: {e}")
+            yield sse_event('error', {'error': '大模型调用失败'})
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
 @app.route('/api/recipe/ai_generate', methods=['POST'])
 def generate_ai_recipe():
     data = request.get_json()
     if not data or not data.get('ingredients'):
         return jsonify({'error': '食材列表不能为空'}), 400
     
-    ingredients_text = ", ".join(data['ingredients'])
-    messages = [
-        {"role": "system", "content": "你是一位富有创意但又注重安全的美食家。你的任务是根据用户提供的食材，创作一个“能吃且略带荒诞感”的创意菜谱。你的回答必须是一个结构完整的 JSON 对象，包含 `name`, `ingredients`, `steps` 三个字段，不要在 JSON 对象之外添加任何说明、注释或 Markdown 标记。"},
-        {"role": "user", "content": f"请根据以下食材：[{ingredients_text}]，创作一个菜谱。"}
-    ]
+    messages = ai_recipe_messages(data['ingredients'])
+    if wants_event_stream():
+        return stream_ai_recipe(messages)
     
     try:
-        response = requests.post(
-            DOUBAO_API_URL,
-            headers={
-                "Content-Type": "application/json",
-                "Authorization": f"Bearer {DOUBAO_API_KEY}"
-            },
-            json={
-                "model": "doubao-seed-1-6-flash-250715",
-                "messages": messages,
-                "stream": False
-            }
-        )
-        response.raise_for_status()
-        recipe_data = json.loads(response.json()['choices'][0]['message']['content'])
+        recipe_data = json.loads(doubao_chat(messages, stream=False))
                 
         # 保存生成的菜谱
-        recipes = load_data('recipes')
         recipe_data['id'] = get_next_id('recipes')
         recipe_data['source'] = 'ai'
         recipe_data['created_at'] = datetime.utcnow().isoformat()
-        recipes.append(recipe_data)
-        save_data('recipes', recipes)
+        append_recipe(recipe_data)
 
         return jsonify(recipe_data), 200
     except Exception as e:
@@ -232,21 +837,15 @@ def recommend_recipe():
     data = request.get_json()
     user_ingredients = data.get('ingredients', [])
     if not user_ingredients: return jsonify([]), 200
+    # 最多返回的结果数，默认10个；不是整数时按默认值处理（与分页接口的 ?limit= 一致）
+    try:
+        limit = int(data.get('limit', 10))
+    except (TypeError, ValueError):
+        limit = 10
+    limit = max(1, min(limit, 50))
 
-    # 从JSON文件加载所有菜谱
-    all_recipes = load_data('recipes')
-    matched_recipes = []
-
-    # 筛选包含任一用户食材的菜谱
-    for recipe in all_recipes:
-        recipe_ingredients = recipe.get('ingredients', [])
-        # 检查是否有交集
-        if any(ingredient in recipe_ingredients for ingredient in user_ingredients):
-            matched_recipes.append(recipe)
-            # 限制最多10个结果
-            if len(matched_recipes) >= 10:
-                break
-
+    # 通过倒排索引找出包含任一用户食材的菜谱，按匹配程度取前limit个
+    matched_recipes = get_recipe_index().top_k(user_ingredients, limit)
     return jsonify(matched_recipes), 200
 
 # === 百度API代理模块 ===
@@ -260,26 +859,77 @@ def get_baidu_token_proxy():
         app.logger.error(f"百度令牌代理失败: {e}")
         return jsonify({'error': str(e)}), 500
 
+def uploaded_audio_stream(file_storage):
+    """把上传的音频文件包装为带长度的流，直接转发给百度而不读入内存"""
+    stream = file_storage.stream
+    stream.seek(0, os.SEEK_END)
+    length = stream.tell()
+    stream.seek(0)
+    return SizedStream(stream, length)
+
+def prepare_asr_audio(audio_data, sample_rate, channels=1):
+    """
+    发送百度前预处理音频：静音裁剪、混合为单声道、重采样为16000/8000
+    返回 (音频bytes, 采样率, 统计信息)；预处理失败时原样返回，统计信息为None
+    """
+    try:
+        audio, rate, stats = preprocess_pcm(audio_data, sample_rate, channels)
+        app.logger.info(f"音频预处理完成，节省 {stats['saved_bytes']} 字节，裁剪静音 {stats['trimmed_ms']} 毫秒")
+        return audio, rate, stats
+    except Exception as e:
+        app.logger.warning(f"音频预处理失败，使用原始音频: {e}")
+        return audio_data, sample_rate, None
+
 @app.route('/api/baidu/asr', methods=['POST'])
 def baidu_asr_proxy():
+    """
+    语音识别代理，支持三种上传方式：
+    - JSON：{"speech": Base64音频, "rate": 采样率, "channel": 声道数}
+    - application/octet-stream 或 audio/pcm：请求体为原始PCM，采样率和声道数由 ?rate=&channel= 指定
+    - multipart/form-data：audio 文件字段 + rate/channel 表单字段
+    启用音频预处理（ASR_PREPROCESS）时先裁剪静音并重采样再以raw模式发送；
+    未启用时JSON中的Base64原样转发，二进制上传直接流式转发
+    """
     try:
-        # 获取请求参数
-        data = request.get_json()
+        speech_base64 = None
+        if request.is_json:
+            # 获取请求参数
+            data = request.get_json()
+            speech_base64 = data['speech']
+            audio_length = base64_decoded_length(speech_base64)
+        elif request.files.get('audio'):
+            data = request.form
+            audio = uploaded_audio_stream(request.files['audio'])
+            audio_length = len(audio)
+        else:
+            data = request.args
+            audio_length = request.content_length or 0
+            if not audio_length:
+                return jsonify({'error': '缺少音频数据'}), 400
+            audio = SizedStream(request.stream, audio_length)
         # 新增：获取前端传递的采样率
-        sample_rate = data.get('rate', 16000)  # 默认为16000
-
-        # 解码前端传递的Base64音频数据
-        audio_data = base64.b64decode(data['speech'])
-        
-        # 调用百度语音识别函数，传入正确的采样率
-        recognized_text = baidu_speech_recognition(audio_data, sample_rate)
+        sample_rate = int(data.get('rate', 16000))  # 默认为16000
+        channels = int(data.get('channel', 1))
+
+        preprocess_stats = None
+        if ASR_PREPROCESS:
+            raw = base64.b64decode(speech_base64) if speech_base64 is not None else audio.read()
+            audio, sample_rate, preprocess_stats = prepare_asr_audio(raw, sample_rate, channels)
+            audio_length = len(audio)
+            recognized_text = baidu_speech_recognition(audio, sample_rate)
+        elif speech_base64 is not None:
+            recognized_text = baidu_speech_recognition(None, sample_rate, speech_base64=speech_base64)
+        else:
+            recognized_text = baidu_speech_recognition(audio, sample_rate)
         
         response_data = {
             'text': recognized_text,
             'debug_info': {
-                'received_params': f'rate={sample_rate}, format=pcm, dev_pid={data.get("dev_pid", 1537)}',
+                'received_params': f'rate={data.get("rate", 16000)}, format=pcm, dev_pid={data.get("dev_pid", 1537)}',
                 'api_url': f'{BAIDU_ASR_URL}?dev_pid={data.get("dev_pid", 1537)}&cuid={data.get("cuid", "forbites")}',
-                'audio_length': len(audio_data)
+                'audio_length': audio_length,
+                'sent_rate': sample_rate,
+                'preprocess': preprocess_stats
             }
         }
         return jsonify(response_data), 200
@@ -288,6 +938,12 @@ def baidu_asr_proxy():
         # 错误响应：仅在失败时返回error
         return jsonify({'error': str(e)}), 500
 
+# === 监控模块 ===
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    """Prometheus文本格式的指标"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 # === 配置模块 ===
 @app.route('/api/config/keys', methods=['GET'])
 def get_api_keys():
@@ -306,45 +962,47 @@ def add_pantry_items():
     items_to_add = data.get('items', [])
     if not items_to_add: return jsonify({'error': '物品列表为空'}), 400
 
-    # 加载现有 pantry 数据
-    pantry_items = load_data('pantry_items')
-    updated = False
+    user_id = current_user_id()
+
+    def add_items(pantry_items):
+        existing_keys = {(item.get('name'), item.get('item_type')) for item in pantry_items}
+
+        new_items = []
+        for item_data in items_to_add:
+            key = (item_data['name'], item_data['item_type'])
+            if key not in existing_keys:
+                new_items.append({
+                    'user_id': user_id,
+                    'name': item_data['name'],
+                    'item_type': item_data['item_type'],
+                    'quantity': item_data.get('quantity'),
+                    'created_at': datetime.utcnow().isoformat()
+                })
+                existing_keys.add(key)
+        if not new_items:
+            raise LookupError('无新物品添加')
+
+        # 一次性为所有新物品分配ID
+        for new_id, new_item in zip(reserve_ids('pantry_items', len(new_items)), new_items):
+            pantry_items.append({'id': new_id, **new_item})
 
-    for item_data in items_to_add:
-        exists = any(
-            item.get('user_id') == 1 and
-            item.get('name') == item_data['name'] and
-            item.get('item_type') == item_data['item_type']
-            for item in pantry_items
-        )
-        
-        if not exists:
-            new_item = {
-                'id': get_next_id('pantry_items'),
-                'user_id': 1,
-                'name': item_data['name'],
-                'item_type': item_data['item_type'],
-                'quantity': item_data.get('quantity'),
-                'created_at': datetime.utcnow().isoformat()
-            }
-            pantry_items.append(new_item)
-            updated = True
-
-    if updated and save_data('pantry_items', pantry_items):
+    try:
+        saved, _ = modify_data('pantry_items', add_items, user_id)
+    except LookupError:
+        saved = False
+    if saved:
         return jsonify({'message': '物品已保存'}), 201
     return jsonify({'error': '保存失败或无新物品添加'}), 500
 
 @app.route('/api/pantry/items', methods=['GET'])
+@conditional_json('pantry_items')
 def get_pantry_items():
     item_type = request.args.get('type')
-    all_items = load_data('pantry_items')
-    user_items = [item for item in all_items if item.get('user_id') == 1]
-
+    where = {}
     # 按类型筛选
     if item_type in ['seasoning', 'ingredient']:
-        user_items = [item for item in user_items if item.get('item_type') == item_type]
-
-    return jsonify(user_items)
+        where['item_type'] = item_type
+    return jsonify(find_data('pantry_items', where, user_id=current_user_id()))
 
 @app.route('/api/pantry/voice_recognize', methods=['POST'])
 def voice_recognize():
@@ -359,12 +1017,15 @@ def voice_recognize():
         if not BAIDU_ASR_API_KEY or not BAIDU_ASR_SECRET_KEY:
             return jsonify({'error': '百度API密钥未配置，请在.env文件中配置BAIDU_ASR_API_KEY和BAIDU_ASR_SECRET_KEY'}), 500
         
-        # 读取音频文件内容
-        audio_data = audio_file.read()
-        app.logger.info(f"接收到音频文件，大小: {len(audio_data)} 字节")
+        # 音频文件直接流式转发，采样率由 rate 表单字段指定（默认16000）
+        audio = uploaded_audio_stream(audio_file)
+        sample_rate = int(request.form.get('rate', 16000))
+        app.logger.info(f"接收到音频文件，大小: {len(audio)} 字节")
+        if ASR_PREPROCESS:
+            audio, sample_rate, _ = prepare_asr_audio(audio.read(), sample_rate, int(request.form.get('channel', 1)))
         
         # 调用百度语音识别
-        result_text = baidu_speech_recognition(audio_data)
+        result_text = baidu_speech_recognition(audio, sample_rate)
         
         app.logger.info(f"语音识别成功，结果: {result_text}")
         return jsonify({'text': result_text})
@@ -372,74 +1033,158 @@ def voice_recognize():
         app.logger.error(f"语音识别失败: {e}")
         return jsonify({'error': str(e)}), 500
 
+STORAGE_TIP_FALLBACK = {"method": "暂无建议", "duration": "N/A"}
+STORAGE_TIP_SYSTEM_PROMPT = "你是一位专业的食品保鲜专家。请严格按照用户要求的JSON格式返回。"
+
+def fetch_storage_tip(ingredient):
+    """请求单个食材的存储建议"""
+    prompt = f"请为“{ingredient}”提供科学的存储建议，包括存储方法和大致的保存期限。返回一个JSON对象，包含 'method' 和 'duration' 两个字段。"
+    messages = [{"role": "system", "content": STORAGE_TIP_SYSTEM_PROMPT}, {"role": "user", "content": prompt}]
+    return {ingredient: json.loads(doubao_chat(messages))}
+
+def fetch_storage_tips_batch(ingredients):
+    """一次请求多个食材的存储建议，按食材名拆分结果；缺失或格式不对的食材不出现在结果中"""
+    if len(ingredients) == 1:
+        return fetch_storage_tip(ingredients[0])
+    names = "、".join(f"“{i}”" for i in ingredients)
+    prompt = f"请分别为以下食材提供科学的存储建议，包括存储方法和大致的保存期限：{names}。返回一个JSON对象，键为食材名称（与给出的名称完全一致），值为包含 'method' 和 'duration' 两个字段的JSON对象。"
+    messages = [{"role": "system", "content": STORAGE_TIP_SYSTEM_PROMPT}, {"role": "user", "content": prompt}]
+    result = json.loads(doubao_chat(messages))
+    return {
+        ingredient: result[ingredient]
+        for ingredient in ingredients
+        if isinstance(result.get(ingredient), dict)
+    }
+
+def storage_tip_cache_key(ingredient):
+    return make_cache_key(DOUBAO_MODEL, STORAGE_TIP_PROMPT_VERSION, ingredient)
+
+def fetch_storage_tips_cached(ingredients):
+    """
+    在线程池中执行：请求一组食材的建议并写入缓存，失败的食材写入负缓存
+    超过截止时间才返回的结果同样会被缓存，供下次请求使用
+    """
+    try:
+        tips = fetch_storage_tips_batch(ingredients)
+    except Exception as e:
+        app.logger.error(f"获取存储建议失败: {e}")
+        tips = {}
+    for ingredient in ingredients:
+        if ingredient in tips:
+            storage_tip_cache.set(storage_tip_cache_key(ingredient), tips[ingredient])
+        else:
+            storage_tip_cache.set_negative(storage_tip_cache_key(ingredient))
+    return tips
+
 @app.route('/api/pantry/storage_tips', methods=['POST'])
 def get_storage_tips():
+    """
+    获取食材存储建议
+    先查缓存；未命中的食材按 batch_size 分组（每组一次大模型调用），各组并发请求；
+    超过截止时间仍未返回或近期请求失败的食材使用默认建议
+    """
     data = request.get_json()
     ingredients = data.get('ingredients', [])
     if not ingredients: return jsonify({}), 200
-    
+
     tips = {}
-    for ingredient in ingredients:
-        prompt = f"请为“{ingredient}”提供科学的存储建议，包括存储方法和大致的保存期限。返回一个JSON对象，包含 'method' 和 'duration' 两个字段。"
-        messages = [{"role": "system", "content": "你是一位专业的食品保鲜专家。请严格按照用户要求的JSON格式返回。"}, {"role": "user", "content": prompt}]
-        
+    missing = []
+    for ingredient in dict.fromkeys(ingredients):
+        hit, tip = storage_tip_cache.get(storage_tip_cache_key(ingredient))
+        if not hit:
+            missing.append(ingredient)
+        elif tip is not None:
+            tips[ingredient] = tip
+
+    try:
+        batch_size = int(data.get('batch_size', STORAGE_TIPS_BATCH_SIZE))
+    except (TypeError, ValueError):
+        batch_size = STORAGE_TIPS_BATCH_SIZE
+    batch_size = max(1, batch_size)
+    batches = [missing[i:i + batch_size] for i in range(0, len(missing), batch_size)]
+
+    futures = [llm_executor.submit(fetch_storage_tips_cached, batch) for batch in batches]
+    done, not_done = wait(futures, timeout=STORAGE_TIPS_DEADLINE) if futures else (set(), set())
+    for future in not_done:
+        future.cancel()
+    if not_done:
+        app.logger.warning(f"存储建议请求超时，{len(not_done)} 组食材使用默认建议")
+
+    for future in done:
         try:
-            response = requests.post(
-                DOUBAO_API_URL,
-                headers={
-                    "Content-Type": "application/json",
-                    "Authorization": f"Bearer {DOUBAO_API_KEY}"
-                },
-                json={
-                    "model": "doubao-seed-1-6-flash-250715",
-                    "messages": messages
-                }
-            )
-            response.raise_for_status()
-            tips[ingredient] = json.loads(response.json()['choices'][0]['message']['content'])
-        except Exception:
-            tips[ingredient] = {"method": "暂无建议", "duration": "N/A"}
-    return jsonify(tips)
+            tips.update(future.result())
+        except Exception as e:
+            app.logger.error(f"获取存储建议失败: {e}")
+    return jsonify({
+        ingredient: tips.get(ingredient, dict(STORAGE_TIP_FALLBACK))
+        for ingredient in ingredients
+    })
+
+@app.route('/api/cache/stats', methods=['GET'])
+def get_cache_stats():
+    """大模型响应缓存的命中统计"""
+    return jsonify({'storage_tips': storage_tip_cache.stats()})
 
 # === “社区”模块 ===
+# 最后的兜底问题列表，仅在上游失败且没有任何缓存时使用
+COMMUNITY_FALLBACK_QUESTIONS = ["在挪威三文鱼怎么做好吃？", "哪里可以买到亚洲调料？", "挪威的蔬菜保质期为什么这么短？", "挪威的肉类推荐做法？", "Brunost（棕色奶酪）可以用来做什么菜？"]
+COMMUNITY_PROMPT_VERSION = 'v1'
+
+# 社区问题缓存：新鲜期内直接返回，过期后先返回旧结果再后台刷新
+community_questions_cache = StaleWhileRevalidate(
+    LLMCache(
+        os.path.join(DATA_DIR, 'llm_cache', 'community_questions'),
+        max_entries=200,
+        ttl=float(os.getenv('COMMUNITY_CACHE_MAX_STALE', str(7 * 86400)))
+    ),
+    llm_executor,
+    fresh_for=float(os.getenv('COMMUNITY_CACHE_FRESH', '3600'))
+)
+
+def collect_llm_cache_stats():
+    """大模型响应缓存的统计，供指标输出"""
+    values = {}
+    for cache_name, cache in (('storage_tips', storage_tip_cache),
+                              ('community_questions', community_questions_cache.cache)):
+        for stat, value in cache.stats().items():
+            values[(cache_name, stat)] = value
+    return values
+
+metrics.gauge_callback('forbites_llm_cache', '大模型响应缓存统计（命中、未命中、淘汰等）', ('cache', 'stat'), collect_llm_cache_stats)
+
+def fetch_community_questions(country):
+    """请求大模型生成指定国家华人社区的热门做菜问题"""
+    prompt = f"你是一位美食社区的数据分析师。请分析并返回在“{country}”的华人社区中，关于做菜访问量最高的5-7个问题。返回一个JSON数组，数组中的每个元素都是一个问题字符串。"
+    messages = [{"role": "system", "content": "请严格按照用户要求的JSON数组格式返回。"}, {"role": "user", "content": prompt}]
+    questions = json.loads(doubao_chat(messages))
+    if not isinstance(questions, list):
+        raise ValueError('社区问题格式错误')
+    return questions
+
 @app.route('/api/community/questions', methods=['GET'])
 def get_community_questions():
     country = request.args.get('country', '挪威')
-    prompt = f"你是一位美食社区的数据分析师。请分析并返回在“{country}”的华人社区中，关于做菜访问量最高的5-7个问题。返回一个JSON数组，数组中的每个元素都是一个问题字符串。"
-    messages = [{"role": "system", "content": "请严格按照用户要求的JSON数组格式返回。"}, {"role": "user", "content": prompt}]
-    
     try:
-        response = requests.post(
-            DOUBAO_API_URL,
-            headers={
-                "Content-Type": "application/json",
-                "Authorization": f"Bearer {DOUBAO_API_KEY}"
-            },
-            json={
-                "model": "doubao-seed-1-6-flash-250715",
-                "messages": messages
-            }
+        questions = community_questions_cache.get(
+            make_cache_key(DOUBAO_MODEL, COMMUNITY_PROMPT_VERSION, country),
+            lambda: fetch_community_questions(country),
+            timeout=UPSTREAM_READ_TIMEOUT
         )
-        response.raise_for_status()
-        questions = json.loads(response.json()['choices'][0]['message']['content'])
         return jsonify(questions)
-    except Exception:
-        return jsonify(["在挪威三文鱼怎么做好吃？", "哪里可以买到亚洲调料？", "挪威的蔬菜保质期为什么这么短？", "挪威的肉类推荐做法？", "Brunost（棕色奶酪）可以用来做什么菜？"]), 200
+    except Exception as e:
+        app.logger.error(f"获取社区问题失败: {e}")
+        return jsonify(COMMUNITY_FALLBACK_QUESTIONS), 200
 
 # === “tips”模块 ===
 @app.route('/api/tips', methods=['GET'])
+@conditional_json('tip_items')
 def get_tips():
     tip_type = request.args.get('type')
     context = request.args.get('context', 'norway')
     if not tip_type: return jsonify({'error': '缺少 type 参数'}), 400
 
-    # 从JSON加载并筛选tips
-    all_tips = load_data('tip_items')
-    filtered_tips = [
-        tip for tip in all_tips
-        if tip.get('tip_type') == tip_type and tip.get('context') == context
-    ]
-    return jsonify(filtered_tips)
+    # 按 (tip_type, context) 筛选tips
+    return jsonify(find_data('tip_items', {'tip_type': tip_type, 'context': context}))
 
 # === 用户位置管理 ===
 # @app.route('/api/user/location', methods=['GET'])
@@ -461,38 +1206,106 @@ def set_user_location():
     if not location_value:
         return jsonify({'error': '位置信息不能为空'}), 400
     
-    locations = load_data('user_locations')
-    # 查找现有记录
-    user_location = next(
-        (loc for loc in locations if loc.get('user_id') == 1),
-        None
-    )
-
-    if user_location:
-        user_location['location'] = location_value
-        user_location['updated_at'] = datetime.utcnow().isoformat()
-    else:
-        new_location = {
-            'id': get_next_id('user_locations'),
-            'user_id': 1,
-            'location': location_value,
-            'created_at': datetime.utcnow().isoformat()
-        }
-        locations.append(new_location)
+    user_id = current_user_id()
+
+    def update_location(locations):
+        # 查找现有记录（分区中只有当前用户的位置）
+        user_location = next(iter(locations), None)
+
+        if user_location:
+            # 替换为新字典而不是原地修改，日志存储据此识别更新
+            locations[locations.index(user_location)] = {
+                **user_location,
+                'location': location_value,
+                'updated_at': datetime.utcnow().isoformat()
+            }
+        else:
+            new_location = {
+                'id': get_next_id('user_locations'),
+                'user_id': user_id,
+                'location': location_value,
+                'created_at': datetime.utcnow().isoformat()
+            }
+            locations.append(new_location)
     
-    if save_data('user_locations', locations):
+    saved, _ = modify_data('user_locations', update_location, user_id)
+    if saved:
         return jsonify({'message': '位置设置成功', 'location': location_value})
     return jsonify({'error': '保存位置失败'}), 500
 
+# === 图片存储 ===
+# 知识库图片按内容哈希保存在 DATA_DIR/blobs，记录中只保留 /api/blobs/<hash> 引用
+blob_store = BlobStore(os.path.join(DATA_DIR, 'blobs'))
+MAX_IMAGE_BYTES = int(os.getenv('MAX_IMAGE_BYTES', str(10 * 1024 * 1024)))
+BLOB_URL_PREFIX = '/api/blobs/'
+
+def externalize_image(image):
+    """
+    把data URL图片存入blob存储并返回引用URL；其他值（已有的URL、None）原样返回
+    不是PNG/JPEG/GIF/WebP时抛出 UnsupportedImageType，图片超过 MAX_IMAGE_BYTES 时抛出 ValueError
+    """
+    parsed = parse_data_url(image)
+    if parsed is None:
+        return image
+    content_type, content = parsed
+    content_type = content_type.lower()
+    if content_type not in IMAGE_CONTENT_TYPES:
+        raise UnsupportedImageType('只支持 PNG、JPEG、GIF、WebP 格式的图片')
+    if len(content) > MAX_IMAGE_BYTES:
+        raise ValueError(f'图片不能超过 {MAX_IMAGE_BYTES // (1024 * 1024)}MB')
+    return BLOB_URL_PREFIX + blob_store.put(content, content_type)
+
+@app.route('/api/blobs/<digest>', methods=['GET'])
+def get_blob(digest):
+    """按内容哈希返回图片，内容不可变，可长期缓存；支持ETag和Range请求"""
+    meta = blob_store.meta(digest)
+    if meta is None:
+        abort(404)
+    response = send_file(
+        blob_store.path(digest),
+        # 早期保存的非图片类型按二进制下载返回，不让浏览器按声明的类型渲染
+        mimetype=meta['content_type'] if meta['content_type'] in IMAGE_CONTENT_TYPES else 'application/octet-stream',
+        etag=digest,
+        max_age=365 * 86400
+    )
+    response.cache_control.immutable = True
+    response.headers['X-Content-Type-Options'] = 'nosniff'
+    return response
+
+def migrate_knowledge_images():
+    """把知识库中内嵌的data URL图片迁移到blob存储"""
+    def migrate(items):
+        migrated = 0
+        for i, item in enumerate(items):
+            image = item.get('image')
+            try:
+                reference = externalize_image(image)
+            except ValueError:
+                # 不允许的类型或过大的图片保留原样，不存入blob存储
+                continue
+            if reference is not image:
+                items[i] = {**item, 'image': reference}
+                migrated += 1
+        if not migrated:
+            raise LookupError('没有需要迁移的图片')
+        return migrated
+
+    total = 0
+    for user_id in list_user_ids('knowledge_items'):
+        try:
+            _, migrated = modify_data('knowledge_items', migrate, user_id)
+            total += migrated
+        except LookupError:
+            pass
+    if total:
+        print(f"已迁移 {total} 张知识库图片到blob存储")
+
 # === 知识库管理 ===
 @app.route('/api/knowledge/items', methods=['GET'])
+@conditional_json('knowledge_items')
 def get_knowledge_items():
-    """获取知识库项目"""
-    items = load_data('knowledge_items')
-    # 筛选user_id=1并按创建时间降序
-    user_items = [item for item in items if item.get('user_id') == 1]
-    user_items.sort(key=lambda x: x.get('created_at', ''), reverse=True)
-    return jsonify(user_items)
+    """获取知识库项目（按创建时间降序，支持 ?limit=&cursor= 分页）"""
+    return user_items_response('knowledge_items')
 
 
 @app.route('/api/knowledge/items', methods=['POST'])
@@ -511,20 +1324,28 @@ def create_knowledge_item():
     except ValueError:
         date_str = datetime.now().date().isoformat()
     
-    # 加载现有数据
-    knowledge_items = load_data('knowledge_items')
+    # 图片单独存入blob存储，记录中只保存引用
+    try:
+        image = externalize_image(data.get('image'))
+    except UnsupportedImageType as e:
+        return jsonify({'error': str(e)}), 400
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 413
+
     new_item = {
         'id': get_next_id('knowledge_items'),
-        'user_id': 1,
+        'user_id': current_user_id(),
         'title': data['title'],
         'content': data['content'],
-        'image': data.get('image'),
+        'image': image,
         'date': date_str,
         'created_at': datetime.utcnow().isoformat()
     }
     
-    knowledge_items.append(new_item)
-    if save_data('knowledge_items', knowledge_items):
+    saved, _ = modify_data(
+        'knowledge_items', lambda knowledge_items: knowledge_items.append(new_item), new_item['user_id']
+    )
+    if saved:
         return jsonify({'message': '知识项目创建成功', 'item': new_item}), 201
     return jsonify({'error': '保存知识项目失败'}), 500
 
@@ -532,26 +1353,20 @@ def create_knowledge_item():
 @app.route('/api/knowledge/items/<int:item_id>', methods=['DELETE'])
 def delete_knowledge_item(item_id):
     """删除知识库项目"""
-    items = load_data('knowledge_items')
-    # 筛选保留非目标项（user_id=1且id匹配）
-    filtered_items = [
-        item for item in items
-        if not (item.get('id') == item_id and item.get('user_id') == 1)
-    ]
-    
-    if len(filtered_items) < len(items) and save_data('knowledge_items', filtered_items):
+    try:
+        saved, _ = modify_data('knowledge_items', lambda items: _remove_item(items, item_id), current_user_id())
+    except LookupError:
+        saved = False
+    if saved:
         return jsonify({'message': '项目删除成功'})
     return jsonify({'error': '项目不存在或删除失败'}), 404
 
 # === 家乡菜谱管理 ===
 @app.route('/api/hometown/recipes', methods=['GET'])
+@conditional_json('hometown_recipes')
 def get_hometown_recipes():
-    """获取家乡菜谱"""
-    recipes = load_data('hometown_recipes')
-    # 筛选user_id=1并按创建时间降序
-    user_recipes = [r for r in recipes if r.get('user_id') == 1]
-    user_recipes.sort(key=lambda x: x.get('created_at', ''), reverse=True)
-    return jsonify(user_recipes)
+    """获取家乡菜谱（按创建时间降序，支持 ?limit=&cursor= 分页）"""
+    return user_items_response('hometown_recipes')
 
 
 @app.route('/api/hometown/recipes', methods=['POST'])
@@ -561,18 +1376,17 @@ def create_hometown_recipe():
     if not all(k in data for k in ['name', 'ingredients', 'steps']):
         return jsonify({'error': '菜谱名称、食材和步骤不能为空'}), 400
     
-    recipes = load_data('hometown_recipes')
     new_recipe = {
         'id': get_next_id('hometown_recipes'),
-        'user_id': 1,
+        'user_id': current_user_id(),
         'name': data['name'],
         'ingredients': data['ingredients'],  # 直接存储列表（原代码用json.dumps，这里简化为列表）
         'steps': data['steps'],
         'created_at': datetime.utcnow().isoformat()
     }
     
-    recipes.append(new_recipe)
-    if save_data('hometown_recipes', recipes):
+    saved, _ = modify_data('hometown_recipes', lambda recipes: recipes.append(new_recipe), new_recipe['user_id'])
+    if saved:
         return jsonify({'message': '菜谱创建成功', 'recipe': new_recipe}), 201
     return jsonify({'error': '保存菜谱失败'}), 500
 
@@ -580,24 +1394,20 @@ def create_hometown_recipe():
 @app.route('/api/hometown/recipes/<int:recipe_id>', methods=['DELETE'])
 def delete_hometown_recipe(recipe_id):
     """删除家乡菜谱"""
-    recipes = load_data('hometown_recipes')
-    filtered_recipes = [
-        r for r in recipes
-        if not (r.get('id') == recipe_id and r.get('user_id') == 1)
-    ]
-    
-    if len(filtered_recipes) < len(recipes) and save_data('hometown_recipes', filtered_recipes):
+    try:
+        saved, _ = modify_data('hometown_recipes', lambda recipes: _remove_item(recipes, recipe_id), current_user_id())
+    except LookupError:
+        saved = False
+    if saved:
         return jsonify({'message': '菜谱删除成功'})
     return jsonify({'error': '菜谱不存在或删除失败'}), 404
 
 # === 用户食材管理 ===
 @app.route('/api/user/ingredients', methods=['GET'])
+@conditional_json('user_ingredients')
 def get_user_ingredients():
-    """获取用户选择的食材"""
-    ingredients = load_data('user_ingredients')
-    user_ingredients = [i for i in ingredients if i.get('user_id') == 1]
-    user_ingredients.sort(key=lambda x: x.get('added_at', ''), reverse=True)
-    return jsonify(user_ingredients)
+    """获取用户选择的食材（按添加时间降序，支持 ?limit=&cursor= 分页）"""
+    return user_items_response('user_ingredients')
 
 
 @app.route('/api/user/ingredients', methods=['POST'])
@@ -610,25 +1420,32 @@ def add_user_ingredients():
         if not isinstance(new_ingredients, list):
             return jsonify({'error': '食材格式必须为数组'}), 400
         
-        # 加载现有食材数据
-        existing_ingredients = load_data('user_ingredients')
-        
-        # 去重并合并（假设食材以name为标识，避免重复添加）
-        # 若需要保留数量，可调整逻辑（如累加数量）
-        existing_names = {ing['name'] for ing in existing_ingredients}
-        for ing_name in new_ingredients:
-            if ing_name not in existing_names:
-                # 为新食材生成ID和默认信息（根据实际需求调整结构）
+        user_id = current_user_id()
+
+        def add_ingredients(existing_ingredients):
+            # 在当前用户的食材中去重并合并（假设食材以name为标识，避免重复添加）
+            # 若需要保留数量，可调整逻辑（如累加数量）
+            existing_names = {ing['name'] for ing in existing_ingredients}
+            names_to_add = []
+            for ing_name in new_ingredients:
+                if ing_name not in existing_names:
+                    names_to_add.append(ing_name)
+                    existing_names.add(ing_name)
+
+            # 为新食材批量生成ID和默认信息（根据实际需求调整结构）
+            for new_id, ing_name in zip(reserve_ids('user_ingredients', len(names_to_add)), names_to_add):
                 new_ing = {
-                    'id': get_next_id('user_ingredients'),
+                    'id': new_id,
+                    'user_id': user_id,
                     'name': ing_name,
                     'added_at': datetime.utcnow().isoformat()
                 }
                 existing_ingredients.append(new_ing)
-                existing_names.add(ing_name)
+            return list(existing_ingredients)
         
         # 保存更新后的数据
-        if save_data('user_ingredients', existing_ingredients):
+        saved, existing_ingredients = modify_data('user_ingredients', add_ingredients, user_id)
+        if saved:
             return jsonify({
                 'message': '食材添加成功',
                 'ingredients': existing_ingredients
@@ -644,13 +1461,13 @@ def add_user_ingredients():
 @app.route('/api/user/ingredients/<int:ingredient_id>', methods=['DELETE'])
 def delete_user_ingredient(ingredient_id):
     """删除用户食材"""
-    ingredients = load_data('user_ingredients')
-    filtered = [
-        i for i in ingredients
-        if not (i.get('id') == ingredient_id and i.get('user_id') == 1)
-    ]
-    
-    if len(filtered) < len(ingredients) and save_data('user_ingredients', filtered):
+    try:
+        saved, _ = modify_data(
+            'user_ingredients', lambda ingredients: _remove_item(ingredients, ingredient_id), current_user_id()
+        )
+    except LookupError:
+        saved = False
+    if saved:
         return jsonify({'message': '食材删除成功'})
     return jsonify({'error': '食材不存在或删除失败'}), 404
 
@@ -658,24 +1475,24 @@ def delete_user_ingredient(ingredient_id):
 @app.route('/api/user/ingredients/clear', methods=['DELETE'])
 def clear_all_user_ingredients():
     """清除用户所有食材"""
-    ingredients = load_data('user_ingredients')
-    # 保留非当前用户的食材
-    filtered = [i for i in ingredients if i.get('user_id') != 1]
-    deleted_count = len(ingredients) - len(filtered)
+    def clear_ingredients(ingredients):
+        # 分区中只有当前用户的食材，全部清除
+        deleted_count = len(ingredients)
+        ingredients.clear()
+        return deleted_count
     
-    if save_data('user_ingredients', filtered):
+    saved, deleted_count = modify_data('user_ingredients', clear_ingredients, current_user_id())
+    if saved:
         return jsonify({'message': f'成功清除 {deleted_count} 个食材'})
     return jsonify({'error': '清除食材失败'}), 500
 
 # === 菜谱筛选条件管理 ===
 @app.route('/api/recipe/filters', methods=['GET'])
+@conditional_json('recipe_filters')
 def get_recipe_filters():
     """获取菜谱筛选条件"""
-    filters = load_data('recipe_filters')
-    # 获取user_id=1的最新筛选条件
-    user_filters = [f for f in filters if f.get('user_id') == 1]
-    # 按创建时间降序取最新
-    user_filters.sort(key=lambda x: x.get('created_at', ''), reverse=True)
+    # 取当前用户最新的一条
+    user_filters, _ = user_items_page('recipe_filters', current_user_id(), limit=1)
     return jsonify(user_filters[0] if user_filters else {})
 
 
@@ -686,26 +1503,219 @@ def set_recipe_filters():
     if not all(k in data for k in ['cooking_time', 'is_packable', 'is_induction']):
         return jsonify({'error': '筛选条件不完整'}), 400
     
-    filters = load_data('recipe_filters')
-    # 删除用户旧筛选条件
-    filters = [f for f in filters if f.get('user_id') != 1]
-    
-    # 添加新筛选条件
+    # 新筛选条件
     new_filter = {
         'id': get_next_id('recipe_filters'),
-        'user_id': 1,
+        'user_id': current_user_id(),
         'cooking_time': data['cooking_time'],
         'is_packable': data['is_packable'],
         'is_induction': data['is_induction'],
         'created_at': datetime.utcnow().isoformat()
     }
-    filters.append(new_filter)
+
+    def replace_filters(filters):
+        # 删除用户旧筛选条件，添加新筛选条件
+        filters[:] = [new_filter]
     
-    if save_data('recipe_filters', filters):
+    saved, _ = modify_data('recipe_filters', replace_filters, new_filter['user_id'])
+    if saved:
         return jsonify({'message': '筛选条件设置成功', 'filters': new_filter})
     return jsonify({'error': '保存筛选条件失败'}), 500
 
 
+# === 全文搜索 ===
+# 结果类型 -> 集合
+SEARCH_TYPES = {
+    'recipe': 'recipes',
+    'hometown_recipe': 'hometown_recipes',
+    'knowledge': 'knowledge_items'
+}
+
+@app.route('/api/search', methods=['GET'])
+@conditional_json(*SEARCH_TYPES.values())
+def search():
+    """
+    全文搜索菜谱、当前用户的家乡菜谱和知识库，按BM25相关度排序
+    参数：q 关键词；type 结果类型（逗号分隔，默认全部）；limit、cursor 分页
+    返回 {"items": [{"type", "score", "item"}], "total": 命中总数, "next_cursor": 下一页游标或null}
+    """
+    query = request.args.get('q', '').strip()
+    terms = query_terms(query)
+    if not terms:
+        return jsonify({'error': '缺少搜索关键词 q'}), 400
+    types = request.args.get('type')
+    types = [t for t in types.split(',') if t in SEARCH_TYPES] if types else list(SEARCH_TYPES)
+    if not types:
+        return jsonify({'error': f"type 只能是 {', '.join(SEARCH_TYPES)}"}), 400
+
+    limit = max(1, min(request.args.get('limit', 20, type=int), MAX_PAGE_SIZE))
+    offset = 0
+    cursor = request.args.get('cursor')
+    if cursor is not None:
+        # 游标记录关键词和偏移量，换了关键词的旧游标无效
+        try:
+            cursor_query, offset = decode_cursor(cursor)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        if cursor_query != query or offset < 0:
+            return jsonify({'error': '无效的分页游标'}), 400
+
+    user_id = current_user_id()
+    # 共享集合（recipes）忽略user_id
+    sources = [(result_type, get_search_index(SEARCH_TYPES[result_type], user_id)) for result_type in types]
+    total, hits = bm25_search(sources, terms, limit, offset)
+    next_offset = offset + len(hits)
+    return jsonify({
+        'items': [{'type': result_type, 'score': round(score, 4), 'item': record} for score, result_type, record in hits],
+        'total': total,
+        'next_cursor': encode_cursor((query, next_offset)) if next_offset < total else None
+    })
+
+# === 批量请求 ===
+# 页面加载时的多个接口请求合并为一次往返；子请求在进程内分发给上面的路由
+MAX_BATCH_REQUESTS = int(os.getenv('MAX_BATCH_REQUESTS', '20'))
+batch_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv('BATCH_CONCURRENCY', '8')),
+    thread_name_prefix='batch'
+)
+
+@app.route('/api/batch', methods=['POST'])
+def batch():
+    """
+    批量执行子请求：{"requests": [{"method": "GET", "path": "/api/tips?type=oil", "body": {...}, "headers": {...}}]}
+    连续的只读请求并发执行，写请求按顺序执行；子请求使用当前请求的用户
+    返回 {"responses": [{"status", "body", "etag"}]}，顺序与请求一致
+    """
+    try:
+        sub_requests = parse_batch(request.get_json(silent=True), MAX_BATCH_REQUESTS, forbidden_paths=('/api/batch',))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    responses = run_batch(
+        app.wsgi_app,
+        sub_requests,
+        batch_executor,
+        forced_headers={USER_ID_HEADER: str(current_user_id())},
+        environ_base={'REMOTE_ADDR': request.remote_addr}
+    )
+    return jsonify({'responses': responses})
+
+# === 后台任务 ===
+# 耗时的上游请求可作为任务提交：POST /api/jobs 立即返回任务ID，任务在后台通过进程内分发执行对应接口，
+# 结果通过 GET /api/jobs/<id> 轮询（?wait=秒 长轮询）或SSE获取
+# 可提交的接口 -> (请求方法, 优先级)：语音识别优先于菜谱生成，菜谱生成优先于批量存储建议和社区问题
+JOB_ROUTES = {
+    '/api/baidu/asr': ('POST', 'interactive'),
+    '/api/recipe/ai_generate': ('POST', 'normal'),
+    '/api/pantry/storage_tips': ('POST', 'bulk'),
+    '/api/community/questions': ('GET', 'bulk'),
+}
+IDEMPOTENCY_KEY_HEADER = 'Idempotency-Key'
+JOB_MAX_WAIT = 30
+JOB_SSE_HEARTBEAT = 15
+
+def run_job(job):
+    """在任务工作线程中以提交任务的用户身份执行对应接口，结果为 {"status", "body"}"""
+    job_request = job['request']
+    return dispatch(
+        app.wsgi_app,
+        job_request['method'],
+        job_request['path'],
+        job_request['body'],
+        {USER_ID_HEADER: str(job['user_id'])}
+    )
+
+job_queue = JobQueue(
+    os.path.join(DATA_DIR, 'jobs'),
+    run_job,
+    workers=int(os.getenv('JOB_WORKERS', '4')),
+    retention=float(os.getenv('JOB_RETENTION', str(86400))),
+    is_success=lambda result: result['status'] < 400
+)
+# serve.py 和压测服务进程启动时调用 job_queue.start() 接管遗留任务；其他情况在第一次提交任务时启动，导入 app 本身不启动线程
+
+def collect_job_queue_stats():
+    stats = job_queue.stats()
+    values = {('queued', priority): count for priority, count in stats['queued'].items()}
+    values[('running', 'all')] = stats['running']
+    return values
+
+metrics.gauge_callback('forbites_jobs', '本进程后台任务数（排队中按优先级、执行中）', ('state', 'priority'), collect_job_queue_stats)
+
+def job_view(job):
+    """返回给客户端的任务信息（不含请求内容，如语音数据）"""
+    return {key: job[key] for key in ('id', 'status', 'priority', 'result', 'error', 'created_at', 'started_at', 'finished_at')}
+
+@app.route('/api/jobs', methods=['POST'])
+def create_job():
+    """
+    提交后台任务：{"path": "/api/recipe/ai_generate", "body": {...}}，请求头 Idempotency-Key 可选
+    新建任务返回202；相同幂等键重复提交返回200和已有任务；同一幂等键对应不同请求时返回422
+    """
+    data = request.get_json(silent=True) or {}
+    path = data.get('path')
+    route = JOB_ROUTES.get(path.split('?', 1)[0]) if isinstance(path, str) else None
+    if route is None:
+        return jsonify({'error': f"path 只能是 {', '.join(JOB_ROUTES)}"}), 400
+    method, priority = route
+    try:
+        job, created = job_queue.submit(
+            {'method': method, 'path': path, 'body': data.get('body')},
+            current_user_id(),
+            priority,
+            request.headers.get(IDEMPOTENCY_KEY_HEADER) or None
+        )
+    except JobConflict as e:
+        return jsonify({'error': str(e)}), 422
+    response = jsonify(job_view(job))
+    response.status_code = 202 if created else 200
+    response.headers['Location'] = f"/api/jobs/{job['id']}"
+    return response
+
+def stream_job(job):
+    """
+    以SSE推送任务状态：
+    - status: 状态变化时发送任务信息
+    - done: 任务完成（成功或失败）时发送任务信息，随后结束
+    等待期间定期发送注释行保持连接
+    """
+    def generate():
+        current = job
+        yield sse_event('status', job_view(current))
+        while current['status'] not in FINISHED:
+            latest = job_queue.wait(current['id'], current['status'], timeout=JOB_SSE_HEARTBEAT)
+            if latest is None:
+                yield sse_event('error', {'error': '任务不存在'})
+                return
+            if latest['status'] == current['status']:
+                yield ': keep-alive\n\n'
+            elif latest['status'] not in FINISHED:
+                yield sse_event('status', job_view(latest))
+            current = latest
+        yield sse_event('done', job_view(current))
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """
+    查询任务状态和结果（只能查询自己的任务）
+    ?wait=N：任务未完成时最多等待N秒（不超过30），状态变化后立即返回；?stream=1 或 Accept: text/event-stream：SSE推送
+    """
+    job = job_queue.get(job_id)
+    if job is None or job['user_id'] != current_user_id():
+        return jsonify({'error': '任务不存在'}), 404
+    if wants_event_stream():
+        return stream_job(job)
+    wait_seconds = min(max(request.args.get('wait', 0, type=float), 0), JOB_MAX_WAIT)
+    if wait_seconds and job['status'] not in FINISHED:
+        job = job_queue.wait(job_id, job['status'], timeout=wait_seconds) or job
+    return jsonify(job_view(job))
+
+
 # --- 数据库初始化与应用启动 ---
 def seed_database():
     """初始化tip_items数据（如果为空）"""
@@ -791,4 +1801,5 @@ def seed_database():
 
 if __name__ == '__main__':
     seed_database()  # 初始化数据
+    migrate_knowledge_images()
     app.run(debug=True, port=5001)
\ No newline at end of file
@@ -0,0 +1,94 @@
+"""
+语音识别前的音频预处理（向量化实现，依赖NumPy，未安装时不启用）
+- 多声道混合为单声道
+- 基于短时能量的静音裁剪（保留首尾少量余量）
+- 重采样为百度支持的16000或8000采样率的16位PCM
+"""
+
+try:
+    import numpy as np
+except ImportError:  # NumPy为可选依赖
+    np = None
+
+# 百度语音识别支持的采样率
+SUPPORTED_RATES = (16000, 8000)
+
+FRAME_MS = 20          # 能量计算的帧长
+PADDING_MS = 200       # 裁剪后在语音首尾保留的余量
+MIN_THRESHOLD = 300.0  # 能量阈值下限（16位PCM的RMS）
+NOISE_FACTOR = 3.0     # 阈值 = 噪声基底 * NOISE_FACTOR
+
+
+def is_available():
+    return np is not None
+
+
+def target_rate_for(sample_rate):
+    """选择重采样目标：不低于16000时用16000，否则用8000"""
+    return 16000 if sample_rate >= 16000 else 8000
+
+
+def _downmix(samples, channels):
+    if channels <= 1:
+        return samples.astype(np.float32)
+    usable = len(samples) - len(samples) % channels
+    return samples[:usable].reshape(-1, channels).mean(axis=1, dtype=np.float32)
+
+
+def _speech_bounds(samples, sample_rate):
+    """返回语音段的 (起始, 结束) 采样点；检测不到语音时返回整段"""
+    frame = max(int(sample_rate * FRAME_MS / 1000), 1)
+    frame_count = len(samples) // frame
+    if frame_count == 0:
+        return 0, len(samples)
+    frames = samples[:frame_count * frame].reshape(frame_count, frame)
+    rms = np.sqrt(np.mean(frames * frames, axis=1))
+    # 以能量最低的10%帧估计噪声基底
+    noise_floor = np.percentile(rms, 10)
+    threshold = max(noise_floor * NOISE_FACTOR, MIN_THRESHOLD)
+    voiced = np.flatnonzero(rms > threshold)
+    if len(voiced) == 0:
+        return 0, len(samples)
+    padding = int(sample_rate * PADDING_MS / 1000)
+    start = max(voiced[0] * frame - padding, 0)
+    end = min((voiced[-1] + 1) * frame + padding, len(samples))
+    return start, end
+
+
+def _resample(samples, sample_rate, target_rate):
+    if sample_rate == target_rate or len(samples) == 0:
+        return samples
+    if sample_rate % target_rate == 0:
+        # 整数倍降采样：块平均起到简单的抗混叠滤波作用
+        factor = sample_rate // target_rate
+        usable = len(samples) - len(samples) % factor
+        return samples[:usable].reshape(-1, factor).mean(axis=1)
+    # 其他情况使用线性插值
+    duration = len(samples) / sample_rate
+    target_count = int(round(duration * target_rate))
+    positions = np.arange(target_count) * (sample_rate / target_rate)
+    return np.interp(positions, np.arange(len(samples)), samples).astype(np.float32)
+
+
+def preprocess_pcm(pcm, sample_rate, channels=1):
+    """
+    预处理16位小端PCM音频
+    返回 (处理后的PCM bytes, 采样率, 统计信息)
+    """
+    samples = np.frombuffer(pcm[:len(pcm) - len(pcm) % 2], dtype='<i2')
+    mono = _downmix(samples, channels)
+    start, end = _speech_bounds(mono, sample_rate)
+    trimmed = mono[start:end]
+    target_rate = target_rate_for(sample_rate)
+    resampled = _resample(trimmed, sample_rate, target_rate)
+    output = np.clip(np.round(resampled), -32768, 32767).astype('<i2').tobytes()
+    stats = {
+        'original_bytes': len(pcm),
+        'processed_bytes': len(output),
+        'saved_bytes': len(pcm) - len(output),
+        'trimmed_ms': int((len(mono) - len(trimmed)) * 1000 / sample_rate),
+        'channels': channels,
+        'original_rate': sample_rate,
+        'rate': target_rate
+    }
+    return output, target_rate, stats
@@ -0,0 +1,115 @@
+"""
+批量请求：把多个子请求在进程内分发给现有路由，结果一次返回
+- 子请求完整经过WSGI应用（before/after_request、错误处理、指标），与单独请求的行为一致
+- 连续的只读请求（GET/HEAD）并发执行；写请求按顺序逐个执行，
+  写请求之后的读请求能看到它的结果
+- 子请求在线程池中执行，每个子请求有自己独立的应用上下文（g），不会影响外层请求
+- 子请求不压缩（忽略 Accept-Encoding），environ 中带 SUB_REQUEST_ENVIRON_KEY 标记，
+  接口可据此跳过只服务于浏览器直接请求的缓存
+"""
+
+import json
+from werkzeug.test import EnvironBuilder
+from werkzeug.wrappers import Response
+
+READ_METHODS = ('GET', 'HEAD')
+ALLOWED_METHODS = ('GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE')
+SUB_REQUEST_ENVIRON_KEY = 'forbites.sub_request'
+
+
+def is_sub_request(environ):
+    """请求是否为进程内分发的子请求（批量请求、后台任务）"""
+    return bool(environ.get(SUB_REQUEST_ENVIRON_KEY))
+
+
+def parse_batch(payload, max_requests, path_prefix='/api/', forbidden_paths=()):
+    """
+    校验批量请求体 {"requests": [{"method", "path", "body", "headers"}, ...]}
+    返回 [(method, path, body, headers), ...]；格式不正确时抛出 ValueError
+    """
+    if not isinstance(payload, dict) or not isinstance(payload.get('requests'), list):
+        raise ValueError('请求体应为 {"requests": [...]}')
+    entries = payload['requests']
+    if not entries:
+        raise ValueError('requests 不能为空')
+    if len(entries) > max_requests:
+        raise ValueError(f'一次最多 {max_requests} 个子请求')
+
+    parsed = []
+    for i, entry in enumerate(entries):
+        if not isinstance(entry, dict):
+            raise ValueError(f'第 {i + 1} 个子请求格式不正确')
+        method = str(entry.get('method') or 'GET').upper()
+        if method not in ALLOWED_METHODS:
+            raise ValueError(f'第 {i + 1} 个子请求的方法不支持: {method}')
+        path = entry.get('path')
+        if not isinstance(path, str) or not path.startswith(path_prefix):
+            raise ValueError(f'第 {i + 1} 个子请求的 path 必须以 {path_prefix} 开头')
+        if path.split('?', 1)[0].rstrip('/') in forbidden_paths:
+            raise ValueError(f'第 {i + 1} 个子请求不能调用 {path}')
+        headers = entry.get('headers') or {}
+        if not isinstance(headers, dict):
+            raise ValueError(f'第 {i + 1} 个子请求的 headers 应为对象')
+        parsed.append((method, path, entry.get('body'), {str(k): str(v) for k, v in headers.items()}))
+    return parsed
+
+
+def _response_body(response):
+    if response.status_code == 304 or not response.data:
+        return None
+    if response.is_json:
+        return json.loads(response.data)
+    return response.get_data(as_text=True)
+
+
+def dispatch(wsgi_app, method, path, body, headers, environ_base=None):
+    """在进程内执行一个子请求，返回 {"status", "body"[, "etag"]}"""
+    # 结果要解析为JSON放入外层响应，子请求不能返回压缩后的响应体
+    headers = {k: v for k, v in headers.items() if k.lower() != 'accept-encoding'}
+    builder = EnvironBuilder(
+        path=path,
+        method=method,
+        json=body,
+        headers=headers,
+        environ_base={**(environ_base or {}), SUB_REQUEST_ENVIRON_KEY: True}
+    )
+    try:
+        response = Response.from_app(wsgi_app, builder.get_environ(), buffered=True)
+        result = {'status': response.status_code, 'body': _response_body(response)}
+    except Exception as e:
+        # 调试模式下应用不会把异常转换为500响应
+        return {'status': 500, 'body': {'error': str(e)}}
+    finally:
+        builder.close()
+    etag = response.headers.get('ETag')
+    if etag:
+        result['etag'] = etag
+    return result
+
+
+def run_batch(wsgi_app, sub_requests, executor, forced_headers=None, environ_base=None):
+    """
+    执行全部子请求，按请求顺序返回结果
+    forced_headers: 覆盖到每个子请求上的请求头（如外层请求的用户标识）
+    """
+    results = [None] * len(sub_requests)
+    pending = []  # 当前一组连续的只读请求 [(序号, future)]
+
+    def submit(method, path, body, headers):
+        headers = {**headers, **(forced_headers or {})}
+        return executor.submit(dispatch, wsgi_app, method, path, body, headers, environ_base)
+
+    def drain():
+        for index, future in pending:
+            results[index] = future.result()
+        pending.clear()
+
+    for index, (method, path, body, headers) in enumerate(sub_requests):
+        if method in READ_METHODS:
+            pending.append((index, submit(method, path, body, headers)))
+            continue
+        # 写请求等之前的读请求完成后再执行，执行完成后才开始后面的请求
+        drain()
+        results[index] = submit(method, path, body, headers).result()
+    drain()
+    return results
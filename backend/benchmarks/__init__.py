@@ -0,0 +1,6 @@
+"""
+压测与基准测试工具
+- fake_upstreams: 本地模拟的豆包、百度接口（可配置延迟和错误率）
+- datagen: 1k/100k/1M 规模的合成数据集
+- run: 并发压测所有 /api/* 接口，输出吞吐量和 p50/p95/p99 延迟（JSON）
+"""
@@ -0,0 +1,147 @@
+"""
+生成压测用的合成数据集（菜谱、食材库存、知识库）
+记录结构和文件布局与应用写入的一致：按 user_id 分散到多个用户，分区集合每个用户一个文件，
+其中用户1是压测请求默认使用的用户
+
+python -m benchmarks.datagen /tmp/forbites-data --scale 100k
+"""
+
+import os
+import json
+import random
+import argparse
+from datetime import datetime, timedelta
+
+from storage_backend import USER_COLLECTIONS
+
+SCALES = {'1k': 1000, '100k': 100000, '1m': 1000000}
+
+INGREDIENTS = [
+    '番茄', '鸡蛋', '土豆', '牛肉', '猪肉', '鸡胸肉', '三文鱼', '鳕鱼', '虾', '豆腐',
+    '白菜', '青椒', '洋葱', '大蒜', '生姜', '葱', '胡萝卜', '西兰花', '蘑菇', '茄子',
+    '黄瓜', '玉米', '米饭', '面条', '酱油', '醋', '盐', '糖', '辣椒', '花椒'
+]
+SEASONINGS = ['酱油', '醋', '盐', '糖', '辣椒', '花椒', '料酒', '蚝油', '豆瓣酱', '五香粉']
+DISHES = ['炒', '炖', '蒸', '煮', '烤', '凉拌', '红烧', '清蒸', '干煸', '糖醋']
+TITLES = ['铸铁锅养护', '挪威超市指南', '刀工入门', '高压锅使用', '调料替代方案', '烘焙基础']
+
+
+def _timestamp(rng, base):
+    return (base - timedelta(seconds=rng.randint(0, 365 * 86400))).isoformat()
+
+
+def make_recipe(rng, record_id, base):
+    ingredients = rng.sample(INGREDIENTS, rng.randint(2, 6))
+    return {
+        'id': record_id,
+        'name': f"{rng.choice(DISHES)}{ingredients[0]}{record_id}",
+        'ingredients': ingredients,
+        'steps': [f'第{i + 1}步：处理{name}' for i, name in enumerate(ingredients)],
+        'source': rng.choice(['manual', 'ai']),
+        'created_at': _timestamp(rng, base)
+    }
+
+
+def make_pantry_item(rng, record_id, base, users):
+    is_seasoning = rng.random() < 0.3
+    return {
+        'id': record_id,
+        'user_id': rng.randint(1, users),
+        'name': f"{rng.choice(SEASONINGS if is_seasoning else INGREDIENTS)}{record_id}",
+        'item_type': 'seasoning' if is_seasoning else 'ingredient',
+        'quantity': rng.randint(1, 10),
+        'created_at': _timestamp(rng, base)
+    }
+
+
+def make_knowledge_item(rng, record_id, base, users):
+    created_at = _timestamp(rng, base)
+    return {
+        'id': record_id,
+        'user_id': rng.randint(1, users),
+        'title': f"{rng.choice(TITLES)}（{record_id}）",
+        'content': '，'.join(rng.sample(INGREDIENTS, 8)) + '的处理和保存要点。',
+        'image': None,
+        'date': created_at[:10],
+        'created_at': created_at
+    }
+
+
+def write_json_array(path, records):
+    """逐条写出JSON数组，百万级数据也不需要在内存中构造整个列表"""
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write('[')
+        for i, record in enumerate(records):
+            if i:
+                f.write(',\n')
+            f.write(json.dumps(record, ensure_ascii=False))
+        f.write(']')
+    os.replace(tmp_path, path)
+
+
+def write_partitions(directory, records):
+    """按 user_id 逐条写入 <directory>/<user_id>.json（与应用的分区存储布局一致），返回用户数"""
+    os.makedirs(directory, exist_ok=True)
+    files = {}
+    try:
+        for record in records:
+            f = files.get(record['user_id'])
+            if f is None:
+                f = files[record['user_id']] = open(
+                    os.path.join(directory, f"{record['user_id']}.json.tmp"), 'w', encoding='utf-8'
+                )
+                f.write('[')
+            else:
+                f.write(',\n')
+            f.write(json.dumps(record, ensure_ascii=False))
+    finally:
+        for f in files.values():
+            f.write(']')
+            f.close()
+    for user_id in files:
+        path = os.path.join(directory, f'{user_id}.json')
+        os.replace(path + '.tmp', path)
+    return len(files)
+
+
+def generate(data_dir, scale='1k', users=100, seed=0):
+    """
+    在 data_dir 下生成数据集，返回 {集合名: 记录数}
+    scale: SCALES 中的规模名称或具体记录数；users: 记录分散到的用户数
+    """
+    count = SCALES[scale] if scale in SCALES else int(scale)
+    os.makedirs(data_dir, exist_ok=True)
+    base = datetime(2025, 1, 1)
+    factories = {
+        'recipes': lambda rng, i: make_recipe(rng, i, base),
+        'pantry_items': lambda rng, i: make_pantry_item(rng, i, base, users),
+        'knowledge_items': lambda rng, i: make_knowledge_item(rng, i, base, users)
+    }
+    counts = {}
+    for key, factory in factories.items():
+        rng = random.Random(f'{seed}:{key}')
+        records = (factory(rng, i) for i in range(1, count + 1))
+        if key in USER_COLLECTIONS:
+            write_partitions(os.path.join(data_dir, key), records)
+        else:
+            write_json_array(os.path.join(data_dir, f'{key}.json'), records)
+        # ID序列文件，应用启动后无需扫描数据求最大ID
+        with open(os.path.join(data_dir, f'{key}.seq'), 'w', encoding='utf-8') as f:
+            f.write(str(count))
+        counts[key] = count
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description='生成压测用的合成数据集')
+    parser.add_argument('data_dir')
+    parser.add_argument('--scale', default='1k', help='1k、100k、1m 或具体记录数')
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    print(json.dumps(generate(args.data_dir, args.scale, args.users, args.seed)))
+
+
+if __name__ == '__main__':
+    main()
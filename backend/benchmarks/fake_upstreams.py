@@ -0,0 +1,175 @@
+"""
+本地模拟的上游服务，压测时代替豆包和百度接口
+通过 DOUBAO_API_URL、BAIDU_ASR_TOKEN_URL、BAIDU_ASR_URL 环境变量指向这里
+
+单独运行：python -m benchmarks.fake_upstreams --port 8900 --latency 0.2 --error-rate 0.01
+"""
+
+import re
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+DOUBAO_PATH = '/api/v3/chat/completions'
+BAIDU_TOKEN_PATH = '/oauth/2.0/token'
+BAIDU_ASR_PATH = '/server_api'
+
+FAKE_RECIPE = {
+    'name': '压测专用番茄炒蛋',
+    'ingredients': ['番茄', '鸡蛋', '盐'],
+    'steps': ['番茄切块', '鸡蛋打散炒熟', '加入番茄翻炒', '加盐出锅']
+}
+FAKE_QUESTIONS = ['在挪威三文鱼怎么做好吃？', '哪里可以买到亚洲调料？', '挪威的肉类推荐做法？']
+FAKE_TIP = {'method': '冷藏保存', 'duration': '3-5天'}
+
+
+def fake_completion(messages):
+    """按提示词内容生成与真实接口格式一致的模型回复文本"""
+    system = messages[0]['content'] if messages else ''
+    prompt = messages[-1]['content'] if messages else ''
+    if 'JSON数组' in system:
+        return json.dumps(FAKE_QUESTIONS, ensure_ascii=False)
+    if '保鲜' in system:
+        names = re.findall(r'“([^”]+)”', prompt)
+        if '分别为' in prompt:
+            return json.dumps({name: FAKE_TIP for name in names}, ensure_ascii=False)
+        return json.dumps(FAKE_TIP, ensure_ascii=False)
+    return json.dumps(FAKE_RECIPE, ensure_ascii=False)
+
+
+class FakeUpstreamHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    def do_POST(self):
+        server = self.server
+        body = self._read_body()
+        path = self.path.split('?', 1)[0]
+        server.record(path)
+
+        delay = server.latency + random.uniform(0, server.jitter)
+        if random.random() < server.error_rate:
+            time.sleep(delay)
+            self._send_json(503, {'error': 'injected failure'})
+            return
+
+        if path == DOUBAO_PATH:
+            request = json.loads(body or b'{}')
+            content = fake_completion(request.get('messages', []))
+            if request.get('stream'):
+                self._stream_completion(content, delay)
+                return
+            time.sleep(delay)
+            self._send_json(200, {'choices': [{'message': {'role': 'assistant', 'content': content}}]})
+        elif path == BAIDU_TOKEN_PATH:
+            time.sleep(delay)
+            self._send_json(200, {'access_token': 'fake-token', 'expires_in': 2592000})
+        elif path == BAIDU_ASR_PATH:
+            time.sleep(delay)
+            self._send_json(200, {'err_no': 0, 'err_msg': 'success.', 'result': ['番茄 鸡蛋']})
+        else:
+            self._send_json(404, {'error': 'not found'})
+
+    def _stream_completion(self, content, delay, chunk_chars=8):
+        """按SSE格式分段返回，总耗时与非流式响应相同"""
+        chunks = [content[i:i + chunk_chars] for i in range(0, len(content), chunk_chars)]
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+        for chunk in chunks:
+            time.sleep(delay / len(chunks))
+            event = {'choices': [{'delta': {'content': chunk}}]}
+            self.wfile.write(f"data: {json.dumps(event, ensure_ascii=False)}\n\n".encode('utf-8'))
+            self.wfile.flush()
+        self.wfile.write(b'data: [DONE]\n\n')
+
+
+class FakeUpstreamServer(ThreadingHTTPServer):
+    """
+    latency: 每次响应的基础延迟（秒）；jitter: 额外的随机延迟上限（秒）
+    error_rate: 返回503的概率
+    """
+
+    daemon_threads = True
+    # 默认的监听队列只有5，大量并发连接（gevent模式的应用）会被重置
+    request_queue_size = 256
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, jitter=0.0, error_rate=0.0):
+        super().__init__((host, port), FakeUpstreamHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self._lock = threading.Lock()
+        self.calls = {}
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def record(self, path):
+        with self._lock:
+            self.calls[path] = self.calls.get(path, 0) + 1
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def upstream_env(doubao, baidu):
+    """把应用指向模拟上游所需的环境变量"""
+    return {
+        'DOUBAO_API_URL': doubao.base_url + DOUBAO_PATH,
+        'DOUBAO_API_KEY': 'fake-doubao-key',
+        'BAIDU_ASR_TOKEN_URL': baidu.base_url + BAIDU_TOKEN_PATH,
+        'BAIDU_ASR_URL': baidu.base_url + BAIDU_ASR_PATH,
+        'BAIDU_ASR_API_KEY': 'fake-baidu-key',
+        'BAIDU_ASR_SECRET_KEY': 'fake-baidu-secret'
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='本地模拟的豆包/百度接口')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8900)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = FakeUpstreamServer(args.host, args.port, args.latency, args.jitter, args.error_rate)
+    for key, value in upstream_env(server, server).items():
+        print(f'{key}={value}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,432 @@
+"""
+并发压测所有 /api/* 接口并输出机器可读的基线结果
+
+在 backend 目录下运行：
+    python -m benchmarks.run --scale 100k --concurrency 16 --duration 10 --output baseline.json
+    python -m benchmarks.run --scale 100k --compare baseline.json --max-regression 0.2
+
+默认会生成数据集、启动模拟上游和应用进程；--target 可改为压测已在运行的服务
+
+--background 在压测每个接口的同时持续发送另一个接口的请求，用于观察慢请求（如等待上游的大模型调用）
+对其他接口的影响，配合 --worker 对比不同的服务器并发模式：
+    python -m benchmarks.run --routes tips --doubao-latency 2 --background recipe_ai_generate:64 --worker threads
+    python -m benchmarks.run --routes tips --doubao-latency 2 --background recipe_ai_generate:64 --worker gevent
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import random
+import socket
+import shutil
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+from datetime import datetime
+
+import requests
+
+import migrate_storage
+from benchmarks import datagen
+from benchmarks.fake_upstreams import FakeUpstreamServer, upstream_env
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 1秒的16kHz单声道PCM（低幅噪声 + 中间一段较响的信号），用于语音识别接口
+_noise = random.Random(0)
+SAMPLE_PCM = b''.join(
+    ((i % 64 - 32) * 200 if 4000 <= i < 12000 else _noise.randint(-40, 40)).to_bytes(2, 'little', signed=True)
+    for i in range(16000)
+)
+
+
+class Scenario:
+    """
+    一个被压测的接口
+    request(rng, n): 返回本次请求的 requests 参数（method, path 之外的部分）
+    prepare(session, base_url, rng): 可选，请求前的准备工作（不计入耗时），返回值替换path中的 {id}
+    stream: 是否逐块读取完整的流式响应
+    """
+
+    def __init__(self, name, method, path, request=None, prepare=None, stream=False):
+        self.name = name
+        self.method = method
+        self.path = path
+        self.request = request or (lambda rng, n: {})
+        self.prepare = prepare
+        self.stream = stream
+
+
+def _ingredients(rng, k=3):
+    return rng.sample(datagen.INGREDIENTS, k)
+
+
+def _create_then_delete(collection_path, body):
+    def prepare(session, base_url, rng):
+        response = session.post(base_url + collection_path, json=body(rng))
+        record = response.json()
+        return (record.get('item') or record.get('recipe') or {}).get('id', 0)
+    return prepare
+
+
+def _add_user_ingredient(session, base_url, rng):
+    name = f'压测食材{rng.random()}'
+    ingredients = session.post(base_url + '/api/user/ingredients', json={'ingredients': [name]}).json()
+    return next((i['id'] for i in ingredients.get('ingredients', []) if i['name'] == name), 0)
+
+
+def _recipe_body(rng):
+    ingredients = _ingredients(rng)
+    return {'name': f'压测菜谱{rng.random()}', 'ingredients': ingredients, 'steps': ['准备', '烹饪']}
+
+
+def _knowledge_body(rng):
+    return {'title': f'压测知识{rng.random()}', 'content': '压测内容', 'date': '2025-01-01'}
+
+
+SCENARIOS = [
+    Scenario('recipe_manual', 'POST', '/api/recipe/manual', lambda rng, n: {'json': _recipe_body(rng)}),
+    Scenario('recipe_ai_generate', 'POST', '/api/recipe/ai_generate',
+             lambda rng, n: {'json': {'ingredients': _ingredients(rng)}}),
+    Scenario('recipe_ai_generate_stream', 'POST', '/api/recipe/ai_generate?stream=1',
+             lambda rng, n: {'json': {'ingredients': _ingredients(rng)}}, stream=True),
+    Scenario('recipe_recommend', 'POST', '/api/recipe/recommend',
+             lambda rng, n: {'json': {'ingredients': _ingredients(rng, 4), 'limit': 10}}),
+    Scenario('baidu_token', 'GET', '/api/baidu/token'),
+    Scenario('baidu_asr', 'POST', '/api/baidu/asr?rate=16000',
+             lambda rng, n: {'data': SAMPLE_PCM, 'headers': {'Content-Type': 'application/octet-stream'}}),
+    Scenario('metrics', 'GET', '/api/metrics'),
+    Scenario('config_keys', 'GET', '/api/config/keys'),
+    Scenario('pantry_items_add', 'POST', '/api/pantry/items',
+             lambda rng, n: {'json': {'items': [{'name': f'压测物品{rng.random()}', 'item_type': 'ingredient', 'quantity': 1}]}}),
+    Scenario('pantry_items_list', 'GET', '/api/pantry/items?type=ingredient'),
+    Scenario('pantry_voice_recognize', 'POST', '/api/pantry/voice_recognize',
+             lambda rng, n: {'files': {'audio': ('audio.pcm', SAMPLE_PCM)}, 'data': {'rate': '16000'}}),
+    Scenario('pantry_storage_tips', 'POST', '/api/pantry/storage_tips',
+             lambda rng, n: {'json': {'ingredients': _ingredients(rng, 2) + [f'压测食材{rng.randint(0, 10000)}']}}),
+    Scenario('cache_stats', 'GET', '/api/cache/stats'),
+    Scenario('community_questions', 'GET', '/api/community/questions',
+             lambda rng, n: {'params': {'country': rng.choice(['挪威', '瑞典', '丹麦'])}}),
+    Scenario('tips', 'GET', '/api/tips?type=translation'),
+    Scenario('user_location', 'POST', '/api/user/location', lambda rng, n: {'json': {'location': rng.choice(['奥斯陆', '卑尔根'])}}),
+    Scenario('knowledge_list', 'GET', '/api/knowledge/items'),
+    Scenario('knowledge_list_page', 'GET', '/api/knowledge/items?limit=20'),
+    Scenario('knowledge_create', 'POST', '/api/knowledge/items', lambda rng, n: {'json': _knowledge_body(rng)}),
+    Scenario('knowledge_delete', 'DELETE', '/api/knowledge/items/{id}',
+             prepare=_create_then_delete('/api/knowledge/items', _knowledge_body)),
+    Scenario('hometown_list', 'GET', '/api/hometown/recipes'),
+    Scenario('hometown_create', 'POST', '/api/hometown/recipes', lambda rng, n: {'json': _recipe_body(rng)}),
+    Scenario('hometown_delete', 'DELETE', '/api/hometown/recipes/{id}',
+             prepare=_create_then_delete('/api/hometown/recipes', _recipe_body)),
+    Scenario('user_ingredients_list', 'GET', '/api/user/ingredients'),
+    Scenario('user_ingredients_add', 'POST', '/api/user/ingredients',
+             lambda rng, n: {'json': {'ingredients': _ingredients(rng, 2)}}),
+    Scenario('user_ingredients_delete', 'DELETE', '/api/user/ingredients/{id}', prepare=_add_user_ingredient),
+    Scenario('user_ingredients_clear', 'DELETE', '/api/user/ingredients/clear'),
+    Scenario('recipe_filters_get', 'GET', '/api/recipe/filters'),
+    Scenario('recipe_filters_set', 'POST', '/api/recipe/filters',
+             lambda rng, n: {'json': {'cooking_time': rng.choice([15, 30, 60]), 'is_packable': True, 'is_induction': False}}),
+    Scenario('search', 'GET', '/api/search', lambda rng, n: {'params': {'q': ''.join(_ingredients(rng, 2)), 'limit': 20}}),
+    # 存储建议作为后台任务提交，只测量提交（立即返回任务ID）的耗时
+    Scenario('jobs_submit', 'POST', '/api/jobs', lambda rng, n: {'json': {
+        'path': '/api/pantry/storage_tips', 'body': {'ingredients': _ingredients(rng, 2)}}}),
+    # 做饭页面加载时的读请求合并为一次
+    Scenario('batch_page_load', 'POST', '/api/batch', lambda rng, n: {'json': {'requests': [
+        {'path': '/api/user/ingredients?limit=20'},
+        {'path': '/api/recipe/filters'},
+        {'path': '/api/tips?type=translation'},
+        {'path': '/api/pantry/items?type=ingredient'},
+    ]}}),
+]
+
+
+def percentile(sorted_values, p):
+    """最近秩法计算百分位数"""
+    if not sorted_values:
+        return None
+    rank = math.ceil(p / 100 * len(sorted_values))
+    return sorted_values[min(max(rank, 1), len(sorted_values)) - 1]
+
+
+def summarize(latencies, errors, elapsed):
+    values = sorted(latencies)
+    ms = lambda v: round(v * 1000, 3) if v is not None else None
+    return {
+        'requests': len(values),
+        'errors': errors,
+        'error_rate': round(errors / len(values), 4) if values else 0.0,
+        'throughput_rps': round(len(values) / elapsed, 2) if elapsed else 0.0,
+        'mean_ms': ms(sum(values) / len(values)) if values else None,
+        'p50_ms': ms(percentile(values, 50)),
+        'p95_ms': ms(percentile(values, 95)),
+        'p99_ms': ms(percentile(values, 99)),
+        'max_ms': ms(values[-1]) if values else None
+    }
+
+
+def run_scenario(base_url, scenario, concurrency, duration, max_requests=None, seed=0, stop=None):
+    """
+    以 concurrency 个线程持续请求 duration 秒（或共 max_requests 次），5xx和连接错误计为错误
+    stop: 可选的 threading.Event，设置后提前结束
+    """
+    lock = threading.Lock()
+    latencies = []
+    errors = [0]
+    issued = [0]
+    deadline = time.perf_counter() + duration
+
+    def take_ticket():
+        with lock:
+            if max_requests is not None and issued[0] >= max_requests:
+                return None
+            issued[0] += 1
+            return issued[0]
+
+    def worker(index):
+        rng = random.Random(f'{seed}:{scenario.name}:{index}')
+        session = requests.Session()
+        while time.perf_counter() < deadline and not (stop is not None and stop.is_set()):
+            n = take_ticket()
+            if n is None:
+                break
+            path = scenario.path
+            start = None
+            try:
+                if scenario.prepare is not None:
+                    path = path.replace('{id}', str(scenario.prepare(session, base_url, rng)))
+                kwargs = scenario.request(rng, n)
+                start = time.perf_counter()
+                response = session.request(scenario.method, base_url + path, stream=scenario.stream, timeout=120, **kwargs)
+                for _ in response.iter_content(chunk_size=None):
+                    pass
+                failed = response.status_code >= 500
+            except (requests.RequestException, ValueError):
+                failed = True
+            elapsed = time.perf_counter() - start if start is not None else None
+            with lock:
+                # 准备步骤失败时只计错误，不计延迟
+                if elapsed is not None:
+                    latencies.append(elapsed)
+                errors[0] += failed
+        session.close()
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return summarize(latencies, errors[0], time.perf_counter() - started)
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_until_ready(base_url, process=None, timeout=300):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f'应用进程已退出，返回码 {process.returncode}')
+        try:
+            if requests.get(base_url + '/api/tips?type=oil', timeout=2).status_code == 200:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError('等待应用启动超时')
+
+
+def start_background(base_url, scenario, concurrency, seed=0):
+    """在后台持续压测一个接口直到调用返回的 stop()，stop() 返回该接口的统计结果"""
+    stop = threading.Event()
+    result = {}
+    thread = threading.Thread(target=lambda: result.update(
+        run_scenario(base_url, scenario, concurrency, math.inf, seed=seed, stop=stop)
+    ))
+    thread.start()
+
+    def finish():
+        stop.set()
+        thread.join()
+        return result
+    return finish
+
+
+def start_app(data_dir, env_overrides, server_args=()):
+    """在子进程中启动应用，返回 (进程, base_url)"""
+    port = _free_port()
+    env = dict(os.environ, DATA_DIR=data_dir, **env_overrides)
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'benchmarks.server', '--port', str(port), *server_args],
+        cwd=BACKEND_DIR, env=env, stdout=sys.stderr
+    )
+    base_url = f'http://127.0.0.1:{port}'
+    try:
+        wait_until_ready(base_url, process)
+    except Exception:
+        process.kill()
+        raise
+    return process, base_url
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=BACKEND_DIR,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except Exception:
+        return None
+
+
+def compare(baseline, current, max_regression):
+    """逐接口对比p95延迟和吞吐量，返回退化超过阈值的接口列表"""
+    regressions = []
+    print(f"{'route':<28}{'p95 base':>12}{'p95 now':>12}{'change':>10}{'rps base':>12}{'rps now':>12}")
+    for name, result in current['routes'].items():
+        base = baseline.get('routes', {}).get(name)
+        if not base or not base.get('p95_ms') or result.get('p95_ms') is None:
+            continue
+        change = result['p95_ms'] / base['p95_ms'] - 1
+        print(f"{name:<28}{base['p95_ms']:>12}{result['p95_ms']:>12}{change:>+10.1%}"
+              f"{base['throughput_rps']:>12}{result['throughput_rps']:>12}")
+        if change > max_regression:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='并发压测 /api/* 接口')
+    parser.add_argument('--scale', default='1k', help='数据集规模：1k、100k、1m 或具体记录数')
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--data-dir', help='使用（或生成到）指定的数据目录，默认使用临时目录')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=5.0, help='每个接口的压测时长（秒）')
+    parser.add_argument('--requests', type=int, help='每个接口的最大请求数')
+    parser.add_argument('--routes', help='只压测指定接口（逗号分隔）')
+    parser.add_argument('--target', help='压测已运行的服务（如 http://127.0.0.1:5001），不启动应用和模拟上游')
+    parser.add_argument('--doubao-latency', type=float, default=0.2)
+    parser.add_argument('--baidu-latency', type=float, default=0.05)
+    parser.add_argument('--jitter', type=float, default=0.05)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--storage', choices=('json', 'sqlite'), default='json', help='应用使用的存储后端')
+    parser.add_argument('--worker', choices=('gevent', 'threads'),
+                        help='应用的服务器并发模式（见 serve.py），默认使用Werkzeug开发服务器')
+    parser.add_argument('--threads', type=int, default=16, help='threads模式的工作线程数')
+    parser.add_argument('--max-connections', type=int, default=1000, help='gevent模式同时处理的连接数上限')
+    parser.add_argument('--background', help='压测期间在后台持续请求的接口及并发数，如 recipe_ai_generate:64')
+    parser.add_argument('--env', action='append', default=[], help='传给应用进程的环境变量 KEY=VALUE，可重复')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='结果JSON的输出路径，默认打印到标准输出')
+    parser.add_argument('--compare', help='与之前的结果JSON对比')
+    parser.add_argument('--max-regression', type=float, default=0.2, help='p95延迟允许的最大退化比例')
+    args = parser.parse_args()
+
+    scenarios = SCENARIOS
+    if args.routes:
+        wanted = set(args.routes.split(','))
+        scenarios = [s for s in SCENARIOS if s.name in wanted]
+    background = None
+    if args.background:
+        name, _, background_concurrency = args.background.partition(':')
+        background = next((s for s in SCENARIOS if s.name == name), None)
+        if background is None:
+            parser.error(f'未知的接口: {name}')
+        background_concurrency = int(background_concurrency or args.concurrency)
+
+    config = {
+        'scale': args.scale, 'users': args.users, 'concurrency': args.concurrency,
+        'duration': args.duration, 'requests': args.requests, 'seed': args.seed,
+        'doubao_latency': args.doubao_latency, 'baidu_latency': args.baidu_latency,
+        'jitter': args.jitter, 'error_rate': args.error_rate, 'storage': args.storage, 'env': args.env,
+        'worker': args.worker, 'threads': args.threads if args.worker == 'threads' else None,
+        'max_connections': args.max_connections if args.worker == 'gevent' else None,
+        'background': args.background
+    }
+
+    cleanup = []
+    try:
+        if args.target:
+            base_url = args.target.rstrip('/')
+        else:
+            data_dir = args.data_dir
+            if data_dir is None:
+                data_dir = tempfile.mkdtemp(prefix='forbites-bench-')
+                cleanup.append(lambda: shutil.rmtree(data_dir, ignore_errors=True))
+            if not os.path.exists(os.path.join(data_dir, 'recipes.json')):
+                print(f'生成 {args.scale} 规模数据集到 {data_dir} ...', file=sys.stderr)
+                datagen.generate(data_dir, args.scale, args.users, args.seed)
+
+            doubao = FakeUpstreamServer(latency=args.doubao_latency, jitter=args.jitter, error_rate=args.error_rate).start()
+            baidu = FakeUpstreamServer(latency=args.baidu_latency, jitter=args.jitter, error_rate=args.error_rate).start()
+            cleanup.extend([doubao.stop, baidu.stop])
+
+            env = upstream_env(doubao, baidu)
+            if args.storage == 'sqlite':
+                db_path = os.path.join(data_dir, 'forbites.db')
+                if not os.path.exists(db_path):
+                    print('迁移数据集到SQLite ...', file=sys.stderr)
+                    migrate_storage.migrate(data_dir, db_path)
+                env.update(STORAGE_BACKEND='sqlite', SQLITE_PATH=db_path)
+            env.update(item.split('=', 1) for item in args.env)
+            server_args = []
+            if args.worker:
+                server_args = ['--worker', args.worker, '--threads', str(args.threads),
+                               '--max-connections', str(args.max_connections)]
+            process, base_url = start_app(data_dir, env, server_args)
+            cleanup.append(lambda: (process.terminate(), process.wait()))
+
+        routes = {}
+        stop_background = None
+        if background is not None:
+            print(f'后台持续请求 {background.name}（并发 {background_concurrency}）...', file=sys.stderr)
+            stop_background = start_background(base_url, background, background_concurrency, args.seed)
+            cleanup.append(stop_background)
+        for scenario in scenarios:
+            print(f'压测 {scenario.name} ...', file=sys.stderr)
+            routes[scenario.name] = run_scenario(
+                base_url, scenario, args.concurrency, args.duration, args.requests, args.seed
+            )
+        if stop_background is not None:
+            cleanup.remove(stop_background)
+            routes[f'{background.name} (background)'] = stop_background()
+    finally:
+        for action in reversed(cleanup):
+            action()
+
+    result = {
+        'meta': {
+            'timestamp': datetime.utcnow().isoformat(),
+            'git_commit': git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'target': args.target,
+            'config': config
+        },
+        'routes': routes
+    }
+
+    output = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output)
+    else:
+        print(output)
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, result, args.max_regression)
+        if regressions:
+            print(f"p95延迟退化超过 {args.max_regression:.0%} 的接口: {', '.join(regressions)}", file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
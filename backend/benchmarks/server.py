@@ -0,0 +1,51 @@
+"""
+压测用的应用进程：加载 app.py 并以多线程WSGI服务器运行
+数据目录和上游地址通过环境变量（DATA_DIR、DOUBAO_API_URL、BAIDU_*）指定
+--worker 指定时使用 serve.py 的部署模式（gevent / 固定线程数），否则使用Werkzeug开发服务器（每个连接一个线程）
+
+python -m benchmarks.server --port 5101 [--worker gevent]
+"""
+
+import sys
+import signal
+import logging
+import argparse
+
+import serve
+
+
+def main():
+    parser = argparse.ArgumentParser(description='压测用的应用进程')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5101)
+    serve.add_server_arguments(parser)
+    parser.set_defaults(worker=None)
+    args = parser.parse_args()
+
+    if args.worker == 'gevent':
+        serve.patch_for_gevent()
+
+    import app as forbites
+    from werkzeug.serving import run_simple
+    from wsgi_server import make_server, exit_on_sigterm
+
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    forbites.app.logger.setLevel(logging.WARNING)
+    forbites.seed_database()
+    # 预热共享集合的索引（搜索索引已持久化时直接加载），压测测量稳定状态而不是首次构建
+    forbites.get_recipe_index()
+    forbites.get_search_index('recipes')
+    # 接管重启前遗留的后台任务
+    forbites.job_queue.start()
+    # 收到SIGTERM时正常退出，执行退出钩子（如停止后台任务、搜索索引写盘）
+    if args.worker is None:
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        run_simple(args.host, args.port, forbites.app, threaded=True)
+    else:
+        server = make_server(forbites.app, args.host, args.port, args.worker, args.threads, args.max_connections)
+        exit_on_sigterm(server, args.worker)
+        server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
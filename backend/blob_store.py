@@ -0,0 +1,78 @@
+"""
+内容寻址的二进制存储（知识库图片等）
+以内容的SHA-256作为文件名，相同内容只保存一份；JSON集合中只保留引用
+"""
+
+import os
+import re
+import json
+import base64
+import hashlib
+import binascii
+import threading
+
+from journal_store import write_json_atomic
+
+DIGEST_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+DATA_URL_PATTERN = re.compile(r'^data:([\w.+-]+/[\w.+-]+)?((?:;[^,;]*)*?);base64,(.*)$', re.DOTALL)
+# 只接受位图格式：text/html、image/svg+xml 等类型从API域名返回时可以执行脚本
+IMAGE_CONTENT_TYPES = ('image/png', 'image/jpeg', 'image/gif', 'image/webp')
+
+
+class UnsupportedImageType(ValueError):
+    """data URL声明的类型不是允许的图片格式"""
+
+
+def parse_data_url(value):
+    """解析Base64编码的data URL，返回 (content_type, bytes)；不是data URL时返回None"""
+    if not isinstance(value, str) or not value.startswith('data:'):
+        return None
+    match = DATA_URL_PATTERN.match(value)
+    if not match:
+        return None
+    try:
+        content = base64.b64decode(match.group(3), validate=True)
+    except (binascii.Error, ValueError):
+        return None
+    return match.group(1) or 'application/octet-stream', content
+
+
+class BlobStore:
+    """
+    directory/<摘要前两位>/<摘要>       内容
+    directory/<摘要前两位>/<摘要>.json  元数据（content_type, size）
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, digest):
+        return os.path.join(self.directory, digest[:2], digest)
+
+    def put(self, content, content_type='application/octet-stream'):
+        """保存内容并返回摘要；内容已存在时不重复写入"""
+        digest = hashlib.sha256(content).hexdigest()
+        path = self.path(digest)
+        if os.path.exists(path):
+            return digest
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # 先写元数据，内容文件出现即表示写入完整
+        write_json_atomic(path + '.json', {'content_type': content_type, 'size': len(content)}, indent=None)
+        tmp_path = f'{path}.tmp-{os.getpid()}-{threading.get_ident()}'
+        with open(tmp_path, 'wb') as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        return digest
+
+    def meta(self, digest):
+        """返回元数据；摘要格式不对或内容不存在时返回None"""
+        if not DIGEST_PATTERN.match(digest) or not os.path.exists(self.path(digest)):
+            return None
+        try:
+            with open(self.path(digest) + '.json', 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {'content_type': 'application/octet-stream', 'size': os.path.getsize(self.path(digest))}
@@ -0,0 +1,85 @@
+"""
+集合数据内存缓存
+"""
+
+import os
+import threading
+
+
+def file_signature(path):
+    """返回文件签名 (mtime_ns, size, inode)，文件不存在时返回None"""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+
+class CollectionCache:
+    """
+    按集合名（DATA_FILES的键）缓存解析后的数据
+    - 本进程写入后直接更新缓存
+    - 其他进程修改文件时，通过mtime/size变化检测并失效
+    - 每次内容变化版本号加一，调用方可据此判断数据是否更新
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._entries = {}     # key -> (signature, data)
+        self._signatures = {}  # key -> 最近一次观察到的文件签名
+        self._versions = {}    # key -> 版本号
+
+    def _observe(self, key, signature):
+        """记录文件签名，签名变化时失效缓存并递增版本号（需持有锁）"""
+        if key in self._signatures and self._signatures[key] == signature:
+            return
+        self._signatures[key] = signature
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] != signature:
+            del self._entries[key]
+        self._versions[key] = self._versions.get(key, 0) + 1
+
+    def lookup(self, key, path):
+        """
+        查询缓存
+        返回 (signature, data)，缓存未命中时data为None；
+        调用方应在读取文件后用同一个signature调用store
+        """
+        signature = file_signature(path)
+        with self._lock:
+            self._observe(key, signature)
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == signature:
+                return signature, entry[1]
+        return signature, None
+
+    def store(self, key, signature, data):
+        """缓存从文件读取到的数据，signature为读取前的文件签名"""
+        with self._lock:
+            if self._signatures.get(key) == signature:
+                self._entries[key] = (signature, data)
+
+    def store_written(self, key, path, data):
+        """本进程写入文件后更新缓存并递增版本号"""
+        signature = file_signature(path)
+        with self._lock:
+            self._signatures[key] = signature
+            self._entries[key] = (signature, data)
+            self._versions[key] = self._versions.get(key, 0) + 1
+            return self._versions[key]
+
+    def invalidate(self, key=None):
+        """失效指定集合（或全部集合）的缓存"""
+        with self._lock:
+            keys = [key] if key is not None else list(self._entries)
+            for k in keys:
+                self._entries.pop(k, None)
+                self._signatures.pop(k, None)
+                self._versions[k] = self._versions.get(k, 0) + 1
+
+    def version(self, key, path):
+        """返回集合当前版本号（会先检查文件是否被外部修改）"""
+        signature = file_signature(path)
+        with self._lock:
+            self._observe(key, signature)
+            return self._versions[key]
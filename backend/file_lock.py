@@ -0,0 +1,86 @@
+"""
+跨进程文件锁
+"""
+
+import os
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+class FileLock:
+    """
+    基于锁文件的独占锁（POSIX下使用flock，Windows下使用msvcrt.locking）
+    用法：with FileLock(path): ...
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._fd = None
+
+    def acquire(self):
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            else:
+                msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+        except Exception:
+            os.close(fd)
+            raise
+        self._fd = fd
+
+    def release(self):
+        fd, self._fd = self._fd, None
+        if fd is None:
+            return
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            else:
+                os.lseek(fd, 0, os.SEEK_SET)
+                msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+        finally:
+            os.close(fd)
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+
+
+class CollectionLock:
+    """
+    集合锁：同一进程内可重入（线程锁），不同进程之间通过文件锁互斥
+    同一线程嵌套获取时只在最外层加文件锁，避免对同一文件重复flock造成死锁
+    """
+
+    def __init__(self, path):
+        self._rlock = threading.RLock()
+        self._file_lock = FileLock(path)
+        self._depth = 0
+
+    def __enter__(self):
+        self._rlock.acquire()
+        if self._depth == 0:
+            try:
+                self._file_lock.acquire()
+            except Exception:
+                self._rlock.release()
+                raise
+        self._depth += 1
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._depth -= 1
+        try:
+            if self._depth == 0:
+                self._file_lock.release()
+        finally:
+            self._rlock.release()
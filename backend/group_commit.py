@@ -0,0 +1,67 @@
+"""
+组提交
+短时间窗口内到达的多个修改合并为一次 读取-修改-保存，只写一次盘
+"""
+
+import threading
+import time
+
+
+class _Waiter:
+    def __init__(self, mutate):
+        self.mutate = mutate
+        self.event = threading.Event()
+        self.leader = False
+        self.outcome = None
+
+
+class GroupCommitter:
+    """
+    第一个到达的请求成为leader：等待window秒收集其他修改，然后整批提交；
+    提交期间到达的修改进入下一批，由其中第一个请求接任leader
+    commit_batch(mutations) 返回 (是否保存成功, [(结果, 异常), ...])
+    """
+
+    def __init__(self, commit_batch, window=0.005):
+        self.commit_batch = commit_batch
+        self.window = window
+        self._lock = threading.Lock()
+        self._pending = []
+        self._busy = False
+
+    def submit(self, mutate):
+        """提交一个修改并等待所在批次完成，返回 (是否保存成功, (结果, 异常))"""
+        waiter = _Waiter(mutate)
+        with self._lock:
+            self._pending.append(waiter)
+            if not self._busy:
+                self._busy = True
+                waiter.leader = True
+        if not waiter.leader:
+            waiter.event.wait()
+        if waiter.outcome is None:
+            self._lead()
+        return waiter.outcome
+
+    def _lead(self):
+        if self.window:
+            time.sleep(self.window)
+        with self._lock:
+            batch, self._pending = self._pending, []
+        try:
+            saved, outcomes = self.commit_batch([w.mutate for w in batch])
+            for waiter, outcome in zip(batch, outcomes):
+                waiter.outcome = (saved, outcome)
+        except Exception as e:
+            for waiter in batch:
+                waiter.outcome = (False, (None, e))
+        finally:
+            with self._lock:
+                if self._pending:
+                    # 把leader交给下一批中最早到达的请求
+                    self._pending[0].leader = True
+                    self._pending[0].event.set()
+                else:
+                    self._busy = False
+            for waiter in batch:
+                waiter.event.set()
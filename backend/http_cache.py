@@ -0,0 +1,125 @@
+"""
+HTTP条件请求、响应缓存与压缩
+- ETag由集合的数据签名和请求参数计算，与进程无关，多进程部署时同样有效
+- 序列化（及压缩）后的响应体按ETag缓存，数据不变时直接复用；集合写入后按标签清除
+- jsonify 在安装了orjson时使用orjson序列化
+"""
+
+import gzip
+import hashlib
+import threading
+from collections import OrderedDict
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import brotli
+except ImportError:  # brotli为可选依赖，未安装时只使用gzip
+    brotli = None
+
+try:
+    import orjson
+except ImportError:  # orjson为可选依赖，未安装时使用标准库json
+    orjson = None
+
+
+def make_etag(*parts):
+    """由任意可序列化为字符串的部分生成ETag值"""
+    raw = '\x1f'.join(repr(part) for part in parts)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()[:32]
+
+
+def available_encodings():
+    """按优先级排列的可用压缩编码"""
+    return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+def choose_encoding(accept_encodings):
+    """根据请求的 Accept-Encoding（werkzeug的MIMEAccept对象）选择压缩编码，不接受压缩时返回None"""
+    for encoding in available_encodings():
+        if accept_encodings[encoding]:
+            return encoding
+    return None
+
+
+def compress(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body, quality=5)
+    return gzip.compress(body, compresslevel=6)
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """
+    jsonify 的序列化：安装了orjson时用orjson直接生成bytes（紧凑格式、UTF-8），
+    orjson不支持的对象（如超出64位的整数）和调试模式下的格式化输出仍使用标准库json
+    """
+
+    def response(self, *args, **kwargs):
+        if orjson is None or self.compact is False or (self.compact is None and self._app.debug):
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        try:
+            body = orjson.dumps(
+                obj, default=self.default,
+                option=orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_APPEND_NEWLINE
+            )
+        except TypeError:
+            return super().response(*args, **kwargs)
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+
+class EncodedResponseCache:
+    """
+    (ETag, 编码) -> 响应体，编码为None时是未压缩的原始响应体；按总字节数做LRU淘汰
+    ETag随数据版本变化，旧版本的条目不会再被命中；
+    条目可带标签（如响应读取的集合），数据写入后用 invalidate(标签) 立即释放
+    """
+
+    def __init__(self, max_bytes=32 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # (ETag, 编码) -> (响应体, Content-Type, 标签)
+        self._tags = {}                # 标签 -> {(ETag, 编码), ...}
+        self._size = 0
+
+    def get(self, etag, encoding):
+        """返回 (响应体, Content-Type)，未命中时返回None"""
+        with self._lock:
+            entry = self._entries.get((etag, encoding))
+            if entry is None:
+                return None
+            self._entries.move_to_end((etag, encoding))
+            return entry[0], entry[1]
+
+    def _discard(self, key):
+        """删除一个条目（需持有锁）"""
+        body, _, tags = self._entries.pop(key)
+        self._size -= len(body)
+        for tag in tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    def set(self, etag, encoding, body, content_type, tags=()):
+        if len(body) > self.max_bytes:
+            return
+        key = (etag, encoding)
+        with self._lock:
+            if key in self._entries:
+                self._discard(key)
+            self._entries[key] = (body, content_type, tuple(tags))
+            self._size += len(body)
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            while self._size > self.max_bytes:
+                self._discard(next(iter(self._entries)))
+
+    def invalidate(self, tag):
+        """删除带有该标签的全部条目，返回删除数"""
+        with self._lock:
+            keys = list(self._tags.get(tag, ()))
+            for key in keys:
+                self._discard(key)
+            return len(keys)
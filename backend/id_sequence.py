@@ -0,0 +1,53 @@
+"""
+持久化ID序列
+每个集合一个序列文件，记录已分配的最大ID；分配时只读写这个小文件，
+不再每次全量加载集合求max(id)
+"""
+
+import os
+import threading
+
+from file_lock import FileLock
+
+
+class IdSequence:
+    """
+    集合ID分配器，进程内用线程锁、进程间用文件锁保证不重复分配
+    initial: 序列文件不存在时调用，返回当前已使用的最大ID
+    """
+
+    def __init__(self, path, initial=None):
+        self.path = path
+        self.initial = initial
+        self._lock = threading.Lock()
+        self._file_lock = FileLock(f"{path}.lock")
+
+    def _read(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return int(f.read().strip())
+        except (FileNotFoundError, ValueError):
+            return self.initial() if self.initial else 0
+
+    def _write(self, value):
+        fd = os.open(self.path, os.O_WRONLY | os.O_CREAT, 0o644)
+        try:
+            data = str(value).encode('utf-8')
+            os.ftruncate(fd, 0)
+            os.write(fd, data)
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def reserve(self, n):
+        """一次分配n个连续ID，返回range"""
+        if n <= 0:
+            return range(0)
+        with self._lock, self._file_lock:
+            last = self._read()
+            self._write(last + n)
+        return range(last + 1, last + n + 1)
+
+    def next(self):
+        """分配一个ID"""
+        return self.reserve(1)[0]
@@ -34,7 +34,16 @@ def main():
     
     # 可选依赖（语音识别相关）
     # 注意：语音识别功能使用百度智能云API，不需要本地语音识别库
-    optional_packages = []
+    # numpy 用于识别前的音频预处理（静音裁剪、重采样），未安装时直接发送原始音频
+    # brotli 用于响应压缩，未安装时只使用gzip
+    # orjson 用于更快的JSON序列化，未安装时使用标准库json
+    # gevent 用于 serve.py 的 gevent 并发模式，未安装时只能使用固定线程数模式
+    optional_packages = [
+        "numpy",
+        "brotli",
+        "orjson",
+        "gevent"
+    ]
     
     print("安装核心依赖...")
     core_success = 0
@@ -50,6 +59,10 @@ def main():
         print("\n❌ 核心依赖安装失败，请检查网络连接或Python环境。")
         return False
     
+    print("\n安装可选依赖...")
+    for package in optional_packages:
+        install_package(package)
+    
     print("\n语音识别功能说明...")
     print("✓ 语音识别功能使用百度智能云API实现")
     print("✓ 不需要本地语音识别库")
@@ -0,0 +1,343 @@
+"""
+后台任务队列
+耗时的大模型/语音识别请求作为任务提交后立即返回任务ID，由工作线程池在后台执行，结果通过轮询或SSE获取
+- 每个任务一个JSON文件（<directory>/<任务ID>.json），任何进程都能查询任务状态
+- 按优先级执行：interactive（如语音识别）先于 normal，normal 先于 bulk（如批量存储建议），同级按提交顺序
+- 客户端提供幂等键时任务ID由（用户, 幂等键）决定，重试提交返回同一个任务，不会重复执行；
+  失败的任务不占用幂等键，用同一幂等键重新提交时失败记录改存到随机ID下，再创建新任务
+- 工作线程由服务进程显式 start() 启动（或第一次提交任务时启动），导入模块本身没有副作用
+- 进程退出时先停止取任务，等待执行中的任务完成；停止期间失败的任务（如线程池已关闭）放回排队状态
+- 进程重启后，原进程已退出的排队任务由新进程接管；执行到一半的任务标记为失败（interrupted），
+  不自动重跑，避免重复产生副作用（如重复保存菜谱）
+"""
+
+import os
+import json
+import time
+import uuid
+import heapq
+import hashlib
+import logging
+import threading
+from datetime import datetime
+
+from file_lock import FileLock
+from journal_store import write_json_atomic
+
+logger = logging.getLogger(__name__)
+
+PRIORITIES = {'interactive': 0, 'normal': 1, 'bulk': 2}
+FINISHED = ('succeeded', 'failed')
+
+
+def job_id_for_key(user_id, idempotency_key):
+    """幂等键 -> 任务ID，不同用户的相同幂等键互不影响"""
+    raw = f'{user_id}\x1f{idempotency_key}'
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()[:32]
+
+
+def _process_alive(pid):
+    if pid == os.getpid():
+        # 与当前进程PID相同的记录来自重启前的进程（容器中PID经常相同）
+        return False
+    if os.name == 'nt':
+        # Windows下 os.kill 会结束进程，无法用来探测；开发环境按单进程处理
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class JobConflict(ValueError):
+    """同一幂等键提交了不同的请求"""
+
+
+class JobQueue:
+    """
+    runner(job): 执行任务，返回结果（可JSON序列化）；抛出异常时任务失败
+    is_success(result): 根据结果判断任务是否成功，默认总是成功
+    workers: 工作线程数；retention: 已完成任务的保留时间（秒）
+    stop_timeout: 进程退出时等待执行中任务的时间（秒）
+    """
+
+    def __init__(self, directory, runner, workers=4, retention=86400, is_success=None, stop_timeout=10.0):
+        self.directory = directory
+        self.runner = runner
+        self.workers = workers
+        self.retention = retention
+        self.is_success = is_success or (lambda result: True)
+        self.stop_timeout = stop_timeout
+        os.makedirs(directory, exist_ok=True)
+
+        self._cond = threading.Condition()
+        self._heap = []  # (优先级, 序号, 任务ID)
+        self._seq = 0
+        self._threads = []
+        self._start_lock = threading.Lock()
+        self._running = 0
+        self._stopping = False
+        self._last_cleanup = 0.0
+
+    def _path(self, job_id):
+        return os.path.join(self.directory, f'{job_id}.json')
+
+    def _write(self, job):
+        write_json_atomic(self._path(job['id']), job, indent=None)
+        with self._cond:
+            self._cond.notify_all()
+
+    def _create(self, job):
+        """原子地创建任务文件，已存在时返回False（先写临时文件再硬链接到目标路径）"""
+        path = self._path(job['id'])
+        tmp_path = f"{path}.tmp-{os.getpid()}-{threading.get_ident()}"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(job, f, ensure_ascii=False)
+                f.flush()
+                os.fsync(f.fileno())
+            try:
+                os.link(tmp_path, path)
+            except FileExistsError:
+                return False
+            return True
+        finally:
+            os.remove(tmp_path)
+
+    def get(self, job_id):
+        """读取任务，不存在时返回None"""
+        if not all(c in '0123456789abcdef' for c in job_id):
+            return None
+        try:
+            with open(self._path(job_id), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except ValueError as e:
+            logger.warning(f"任务文件无法读取: {job_id}: {e}")
+            return None
+
+    # --- 提交 ---
+
+    def submit(self, request, user_id, priority='normal', idempotency_key=None):
+        """
+        提交任务，返回 (任务, 是否新建)
+        request: 任务内容（交给runner执行）；同一幂等键对应不同的request时抛出 JobConflict
+        """
+        if priority not in PRIORITIES:
+            raise ValueError(f'未知的优先级: {priority}')
+        job_id = job_id_for_key(user_id, idempotency_key) if idempotency_key else uuid.uuid4().hex
+        job = {
+            'id': job_id,
+            'user_id': user_id,
+            'status': 'queued',
+            'priority': priority,
+            'request': request,
+            'idempotency_key': idempotency_key,
+            'result': None,
+            'error': None,
+            'owner': os.getpid(),
+            'created_at': datetime.utcnow().isoformat(),
+            'started_at': None,
+            'finished_at': None
+        }
+        self.start()
+        while not self._create(job):
+            existing = self.get(job_id)
+            if existing is None:
+                # 文件刚被清理或释放，重新创建
+                continue
+            if existing['status'] == 'failed':
+                self._release(existing)
+                continue
+            if existing['request'] != request:
+                raise JobConflict('该幂等键已用于不同的请求')
+            return existing, False
+        self._enqueue(job)
+        return job, True
+
+    def _release(self, job):
+        """
+        把失败的任务改存到随机ID下，释放它占用的幂等键
+        并发重试时只有一个提交能移走原文件，其他提交随后会看到新创建的任务
+        """
+        archived_id = uuid.uuid4().hex
+        with FileLock(os.path.join(self.directory, '.release.lock')):
+            # 加锁后重新读取，避免把其他提交刚创建的新任务移走
+            current = self.get(job['id'])
+            if current is None or current['status'] != 'failed':
+                return
+            os.rename(self._path(job['id']), self._path(archived_id))
+        write_json_atomic(self._path(archived_id), {**current, 'id': archived_id, 'idempotency_key': None}, indent=None)
+
+    def _enqueue(self, job):
+        with self._cond:
+            self._seq += 1
+            heapq.heappush(self._heap, (PRIORITIES[job['priority']], self._seq, job['id']))
+            self._cond.notify_all()
+
+    # --- 执行 ---
+
+    def start(self):
+        """接管已退出进程遗留的任务、清理过期任务并启动工作线程；重复调用无效"""
+        with self._start_lock:
+            if self._threads:
+                return
+            self._start_workers()
+
+    def _start_workers(self):
+        # 解释器退出时在 ThreadPoolExecutor 关闭之前停止取任务：线程池同样通过 threading._register_atexit
+        # 注册退出钩子，钩子按注册的逆序执行，而 atexit 回调要等这些钩子执行完才执行
+        try:
+            threading._register_atexit(self.stop)
+        except RuntimeError:
+            # 解释器已经在退出，不再启动工作线程，任务留给下一个进程
+            return
+        self._recover()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f'job-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        """停止分配新任务，最多等待 stop_timeout 秒让执行中的任务完成；未执行的任务留给下一个进程"""
+        deadline = time.monotonic() + self.stop_timeout
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+            while self._running:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    logger.warning(f"进程退出时仍有 {self._running} 个任务在执行")
+                    break
+                self._cond.wait(remaining)
+
+    def _recover(self):
+        now = time.time()
+        # 多个进程同时启动时只有一个进程接管同一个任务
+        with FileLock(os.path.join(self.directory, '.recover.lock')):
+            for name in os.listdir(self.directory):
+                if not name.endswith('.json'):
+                    continue
+                job = self.get(name[:-len('.json')])
+                if job is None:
+                    continue
+                if job['status'] in FINISHED:
+                    if self._expired(job):
+                        self._remove(job['id'])
+                    continue
+                if _process_alive(job.get('owner', 0)):
+                    continue
+                if job['status'] == 'running':
+                    self._finish(job, 'failed', error='interrupted')
+                else:
+                    job = {**job, 'owner': os.getpid()}
+                    write_json_atomic(self._path(job['id']), job, indent=None)
+                    self._enqueue(job)
+        self._last_cleanup = now
+
+    def _expired(self, job):
+        finished_at = datetime.fromisoformat(job['finished_at'] or job['created_at'])
+        return (datetime.utcnow() - finished_at).total_seconds() > self.retention
+
+    def _remove(self, job_id):
+        try:
+            os.remove(self._path(job_id))
+        except FileNotFoundError:
+            pass
+
+    def _cleanup(self):
+        """每小时最多一次删除过期的已完成任务"""
+        now = time.time()
+        if now - self._last_cleanup < 3600:
+            return
+        self._last_cleanup = now
+        for name in os.listdir(self.directory):
+            if name.endswith('.json'):
+                job = self.get(name[:-len('.json')])
+                if job is not None and job['status'] in FINISHED and self._expired(job):
+                    self._remove(job['id'])
+
+    def _next(self):
+        """取下一个任务ID；停止后返回None"""
+        with self._cond:
+            while not self._heap and not self._stopping:
+                self._cond.wait()
+            if self._stopping:
+                return None
+            _, _, job_id = heapq.heappop(self._heap)
+            self._running += 1
+            return job_id
+
+    def _work(self):
+        while True:
+            job_id = self._next()
+            if job_id is None:
+                return
+            try:
+                job = self.get(job_id)
+                if job is None or job['status'] != 'queued':
+                    continue
+                job = {**job, 'status': 'running', 'started_at': datetime.utcnow().isoformat()}
+                self._write(job)
+                try:
+                    result = self.runner(job)
+                except Exception as e:
+                    if self._stopping:
+                        self._requeue(job, e)
+                    else:
+                        logger.error(f"任务执行失败: {job_id}: {e}")
+                        self._finish(job, 'failed', error=str(e))
+                else:
+                    if self.is_success(result):
+                        self._finish(job, 'succeeded', result=result)
+                    elif self._stopping:
+                        self._requeue(job, result)
+                    else:
+                        self._finish(job, 'failed', result=result)
+                self._cleanup()
+            finally:
+                with self._cond:
+                    self._running -= 1
+                    self._cond.notify_all()
+
+    def _requeue(self, job, reason):
+        """进程退出过程中失败的任务（依赖的线程池可能已关闭）放回排队状态，由下一个进程接管"""
+        logger.warning(f"进程退出中，任务放回队列: {job['id']}: {reason}")
+        self._write({**job, 'status': 'queued', 'started_at': None})
+
+    def _finish(self, job, status, result=None, error=None):
+        job = {**job, 'status': status, 'result': result, 'error': error,
+               'finished_at': datetime.utcnow().isoformat()}
+        self._write(job)
+        return job
+
+    # --- 查询 ---
+
+    def wait(self, job_id, status=None, timeout=30.0):
+        """
+        等待任务状态变为不同于 status 的值（或已完成），最多等待 timeout 秒，返回最新的任务
+        其他进程中的任务按1秒间隔重新读取
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            job = self.get(job_id)
+            if job is None or job['status'] != status or job['status'] in FINISHED:
+                return job
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return job
+            with self._cond:
+                self._cond.wait(min(remaining, 1.0))
+
+    def stats(self):
+        """排队中的任务数（按优先级）和执行中的任务数"""
+        with self._cond:
+            queued = {name: 0 for name in PRIORITIES}
+            names = {value: name for name, value in PRIORITIES.items()}
+            for priority, _, _ in self._heap:
+                queued[names[priority]] += 1
+            return {'queued': queued, 'running': self._running}
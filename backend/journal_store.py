@@ -0,0 +1,262 @@
+"""
+追加式日志存储引擎
+每个集合由一个快照文件（原JSON文件）和一个JSONL日志文件组成：
+- 写入时只向日志追加 insert/update/delete 记录
+- 日志过大时在后台线程中压缩为新快照（临时文件 + 原子重命名）
+- 启动时读取快照并重放日志完成恢复
+"""
+
+import os
+import json
+import logging
+import threading
+from contextlib import nullcontext
+
+from collection_cache import file_signature
+
+logger = logging.getLogger(__name__)
+
+
+def write_json_atomic(path, data, indent=2):
+    """先写临时文件再原子重命名，避免写入中途崩溃导致文件被截断"""
+    tmp_path = f"{path}.tmp-{os.getpid()}-{threading.get_ident()}"
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=indent)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def journal_path_for(snapshot_path):
+    """快照文件对应的日志文件路径，如 recipes.json -> recipes.journal.jsonl"""
+    base, _ = os.path.splitext(snapshot_path)
+    return f"{base}.journal.jsonl"
+
+
+class JournalStore:
+    """
+    单个集合的快照+日志存储
+    集合元素必须带有 'id' 字段；记录按 id 做 upsert/删除，重放是幂等的
+    注意：差异比较依赖对象身份，修改元素时应替换为新字典而不是原地修改
+    """
+
+    def __init__(self, snapshot_path, compact_records=1000, fsync=True, collection_lock=None):
+        self.snapshot_path = snapshot_path
+        self.journal_path = journal_path_for(snapshot_path)
+        self.compact_records = compact_records
+        self.fsync = fsync
+        # 跨进程的集合锁，压缩时替换日志文件需要排除其他进程的追加
+        self.collection_lock = collection_lock or nullcontext()
+
+        self._lock = threading.RLock()
+        self._records = None          # id -> record，保持插入顺序
+        self._snapshot_sig = None
+        self._journal_sig = None
+        self._journal_offset = 0      # 已应用到的日志字节偏移
+        self._journal_count = 0       # 日志中的记录数
+        self._version = 0
+        self._stale = False           # 检测到并发追加，下次读取时全量重放
+        self._compacting = False
+
+    # --- 读取与恢复 ---
+
+    def _read_snapshot(self):
+        if not os.path.exists(self.snapshot_path):
+            return {}
+        with open(self.snapshot_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        return {item['id']: item for item in data}
+
+    @staticmethod
+    def _apply(records, entry):
+        op = entry.get('op')
+        if op in ('insert', 'update'):
+            record = entry['record']
+            records[record['id']] = record
+        elif op == 'delete':
+            records.pop(entry['id'], None)
+
+    def _replay(self, records, start):
+        """从start偏移处重放日志中的完整行，返回 (新偏移, 应用记录数)"""
+        if not os.path.exists(self.journal_path):
+            return start, 0
+        applied = 0
+        with open(self.journal_path, 'rb') as f:
+            f.seek(start)
+            chunk = f.read()
+        end = chunk.rfind(b'\n') + 1  # 只消费完整的行，未写完的行留到下次
+        for line in chunk[:end].splitlines():
+            if not line.strip():
+                continue
+            try:
+                self._apply(records, json.loads(line))
+                applied += 1
+            except (ValueError, KeyError) as e:
+                logger.error(f"日志记录损坏，已跳过: {self.journal_path}: {e}")
+        return start + end, applied
+
+    def _full_load(self):
+        """读取快照并重放全部日志（需持有锁）"""
+        snapshot_sig = file_signature(self.snapshot_path)
+        records = self._read_snapshot()
+        offset, applied = self._replay(records, 0)
+        self._records = records
+        self._snapshot_sig = snapshot_sig
+        self._journal_sig = file_signature(self.journal_path)
+        self._journal_offset = offset
+        self._journal_count = applied
+        self._stale = False
+        self._version += 1
+
+    def _refresh(self):
+        """检查其他进程的修改：快照或日志被替换则全量加载，日志增长则只重放新增部分"""
+        if self._records is None or self._stale:
+            self._full_load()
+            return
+        snapshot_sig = file_signature(self.snapshot_path)
+        journal_sig = file_signature(self.journal_path)
+        if snapshot_sig != self._snapshot_sig:
+            self._full_load()
+            return
+        if journal_sig == self._journal_sig:
+            return
+        if (journal_sig is None or self._journal_sig is None
+                or journal_sig[2] != self._journal_sig[2]
+                or journal_sig[1] < self._journal_offset):
+            self._full_load()
+            return
+        offset, applied = self._replay(self._records, self._journal_offset)
+        self._journal_sig = journal_sig
+        if applied:
+            self._journal_offset = offset
+            self._journal_count += applied
+            self._version += 1
+
+    def recover(self):
+        """启动时恢复：重放日志，并截掉崩溃时写了一半的末尾记录"""
+        with self._lock:
+            if os.path.exists(self.journal_path):
+                with open(self.journal_path, 'rb+') as f:
+                    content = f.read()
+                    good = content.rfind(b'\n') + 1
+                    if good < len(content):
+                        logger.warning(f"截断未写完的日志记录: {self.journal_path}")
+                        f.truncate(good)
+            self._full_load()
+
+    def load(self):
+        """返回集合当前数据（列表）"""
+        with self._lock:
+            self._refresh()
+            return list(self._records.values())
+
+    @property
+    def version(self):
+        with self._lock:
+            self._refresh()
+            return self._version
+
+    # --- 写入 ---
+
+    def _diff(self, data):
+        """比较新旧数据，生成日志记录"""
+        entries = []
+        seen = set()
+        for item in data:
+            item_id = item['id']
+            seen.add(item_id)
+            old = self._records.get(item_id)
+            if old is None:
+                entries.append({'op': 'insert', 'record': item})
+            elif old is not item and old != item:
+                entries.append({'op': 'update', 'record': item})
+        for item_id in self._records:
+            if item_id not in seen:
+                entries.append({'op': 'delete', 'id': item_id})
+        return entries
+
+    def _append(self, entries):
+        """向日志追加记录（需持有锁），返回写入的字节数"""
+        payload = ''.join(
+            json.dumps(entry, ensure_ascii=False, separators=(',', ':')) + '\n'
+            for entry in entries
+        ).encode('utf-8')
+        fd = os.open(self.journal_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, payload)
+            if self.fsync:
+                os.fsync(fd)
+            end = os.lseek(fd, 0, os.SEEK_CUR)
+        finally:
+            os.close(fd)
+        if end - len(payload) != self._journal_offset:
+            # 其他进程在此期间也追加了记录，下次读取时全量重放
+            self._stale = True
+        self._journal_offset = end
+        self._journal_sig = file_signature(self.journal_path)
+        return len(payload)
+
+    def save(self, data):
+        """保存集合数据：只把与当前数据的差异追加到日志"""
+        with self._lock:
+            self._refresh()
+            entries = self._diff(data)
+            if not entries:
+                return 0
+            written = self._append(entries)
+            records = {}
+            for item in data:
+                records[item['id']] = item
+            self._records = records
+            self._journal_count += len(entries)
+            self._version += 1
+            if self._journal_count >= self.compact_records and not self._compacting:
+                self._compacting = True
+                threading.Thread(target=self._compact_in_background, daemon=True).start()
+            return written
+
+    # --- 压缩 ---
+
+    def _compact_in_background(self):
+        try:
+            self.compact()
+        except Exception as e:
+            logger.error(f"日志压缩失败: {self.snapshot_path}: {e}")
+        finally:
+            with self._lock:
+                self._compacting = False
+
+    def compact(self):
+        """
+        把当前数据写成新快照并清理已合并的日志
+        快照写入在锁外进行，不阻塞写请求；之后只保留压缩期间新追加的日志
+        重放幂等，因此任意一步崩溃后重放旧日志结果都不变
+        """
+        with self._lock:
+            self._refresh()
+            data = list(self._records.values())
+            offset = self._journal_offset
+            count = self._journal_count
+        write_json_atomic(self.snapshot_path, data)
+        with self.collection_lock, self._lock:
+            tail = b''
+            if os.path.exists(self.journal_path):
+                with open(self.journal_path, 'rb') as f:
+                    f.seek(offset)
+                    tail = f.read()
+            tmp_path = f"{self.journal_path}.tmp-{os.getpid()}"
+            with open(tmp_path, 'wb') as f:
+                f.write(tail)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.journal_path)
+            # 压缩期间本进程追加的记录已在内存中，其余新增部分下次读取时重放
+            self._snapshot_sig = file_signature(self.snapshot_path)
+            self._journal_sig = None
+            self._journal_offset = self._journal_offset - offset
+            self._journal_count = max(self._journal_count - count, 0)
+        logger.info(f"日志压缩完成: {self.snapshot_path}, 合并 {count} 条记录")
@@ -0,0 +1,142 @@
+"""
+流式JSON解析
+大模型逐段返回文本时，增量解析顶层JSON对象，字段一旦完整就产生事件
+"""
+
+import json
+
+
+def parse_model_json(text):
+    """解析模型返回的JSON，兼容包裹在 ```json 代码块或前后说明文字中的情况"""
+    try:
+        return json.loads(text)
+    except ValueError:
+        start, end = text.find('{'), text.rfind('}')
+        if start == -1 or end <= start:
+            raise
+        return json.loads(text[start:end + 1])
+
+
+class StreamingObjectParser:
+    """
+    增量解析顶层JSON对象
+    feed(text) 返回本次新完成的事件列表：
+    - ('field', key, value)：顶层字段的值已完整
+    - ('item', key, index, value)：数组字段中的一个元素已完整（先于该字段的 field 事件）
+    顶层对象之前的文字（如 ```json）会被忽略
+    """
+
+    def __init__(self):
+        self.text = ''
+        self._pos = 0
+        self._depth = 0
+        self._started = False
+        self._finished = False
+        self._in_string = False
+        self._escape = False
+        self._key = None
+        self._key_start = None
+        self._value_start = None
+        self._value_is_array = False
+        self._item_start = None
+        self._item_index = 0
+
+    def _end_field(self, end, events):
+        value = json.loads(self.text[self._value_start:end])
+        events.append(('field', self._key, value))
+        self._key = None
+        self._value_start = None
+        self._value_is_array = False
+
+    def _end_item(self, end, events):
+        value = json.loads(self.text[self._item_start:end])
+        events.append(('item', self._key, self._item_index, value))
+        self._item_index += 1
+        self._item_start = None
+
+    def _close_string(self, i, events):
+        if self._depth == 1:
+            if self._value_start is None:
+                self._key = json.loads(self.text[self._key_start:i + 1])
+                self._key_start = None
+            else:
+                self._end_field(i + 1, events)
+        elif self._depth == 2 and self._value_is_array and self._item_start is not None:
+            self._end_item(i + 1, events)
+
+    def feed(self, chunk):
+        self.text += chunk
+        events = []
+        text = self.text
+        for i in range(self._pos, len(text)):
+            c = text[i]
+            if self._finished:
+                break
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif c == '\\':
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+                    self._close_string(i, events)
+                continue
+            if not self._started:
+                if c == '{':
+                    self._started = True
+                    self._depth = 1
+                continue
+
+            if self._depth == 1:
+                if self._value_start is None:
+                    if c.isspace() or c in ':,':
+                        continue
+                    if c == '}':
+                        self._finished = True
+                        continue
+                    if c == '"' and self._key is None:
+                        self._key_start = i
+                        self._in_string = True
+                        continue
+                    # 字段值开始
+                    self._value_start = i
+                    if c == '"':
+                        self._in_string = True
+                    elif c in '[{':
+                        self._depth = 2
+                        self._value_is_array = c == '['
+                        self._item_start = None
+                        self._item_index = 0
+                elif c in ',}':
+                    # 数字、true/false/null 等字面量在分隔符处结束
+                    self._end_field(i, events)
+                    if c == '}':
+                        self._finished = True
+                continue
+
+            # depth >= 2：位于对象或数组类型的字段值内部
+            array_level = self._depth == 2 and self._value_is_array
+            if c in '[{':
+                if array_level and self._item_start is None:
+                    self._item_start = i
+                self._depth += 1
+            elif c in ']}':
+                if array_level and self._item_start is not None:
+                    self._end_item(i, events)
+                self._depth -= 1
+                if self._depth == 1:
+                    self._end_field(i + 1, events)
+                elif self._depth == 2 and self._value_is_array:
+                    self._end_item(i + 1, events)
+            elif c == '"':
+                if array_level and self._item_start is None:
+                    self._item_start = i
+                self._in_string = True
+            elif array_level:
+                if c == ',':
+                    if self._item_start is not None:
+                        self._end_item(i, events)
+                elif not c.isspace() and self._item_start is None:
+                    self._item_start = i
+        self._pos = len(text)
+        return events
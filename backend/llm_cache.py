@@ -0,0 +1,168 @@
+"""
+大模型响应缓存
+内存LRU + 磁盘持久化两级缓存，支持TTL过期和失败结果的短期负缓存
+读到已过期的磁盘条目时删除文件，写入时每小时最多一次清理其余过期文件
+"""
+
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+import unicodedata
+from collections import OrderedDict
+
+from journal_store import write_json_atomic
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_key_text(text):
+    """规范化缓存键文本：全角转半角、去首尾空白、转小写"""
+    return unicodedata.normalize('NFKC', str(text)).strip().lower()
+
+
+def make_cache_key(*parts):
+    """由多个部分（如模型、提示词版本、食材名）生成缓存键"""
+    raw = '\x1f'.join(normalize_key_text(part) for part in parts)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+class LLMCache:
+    """
+    directory: 磁盘缓存目录，每个键一个JSON文件
+    max_entries: 内存LRU最大条目数
+    ttl/negative_ttl: 正常结果/失败结果的有效期（秒）
+    """
+
+    def __init__(self, directory, max_entries=1000, ttl=30 * 86400, negative_ttl=300):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._last_purge = 0.0
+        self._memory = OrderedDict()  # key -> (expires_at, negative, value)
+        self._stats = {'hits': 0, 'disk_hits': 0, 'negative_hits': 0, 'misses': 0,
+                       'writes': 0, 'evictions': 0, 'expired': 0}
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], f'{key}.json')
+
+    def _remember(self, key, entry):
+        """放入内存LRU（需持有锁）"""
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self._stats['evictions'] += 1
+
+    def _read_disk(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                cached = json.load(f)
+            return (cached['expires_at'], cached['negative'], cached['value'])
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"读取缓存文件失败: {path}: {e}")
+            return None
+
+    def _remove_expired(self, path, now):
+        """删除已过期的缓存文件；删除前重新读取，避免删掉其他进程刚写入的新结果"""
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                if json.load(f)['expires_at'] > now:
+                    return False
+            os.remove(path)
+            return True
+        except FileNotFoundError:
+            return False
+        except Exception as e:
+            logger.warning(f"删除过期缓存文件失败: {path}: {e}")
+            return False
+
+    def purge_expired(self):
+        """删除所有已过期的缓存文件，返回删除的文件数"""
+        now = time.time()
+        removed = 0
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                if name.endswith('.json') and self._remove_expired(os.path.join(root, name), now):
+                    removed += 1
+        return removed
+
+    def get(self, key):
+        """
+        查询缓存，返回 (是否命中, 值)
+        命中负缓存时返回 (True, None)，调用方应直接使用降级结果
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+        from_disk = False
+        if entry is None:
+            entry = self._read_disk(key)
+            from_disk = entry is not None
+        with self._lock:
+            if entry is not None and entry[0] > now:
+                if from_disk:
+                    self._remember(key, entry)
+                    self._stats['disk_hits'] += 1
+                self._stats['negative_hits' if entry[1] else 'hits'] += 1
+                return True, entry[2]
+            if entry is not None:
+                self._memory.pop(key, None)
+                self._stats['expired'] += 1
+            self._stats['misses'] += 1
+        if entry is not None:
+            # 内存和磁盘中的条目有效期相同，过期时一并删除磁盘文件
+            self._remove_expired(self._path(key), now)
+        return False, None
+
+    def _put(self, key, value, negative, ttl):
+        entry = (time.time() + ttl, negative, value)
+        with self._lock:
+            self._remember(key, entry)
+            self._stats['writes'] += 1
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            write_json_atomic(path, {'expires_at': entry[0], 'negative': negative, 'value': value}, indent=None)
+        except Exception as e:
+            logger.warning(f"写入缓存文件失败: {path}: {e}")
+        self._purge_periodically()
+
+    def _purge_periodically(self):
+        """每小时最多一次清理过期文件（从未再被读取的条目不会在读取时删除）"""
+        now = time.time()
+        with self._lock:
+            if now - self._last_purge < 3600:
+                return
+            self._last_purge = now
+        removed = self.purge_expired()
+        if removed:
+            logger.info(f"已删除 {removed} 个过期缓存文件: {self.directory}")
+
+    def set(self, key, value):
+        """缓存正常结果"""
+        self._put(key, value, False, self.ttl)
+
+    def set_negative(self, key):
+        """缓存一次上游失败，negative_ttl内不再请求上游"""
+        self._put(key, None, True, self.negative_ttl)
+
+    def stats(self):
+        """返回命中/未命中等计数"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['memory_entries'] = len(self._memory)
+        lookups = stats['hits'] + stats['negative_hits'] + stats['misses']
+        stats['hit_ratio'] = round((stats['hits'] + stats['negative_hits']) / lookups, 4) if lookups else 0.0
+        return stats
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+把 data/ 下的JSON数据（含追加日志和按用户分区的文件）一次性迁移到SQLite数据库
+迁移后设置 STORAGE_BACKEND=sqlite 启动应用
+
+python migrate_storage.py [--data-dir data] [--db data/forbites.db]
+"""
+
+import os
+import argparse
+
+from journal_store import journal_path_for
+from storage_backend import JsonFileBackend, partition_name, USER_COLLECTIONS
+from sqlite_backend import SQLiteBackend, COLLECTION_SCHEMAS
+
+
+def read_sequence(path):
+    """读取ID序列文件中已分配的最大ID，文件不存在时返回0"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return int(f.read().strip())
+    except (FileNotFoundError, ValueError):
+        return 0
+
+
+def has_journal(data_dir, key):
+    """集合（或其任一分区）是否存在日志文件"""
+    if os.path.exists(journal_path_for(os.path.join(data_dir, f'{key}.json'))):
+        return True
+    directory = os.path.join(data_dir, key)
+    return os.path.isdir(directory) and any(name.endswith('.journal.jsonl') for name in os.listdir(directory))
+
+
+def load_collection(source, key):
+    """读取集合的全部记录，分区集合合并所有用户的分区"""
+    if key not in source.partitioned:
+        return source.load(key)
+    return [
+        record for user_id in source.partitions(key)
+        for record in source.load(partition_name(key, user_id))
+    ]
+
+
+def migrate(data_dir, db_path, partitioned=USER_COLLECTIONS):
+    """
+    迁移全部集合，返回 {集合名: 记录数}；重复执行会用JSON文件中的数据覆盖数据库
+    partitioned: 按用户分区的集合（默认与应用一致），旧的整集合文件会先拆分为分区
+    """
+    data_files = {key: os.path.join(data_dir, f'{key}.json') for key in COLLECTION_SCHEMAS}
+    # 存在日志文件的集合按快照+日志读取
+    journal_collections = [key for key in data_files if has_journal(data_dir, key)]
+    source = JsonFileBackend(data_files, data_dir, journal_collections=journal_collections, partitioned=partitioned)
+    target = SQLiteBackend(db_path, data_files, data_dir, partitioned=partitioned)
+
+    counts = {}
+    try:
+        for key in data_files:
+            with source.lock(key):
+                records = load_collection(source, key)
+                target.replace_all(key, records)
+                max_id = max((record['id'] for record in records), default=0)
+                target.set_sequence(key, max(max_id, read_sequence(os.path.join(data_dir, f'{key}.seq'))))
+            migrated = len(load_collection(target, key))
+            if migrated != len(records):
+                raise RuntimeError(f'{key} 迁移后记录数不一致: {len(records)} -> {migrated}')
+            counts[key] = migrated
+    finally:
+        target.close()
+    return counts
+
+
+def main():
+    backend_dir = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description='把JSON数据文件迁移到SQLite')
+    parser.add_argument('--data-dir', default=os.getenv('DATA_DIR') or os.path.join(backend_dir, 'data'))
+    parser.add_argument('--db', help='SQLite数据库路径，默认 <data-dir>/forbites.db')
+    args = parser.parse_args()
+
+    db_path = args.db or os.getenv('SQLITE_PATH') or os.path.join(args.data_dir, 'forbites.db')
+    print(f"迁移 {args.data_dir} -> {db_path}")
+    for key, count in migrate(args.data_dir, db_path).items():
+        print(f"✓ {key}: {count} 条记录")
+    print("迁移完成，设置 STORAGE_BACKEND=sqlite 后启动应用")
+
+
+if __name__ == '__main__':
+    main()
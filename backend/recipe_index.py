@@ -0,0 +1,93 @@
+"""
+菜谱食材倒排索引
+食材（规范化后）-> 菜谱ID集合，用于按用户食材快速检索并排序推荐菜谱
+"""
+
+import heapq
+import threading
+from collections import defaultdict
+
+
+def normalize_ingredient(ingredient):
+    """规范化食材名：兼容字符串和 {'name': ...} 两种格式，去空白并转小写"""
+    if isinstance(ingredient, dict):
+        ingredient = ingredient.get('name', '')
+    if not isinstance(ingredient, str):
+        return ''
+    return ' '.join(ingredient.split()).lower()
+
+
+def recipe_ingredient_set(recipe):
+    """菜谱的规范化食材集合"""
+    ingredients = recipe.get('ingredients') or []
+    if not isinstance(ingredients, list):
+        ingredients = [ingredients]
+    return frozenset(filter(None, (normalize_ingredient(i) for i in ingredients)))
+
+
+class RecipeIndex:
+    """
+    内存倒排索引，version记录索引对应的recipes集合版本
+    新增菜谱时增量更新；版本不一致时由调用方重建
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.version = None
+        self._postings = defaultdict(set)  # 食材 -> 菜谱ID集合
+        self._ingredients = {}             # 菜谱ID -> 食材集合
+        self._recipes = {}                 # 菜谱ID -> 菜谱
+
+    def _add(self, recipe):
+        recipe_id = recipe['id']
+        ingredients = recipe_ingredient_set(recipe)
+        self._recipes[recipe_id] = recipe
+        self._ingredients[recipe_id] = ingredients
+        for ingredient in ingredients:
+            self._postings[ingredient].add(recipe_id)
+
+    def rebuild(self, recipes, version):
+        """根据完整菜谱列表重建索引"""
+        with self._lock:
+            self._postings = defaultdict(set)
+            self._ingredients = {}
+            self._recipes = {}
+            for recipe in recipes:
+                self._add(recipe)
+            self.version = version
+
+    def sync(self, recipes, from_version, to_version):
+        """
+        保存recipes后的增量更新：只索引尚未收录的菜谱
+        只有索引正好处于写入前的版本时才更新，否则保持过期状态等待重建
+        """
+        with self._lock:
+            if self.version != from_version:
+                return False
+            for recipe in recipes:
+                if recipe['id'] not in self._recipes:
+                    self._add(recipe)
+            if len(self._recipes) != len(recipes):
+                # 有菜谱被删除，交给下次查询时重建
+                return False
+            self.version = to_version
+            return True
+
+    def top_k(self, user_ingredients, k=10):
+        """
+        返回与用户食材最匹配的k个菜谱
+        排序：命中的用户食材数（覆盖率）降序 -> 缺少的食材数升序 -> 新菜谱优先
+        """
+        wanted = {normalize_ingredient(i) for i in user_ingredients} - {''}
+        with self._lock:
+            hits = defaultdict(int)
+            for ingredient in wanted:
+                for recipe_id in self._postings.get(ingredient, ()):
+                    hits[recipe_id] += 1
+            # nlargest 内部维护大小为k的堆，复杂度 O(n log k)
+            best = heapq.nlargest(
+                k,
+                hits.items(),
+                key=lambda hit: (hit[1], hit[1] - len(self._ingredients[hit[0]]), hit[0])
+            )
+            return [self._recipes[recipe_id] for recipe_id, _ in best]
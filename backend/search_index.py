@@ -0,0 +1,324 @@
+"""
+中文全文检索
+按汉字二元组（bigram）建立倒排索引，单字和英文/数字单词也作为词项，查询结果按BM25排序
+- 每个存储键（集合或用户分区）一个索引，保存后按对象身份增量更新
+- 索引定期持久化到磁盘（JSON），启动时直接加载：数据签名一致时原样使用，
+  否则按每个文档的内容指纹只对变化的文档重新分词
+"""
+
+import os
+import re
+import json
+import math
+import heapq
+import zlib
+import logging
+import threading
+from collections import OrderedDict, Counter
+
+from journal_store import write_json_atomic
+
+logger = logging.getLogger(__name__)
+
+_TOKEN_RE = re.compile(r'[一-鿿]+|[A-Za-z0-9]+')
+
+
+def _is_cjk(run):
+    return '一' <= run[0] <= '鿿'
+
+
+def field_text(value):
+    """字段值 -> 文本：兼容字符串、列表（食材、步骤）和 {'name': ...} 等字典"""
+    if isinstance(value, str):
+        return value
+    if isinstance(value, list):
+        return ' '.join(field_text(v) for v in value)
+    if isinstance(value, dict):
+        return ' '.join(field_text(v) for v in value.values())
+    return ''
+
+
+def tokenize(text):
+    """文档分词：汉字串产生单字和二元组，英文/数字按单词（小写）"""
+    terms = []
+    for run in _TOKEN_RE.findall(text):
+        if _is_cjk(run):
+            terms.extend(run)
+            terms.extend(map(str.__add__, run, run[1:]))
+        else:
+            terms.append(run.lower())
+    return terms
+
+
+def query_terms(text):
+    """查询分词：汉字串只用二元组匹配（单字查询时用单字），结果去重"""
+    terms = []
+    for run in _TOKEN_RE.findall(text):
+        if not _is_cjk(run):
+            terms.append(run.lower())
+        elif len(run) == 1:
+            terms.append(run)
+        else:
+            terms.extend(map(str.__add__, run, run[1:]))
+    return list(dict.fromkeys(terms))
+
+
+class SearchIndex:
+    """
+    单个存储键的倒排索引：词项 -> {文档ID: 加权词频}
+    fields: {字段名: 权重}，如标题命中比正文命中得分更高
+    version记录索引对应的本进程数据版本，signature记录对应的数据签名（用于持久化）
+    """
+
+    def __init__(self, fields, path=None, persist_delay=30.0):
+        self.fields = fields
+        self.path = path
+        self.persist_delay = persist_delay
+        self._lock = threading.RLock()
+        self.version = None
+        self.signature = None
+        self._records = {}    # 文档ID -> 记录
+        self._fingerprints = {}  # 文档ID -> 检索字段内容的指纹
+        self._terms = {}      # 文档ID -> {词项: 加权词频}
+        self._lengths = {}    # 文档ID -> 加权文档长度
+        self._postings = {}   # 词项 -> {文档ID: 加权词频}
+        self.total_length = 0
+        self._dirty = False
+        self._timer = None
+
+    @property
+    def doc_count(self):
+        return len(self._terms)
+
+    def _fingerprint(self, record):
+        raw = json.dumps([record.get(field) for field in self.fields], ensure_ascii=False, default=str)
+        return zlib.crc32(raw.encode('utf-8'))
+
+    def _document_terms(self, record):
+        weights = {}
+        for field, weight in self.fields.items():
+            for term, count in Counter(tokenize(field_text(record.get(field)))).items():
+                weights[term] = weights.get(term, 0) + count * weight
+        return weights
+
+    def _index(self, doc_id, fingerprint, terms):
+        self._fingerprints[doc_id] = fingerprint
+        self._terms[doc_id] = terms
+        length = sum(terms.values())
+        self._lengths[doc_id] = length
+        self.total_length += length
+        for term, tf in terms.items():
+            self._postings.setdefault(term, {})[doc_id] = tf
+
+    def _add(self, record):
+        self._records[record['id']] = record
+        self._index(record['id'], self._fingerprint(record), self._document_terms(record))
+
+    def _remove(self, doc_id):
+        self._records.pop(doc_id, None)
+        self._fingerprints.pop(doc_id)
+        terms = self._terms.pop(doc_id)
+        self.total_length -= self._lengths.pop(doc_id)
+        for term in terms:
+            postings = self._postings[term]
+            del postings[doc_id]
+            if not postings:
+                del self._postings[term]
+
+    def _reset(self):
+        self._records = {}
+        self._fingerprints = {}
+        self._terms = {}
+        self._lengths = {}
+        self._postings = {}
+        self.total_length = 0
+
+    def rebuild(self, records, version, signature=None):
+        """根据完整数据重建索引，随后在后台持久化"""
+        with self._lock:
+            self._reset()
+            for record in records:
+                self._add(record)
+            self.version = version
+            self._mark_dirty(signature)
+
+    def sync(self, records, from_version, to_version, signature=None):
+        """
+        保存后的增量更新：新增、替换和删除的记录按对象身份识别（记录只替换不原地修改）
+        只有索引正好处于写入前的版本时才更新，否则保持过期状态等待重建
+        """
+        with self._lock:
+            if self.version != from_version:
+                return False
+            current_ids = set()
+            for record in records:
+                doc_id = record['id']
+                current_ids.add(doc_id)
+                existing = self._records.get(doc_id)
+                if existing is record:
+                    continue
+                if existing is not None:
+                    self._remove(doc_id)
+                self._add(record)
+            if len(current_ids) != len(self._records):
+                for doc_id in [i for i in self._records if i not in current_ids]:
+                    self._remove(doc_id)
+            self.version = to_version
+            self._mark_dirty(signature)
+            return True
+
+    # --- 查询 ---
+
+    def document_frequency(self, term):
+        with self._lock:
+            return len(self._postings.get(term, ()))
+
+    def score(self, idf, avgdl, k1=1.2, b=0.75):
+        """idf: {词项: 逆文档频率}；返回 [(BM25得分, 记录), ...]"""
+        scores = {}
+        # 长度归一化 k1 * (1 - b + b * 文档长度 / 平均长度) 拆成常数项和系数，减少内层循环的计算
+        base, slope = k1 * (1 - b), k1 * b / avgdl
+        with self._lock:
+            lengths = self._lengths
+            for term, weight in idf.items():
+                weight *= k1 + 1
+                for doc_id, tf in self._postings.get(term, {}).items():
+                    scores[doc_id] = scores.get(doc_id, 0.0) + weight * tf / (tf + base + slope * lengths[doc_id])
+            return [(score, self._records[doc_id]) for doc_id, score in scores.items()]
+
+    # --- 持久化 ---
+
+    def _mark_dirty(self, signature):
+        """记录索引对应的数据签名，延迟persist_delay秒后在后台写盘（需持有锁）"""
+        self.signature = json.loads(json.dumps(signature))
+        if self.path is None:
+            return
+        self._dirty = True
+        if self._timer is None:
+            self._timer = threading.Timer(self.persist_delay, self.persist)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def persist(self):
+        """把索引写入磁盘（每个文档的指纹和词项 + 数据签名），没有未保存的修改时不写"""
+        with self._lock:
+            self._timer = None
+            if not self._dirty:
+                return
+            self._dirty = False
+            # 每个文档的词项字典创建后不再修改，浅拷贝后可在锁外序列化
+            # 文档以 [文档ID, 指纹, 词项] 列表保存，JSON对象的键只能是字符串，这样可以保留ID的类型
+            state = {
+                'signature': self.signature,
+                'fields': self.fields,
+                'docs': [[doc_id, self._fingerprints[doc_id], terms] for doc_id, terms in self._terms.items()]
+            }
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            write_json_atomic(self.path, state, indent=None)
+        except Exception as e:
+            logger.error(f"搜索索引持久化失败: {self.path}: {e}")
+
+    def restore(self, records, version, signature):
+        """
+        从磁盘加载索引，返回是否成功（文件不存在或字段配置变化时返回False，由调用方重建）
+        数据签名一致时直接使用；否则逐个比较文档指纹，只对新增和修改的文档重新分词
+        """
+        if self.path is None:
+            return False
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+            if state.get('fields') != self.fields:
+                return False
+            docs = {doc_id: (fingerprint, terms) for doc_id, fingerprint, terms in state['docs']}
+        except FileNotFoundError:
+            return False
+        except Exception as e:
+            logger.warning(f"搜索索引文件无法读取，将重建: {self.path}: {e}")
+            return False
+        signature = json.loads(json.dumps(signature))
+        unchanged = state.get('signature') == signature and len(docs) == len(records)
+        with self._lock:
+            self._reset()
+            reused = 0
+            for record in records:
+                doc_id = record['id']
+                saved = docs.get(doc_id)
+                if saved is not None and (unchanged or saved[0] == self._fingerprint(record)):
+                    self._records[doc_id] = record
+                    self._index(doc_id, saved[0], saved[1])
+                    reused += 1
+                else:
+                    self._add(record)
+            self.version = version
+            if reused == len(docs) == len(records):
+                self.signature = signature
+            else:
+                self._mark_dirty(signature)
+            return True
+
+
+class SearchIndexCache:
+    """
+    存储键 -> SearchIndex，持久化在 <directory>/<存储键>.json
+    按最近使用保留至多 max_indexes 个，被淘汰的索引先写盘，下次使用时从磁盘加载
+    """
+
+    def __init__(self, directory, max_indexes=1024, persist_delay=30.0):
+        self.directory = directory
+        self.max_indexes = max_indexes
+        self.persist_delay = persist_delay
+        self._lock = threading.Lock()
+        self._indexes = OrderedDict()
+
+    def get(self, key, fields):
+        evicted = None
+        with self._lock:
+            index = self._indexes.get(key)
+            if index is None:
+                path = os.path.join(self.directory, f'{key}.json')
+                index = self._indexes[key] = SearchIndex(fields, path, self.persist_delay)
+                if len(self._indexes) > self.max_indexes:
+                    _, evicted = self._indexes.popitem(last=False)
+            else:
+                self._indexes.move_to_end(key)
+        if evicted is not None:
+            evicted.persist()
+        return index
+
+    def peek(self, key):
+        """返回已在内存中的索引，不存在时返回None"""
+        with self._lock:
+            return self._indexes.get(key)
+
+    def persist_all(self):
+        with self._lock:
+            indexes = list(self._indexes.values())
+        for index in indexes:
+            index.persist()
+
+
+def bm25_search(sources, terms, limit, offset=0, k1=1.2, b=0.75):
+    """
+    在多个索引组成的语料上按BM25排序，文档数、平均长度和文档频率按所有索引合计
+    sources: [(来源名, SearchIndex), ...]
+    返回 (总命中数, [(得分, 来源名, 记录), ...] 中第offset起的limit条)
+    """
+    doc_count = sum(index.doc_count for _, index in sources)
+    if not doc_count or not terms:
+        return 0, []
+    avgdl = max(sum(index.total_length for _, index in sources) / doc_count, 1e-9)
+    idf = {}
+    for term in terms:
+        df = sum(index.document_frequency(term) for _, index in sources)
+        if df:
+            idf[term] = math.log(1 + (doc_count - df + 0.5) / (df + 0.5))
+    hits = [
+        (score, name, record)
+        for name, index in sources
+        for score, record in index.score(idf, avgdl, k1, b)
+    ]
+    # 得分相同时新记录（ID大）优先
+    best = heapq.nlargest(offset + limit, hits, key=lambda hit: (hit[0], hit[2]['id']))
+    return len(hits), best[offset:]
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+应用服务进程（自托管部署时使用，开发时仍可直接运行 python app.py）
+
+两种并发模式：
+- gevent（推荐）：启动前对标准库打补丁（monkey patch），requests 调用豆包/百度、
+  time.sleep、线程池和锁都变为协程切换；等待上游时不占用线程，同时处理的请求数
+  只受 --max-connections 和内存限制；存储层的文件锁（flock）和 SQLite 调用不会被打补丁，
+  等待其他进程持有的锁时阻塞整个进程（见 README「部署与并发模式」）
+- threads：固定数量的工作线程，每个进行中的请求（包括等待上游的请求）占用一个线程，
+  线程用完后新请求排队
+
+python serve.py --worker gevent --port 5001 --max-connections 1000
+python serve.py --worker threads --threads 16
+"""
+
+import os
+import argparse
+
+WORKER_MODES = ('gevent', 'threads')
+
+
+def patch_for_gevent():
+    """gevent模式：必须在导入 app、wsgi_server（及 requests、ssl 等）之前调用"""
+    try:
+        from gevent import monkey
+    except ImportError:
+        raise SystemExit('gevent 模式需要安装 gevent：pip install gevent')
+    monkey.patch_all()
+
+
+def add_server_arguments(parser):
+    parser.add_argument('--worker', choices=WORKER_MODES, default=os.getenv('SERVER_WORKER', 'threads'),
+                        help='并发模式（环境变量 SERVER_WORKER）')
+    parser.add_argument('--threads', type=int, default=int(os.getenv('SERVER_THREADS', '16')),
+                        help='threads模式的工作线程数（环境变量 SERVER_THREADS）')
+    parser.add_argument('--max-connections', type=int, default=int(os.getenv('SERVER_MAX_CONNECTIONS', '1000')),
+                        help='gevent模式同时处理的连接数上限，0为不限制（环境变量 SERVER_MAX_CONNECTIONS）')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='四时后端服务')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=int(os.getenv('PORT', '5001')))
+    add_server_arguments(parser)
+    args = parser.parse_args()
+
+    if args.worker == 'gevent':
+        patch_for_gevent()
+
+    import app as forbites
+    from wsgi_server import make_server, exit_on_sigterm
+
+    forbites.seed_database()
+    forbites.migrate_knowledge_images()
+    forbites.job_queue.start()
+    server = make_server(forbites.app, args.host, args.port, args.worker, args.threads, args.max_connections)
+    exit_on_sigterm(server, args.worker)
+    print(f"四时后端服务已启动: http://{args.host}:{args.port}（{args.worker} 模式）")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,319 @@
+"""
+SQLite存储后端（WAL模式）
+每个集合一张表：常用查询字段单独成列并建索引，完整记录以JSON保存在 data 列
+- 保存时按对象身份比较新旧数据，只写入新增、修改和删除的行
+- 分区集合以 user_id 列为分区键，每个用户的数据单独加载、缓存和保存
+- collection_versions 表记录每个存储键（集合或分区）的版本号，所有进程看到的版本一致
+- id_sequences 表分配ID，与写入在同一个数据库中
+"""
+
+import json
+import sqlite3
+import threading
+from collections import OrderedDict
+
+from storage_backend import StorageBackend, sort_value, split_partition, LEGACY_USER_ID
+
+# 集合 -> 单独成列的字段和索引
+# sort 字段缺失时按空字符串保存，与JSON后端的排序规则一致
+COLLECTION_SCHEMAS = {
+    'recipes': {'columns': ('created_at',), 'sort': ('created_at',),
+                'indexes': [('created_at',)]},
+    'pantry_items': {'columns': ('user_id', 'name', 'item_type', 'created_at'), 'sort': ('created_at',),
+                     'indexes': [('user_id', 'name', 'item_type'), ('user_id', 'created_at')]},
+    'tip_items': {'columns': ('tip_type', 'context', 'created_at'), 'sort': ('created_at',),
+                  'indexes': [('tip_type', 'context')]},
+    'user_locations': {'columns': ('user_id', 'created_at'), 'sort': ('created_at',),
+                       'indexes': [('user_id', 'created_at')]},
+    'knowledge_items': {'columns': ('user_id', 'created_at'), 'sort': ('created_at',),
+                        'indexes': [('user_id', 'created_at')]},
+    'hometown_recipes': {'columns': ('user_id', 'created_at'), 'sort': ('created_at',),
+                         'indexes': [('user_id', 'created_at')]},
+    'user_ingredients': {'columns': ('user_id', 'name', 'added_at'), 'sort': ('added_at',),
+                         'indexes': [('user_id', 'added_at'), ('user_id', 'name')]},
+    'recipe_filters': {'columns': ('user_id', 'created_at'), 'sort': ('created_at',),
+                       'indexes': [('user_id', 'created_at')]},
+}
+
+
+def _quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+class SQLiteBackend(StorageBackend):
+    """
+    db_path: 数据库文件路径；lock_dir: 集合锁文件目录
+    每个线程一个连接，请求结束时（release）放回空闲连接池，最多保留 max_idle 个空闲连接；
+    gevent模式下 threading.local 是协程局部变量，每个请求在新协程中处理，连接靠连接池复用
+    加载的数据按版本号缓存在内存中
+    partitioned 中的集合必须有 user_id 列
+    """
+
+    indexed_queries = True
+
+    def __init__(self, db_path, collections, lock_dir, schemas=COLLECTION_SCHEMAS, partitioned=(), max_idle=8):
+        super().__init__(collections, lock_dir, partitioned)
+        self.db_path = db_path
+        self.schemas = {key: schemas.get(key, {'columns': (), 'sort': (), 'indexes': []}) for key in self.collections}
+        self._local = threading.local()
+        self.max_idle = max_idle
+        self._idle_lock = threading.Lock()
+        self._idle = []  # 空闲连接
+        self._cache_lock = threading.Lock()
+        self._cache = {}  # key -> (版本号, OrderedDict(id -> 记录))
+        self._init_schema()
+        self.release()
+
+    # --- 连接与表结构 ---
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            return conn
+        with self._idle_lock:
+            conn = self._idle.pop() if self._idle else None
+        if conn is None:
+            # isolation_level=None：由代码显式 BEGIN/COMMIT 控制事务；连接可能在线程间传递
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+        self._local.conn = conn
+        return conn
+
+    def _init_schema(self):
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute('CREATE TABLE IF NOT EXISTS collection_versions (name TEXT PRIMARY KEY, version INTEGER NOT NULL)')
+            conn.execute('CREATE TABLE IF NOT EXISTS id_sequences (name TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+            for key, schema in self.schemas.items():
+                columns = ''.join(f', {_quote(c)}' for c in schema['columns'])
+                conn.execute(f'CREATE TABLE IF NOT EXISTS {_quote(key)} (id INTEGER PRIMARY KEY{columns}, data TEXT NOT NULL)')
+                for index_columns in schema['indexes']:
+                    name = _quote(f"idx_{key}_{'_'.join(index_columns)}")
+                    # 排序字段相同时按id排序，索引带上id使分页无需额外排序
+                    indexed = ', '.join(_quote(c) for c in index_columns + ('id',))
+                    conn.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {_quote(key)} ({indexed})')
+                if key in self.partitioned:
+                    # 分区之前没有 user_id 的旧记录归属 LEGACY_USER_ID
+                    conn.execute(
+                        f"UPDATE {_quote(key)} SET user_id = ?, data = json_set(data, '$.user_id', ?) WHERE user_id IS NULL",
+                        (LEGACY_USER_ID, LEGACY_USER_ID)
+                    )
+                conn.execute('INSERT OR IGNORE INTO collection_versions (name, version) VALUES (?, 0)', (key,))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def _row(self, key, record):
+        schema = self.schemas[key]
+        values = [record['id']]
+        for column in schema['columns']:
+            value = record.get(column)
+            values.append(sort_value(value) if column in schema['sort'] else value)
+        values.append(json.dumps(record, ensure_ascii=False))
+        return values
+
+    # --- 读写 ---
+
+    def _partition_filter(self, key):
+        """存储键 -> (表名, WHERE子句, 参数)，不分区的集合没有过滤条件"""
+        collection, user_id = split_partition(key)
+        if user_id is None:
+            return _quote(collection), '', ()
+        return _quote(collection), ' WHERE user_id = ?', (user_id,)
+
+    def _version(self, conn, key):
+        row = conn.execute('SELECT version FROM collection_versions WHERE name = ?', (key,)).fetchone()
+        return row[0] if row else 0
+
+    def version(self, key):
+        return self._version(self._conn(), key)
+
+    def signature(self, key):
+        return ('sqlite', self.version(key))
+
+    def _cached(self, key):
+        """返回与数据库当前版本一致的缓存记录（OrderedDict），必要时重新读取"""
+        conn = self._conn()
+        version = self._version(conn, key)
+        with self._cache_lock:
+            cached = self._cache.get(key)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        # 在同一个读事务中读取版本号和数据，保证两者一致
+        conn.execute('BEGIN')
+        try:
+            version = self._version(conn, key)
+            table, where, params = self._partition_filter(key)
+            rows = conn.execute(f'SELECT data FROM {table}{where} ORDER BY id', params).fetchall()
+        finally:
+            conn.execute('COMMIT')
+        records = OrderedDict()
+        for (data,) in rows:
+            record = json.loads(data)
+            records[record['id']] = record
+        with self._cache_lock:
+            self._cache[key] = (version, records)
+        return records
+
+    def load(self, key):
+        return list(self._cached(key).values())
+
+    def save(self, key, data):
+        collection, user_id = split_partition(key)
+        old = self._cached(key)
+        upserts = []
+        seen = set()
+        for item in data:
+            if user_id is not None and item.get('user_id') != user_id:
+                raise ValueError(f'记录 {item["id"]} 不属于分区 {key}')
+            seen.add(item['id'])
+            existing = old.get(item['id'])
+            if existing is None or (existing is not item and existing != item):
+                upserts.append(self._row(collection, item))
+        deletes = [(record_id,) for record_id in old if record_id not in seen]
+
+        conn = self._conn()
+        table = _quote(collection)
+        placeholders = ', '.join('?' * (len(self.schemas[collection]['columns']) + 2))
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if upserts:
+                conn.executemany(f'INSERT OR REPLACE INTO {table} VALUES ({placeholders})', upserts)
+            if deletes:
+                conn.executemany(f'DELETE FROM {table} WHERE id = ?', deletes)
+            # 分区的版本号在第一次写入时创建
+            conn.execute(
+                'INSERT INTO collection_versions (name, version) VALUES (?, 1) '
+                'ON CONFLICT(name) DO UPDATE SET version = version + 1',
+                (key,)
+            )
+            version = self._version(conn, key)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        with self._cache_lock:
+            self._cache[key] = (version, OrderedDict((item['id'], item) for item in data))
+        return sum(len(row[-1].encode('utf-8')) for row in upserts)
+
+    def replace_all(self, key, data):
+        """清空集合（包括所有分区）后写入全部数据（用于迁移），key为集合名"""
+        conn = self._conn()
+        table = _quote(key)
+        placeholders = ', '.join('?' * (len(self.schemas[key]['columns']) + 2))
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute(f'DELETE FROM {table}')
+            conn.executemany(f'INSERT INTO {table} VALUES ({placeholders})', (self._row(key, item) for item in data))
+            conn.execute(
+                'UPDATE collection_versions SET version = version + 1 WHERE name = ? OR name LIKE ?',
+                (key, f'{key}/%')
+            )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        with self._cache_lock:
+            for name in [name for name in self._cache if split_partition(name)[0] == key]:
+                del self._cache[name]
+
+    def partitions(self, key):
+        rows = self._conn().execute(f'SELECT DISTINCT user_id FROM {_quote(key)} WHERE user_id IS NOT NULL ORDER BY user_id')
+        return [user_id for (user_id,) in rows]
+
+    # --- ID分配 ---
+
+    def reserve_ids(self, key, count):
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT value FROM id_sequences WHERE name = ?', (key,)).fetchone()
+            if row is None:
+                start = conn.execute(f'SELECT COALESCE(MAX(id), 0) FROM {_quote(key)}').fetchone()[0]
+            else:
+                start = row[0]
+            conn.execute('INSERT OR REPLACE INTO id_sequences (name, value) VALUES (?, ?)', (key, start + count))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return range(start + 1, start + count + 1)
+
+    def set_sequence(self, key, value):
+        """设置已分配的最大ID（用于迁移），不会调小"""
+        conn = self._conn()
+        conn.execute(
+            'INSERT INTO id_sequences (name, value) VALUES (?, ?) '
+            'ON CONFLICT(name) DO UPDATE SET value = MAX(value, excluded.value)',
+            (key, value)
+        )
+
+    # --- 查询 ---
+
+    def find(self, key, where=None, order_by=(), descending=False, limit=None, after=None):
+        """等值条件和排序字段为表中的列时由索引完成，其他条件在读取后过滤"""
+        collection, user_id = split_partition(key)
+        schema = self.schemas[collection]
+        columns = set(schema['columns']) | {'id'}
+        if any(field not in columns for field in order_by):
+            return super().find(key, where, order_by, descending, limit, after)
+        where = dict(where or {})
+        if user_id is not None:
+            where['user_id'] = user_id
+
+        clauses, params = [], []
+        extra = {}
+        for field, value in where.items():
+            if field not in columns:
+                extra[field] = value
+            elif value is None:
+                clauses.append(f'{_quote(field)} IS NULL')
+            else:
+                clauses.append(f'{_quote(field)} = ?')
+                params.append(value)
+        if order_by and after is not None:
+            fields = ', '.join(_quote(f) for f in order_by)
+            marks = ', '.join('?' * len(order_by))
+            clauses.append(f"({fields}) {'<' if descending else '>'} ({marks})")
+            params.extend(after)
+
+        sql = f'SELECT data FROM {_quote(collection)}'
+        if clauses:
+            sql += ' WHERE ' + ' AND '.join(clauses)
+        direction = ' DESC' if descending else ''
+        sql += ' ORDER BY ' + ', '.join(_quote(f) + direction for f in (order_by or ('id',)))
+        if limit is not None and not extra:
+            sql += f' LIMIT {int(limit)}'
+
+        records = [json.loads(data) for (data,) in self._conn().execute(sql, params)]
+        if extra:
+            records = [r for r in records if all(r.get(f) == v for f, v in extra.items())]
+            if limit is not None:
+                records = records[:limit]
+        return records
+
+    def release(self):
+        """把当前线程（协程）的连接放回空闲连接池，空闲连接已满或事务未结束时关闭连接"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            return
+        self._local.conn = None
+        if not conn.in_transaction:
+            with self._idle_lock:
+                if len(self._idle) < self.max_idle:
+                    self._idle.append(conn)
+                    return
+        conn.close()
+
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+        with self._idle_lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
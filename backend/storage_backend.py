@@ -0,0 +1,313 @@
+"""
+存储后端
+集合是带 'id' 字段的字典列表，app.py 的 load_data/save_data/get_next_id 通过后端读写
+按用户分区的集合（partitioned）以 "<集合名>/<user_id>" 为存储键，每个用户的数据单独读写，
+请求的开销只与该用户的数据量有关
+- JsonFileBackend: 每个集合一个JSON文件（可选追加日志存储），适合开发环境
+- SQLiteBackend（sqlite_backend.py）: WAL模式的SQLite，按常用查询建立索引，适合生产环境
+"""
+
+import os
+import json
+import logging
+import threading
+
+from collection_cache import CollectionCache, file_signature
+from journal_store import JournalStore, write_json_atomic, journal_path_for
+from file_lock import CollectionLock
+from id_sequence import IdSequence
+
+logger = logging.getLogger(__name__)
+
+# 按用户分区的集合（其余集合如 recipes、tip_items 为所有用户共享）
+USER_COLLECTIONS = (
+    'pantry_items', 'user_locations', 'knowledge_items',
+    'hometown_recipes', 'user_ingredients', 'recipe_filters'
+)
+
+# 分区之前的旧数据中没有 user_id 的记录归属的用户
+LEGACY_USER_ID = 1
+
+
+def partition_name(key, user_id):
+    """分区集合中某个用户的存储键，如 knowledge_items/7"""
+    return f'{key}/{int(user_id)}'
+
+
+def split_partition(name):
+    """存储键 -> (集合名, user_id)，不分区的集合user_id为None"""
+    key, sep, user_id = name.partition('/')
+    return (key, int(user_id)) if sep else (key, None)
+
+
+def sort_value(value):
+    """排序字段缺失时按空字符串处理，与时间字符串可比较"""
+    return '' if value is None else value
+
+
+class StorageBackend:
+    """
+    存储后端接口
+    下面方法中的 key 为存储键：不分区的集合为集合名，分区集合为 partition_name(集合名, user_id)
+    修改集合时应在 lock(key) 内 load -> 修改 -> save，记录只替换不原地修改
+    indexed_queries 为True时 find 由存储引擎的索引完成，否则为内存扫描
+    """
+
+    indexed_queries = False
+
+    def __init__(self, collections, lock_dir, partitioned=()):
+        self.collections = list(collections)
+        self.partitioned = set(partitioned)
+        self.lock_dir = lock_dir
+        # 每个存储键一把跨进程锁（<lock_dir>/<存储键>.lock），保证 读取-修改-保存 不丢更新；分区的锁按需创建
+        self._locks = {key: CollectionLock(os.path.join(lock_dir, f'{key}.lock')) for key in self.collections}
+        self._locks_guard = threading.Lock()
+
+    def lock(self, key):
+        lock = self._locks.get(key)
+        if lock is None:
+            with self._locks_guard:
+                lock = self._locks.get(key)
+                if lock is None:
+                    path = os.path.join(self.lock_dir, f'{key}.lock')
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    lock = self._locks[key] = CollectionLock(path)
+        return lock
+
+    def partitions(self, key):
+        """分区集合中有数据的全部user_id"""
+        raise NotImplementedError
+
+    def load(self, key):
+        """返回集合全部记录的列表（浅拷贝，调用方可以增删元素）"""
+        raise NotImplementedError
+
+    def save(self, key, data):
+        """保存集合的完整数据，返回写入的字节数"""
+        raise NotImplementedError
+
+    def version(self, key):
+        """本进程内的数据版本号，数据变化（包括其他进程写入）后改变"""
+        raise NotImplementedError
+
+    def signature(self, key):
+        """与进程无关的数据签名，只做轻量检查不加载数据，用于计算ETag"""
+        raise NotImplementedError
+
+    def reserve_ids(self, key, count):
+        """批量分配count个ID，返回range；ID在整个集合（所有分区）内唯一，key为集合名"""
+        raise NotImplementedError
+
+    def next_id(self, key):
+        return self.reserve_ids(key, 1)[0]
+
+    def find(self, key, where=None, order_by=(), descending=False, limit=None, after=None):
+        """
+        查询记录
+        where: {字段: 值} 等值条件；order_by: 排序字段元组
+        after: 与order_by对应的值元组，只返回排在它之后的记录（用于游标分页）
+        默认实现加载全部数据后在内存中过滤排序
+        """
+        where = where or {}
+        records = [r for r in self.load(key) if all(r.get(f) == v for f, v in where.items())]
+        if order_by:
+            def sort_key(record):
+                return tuple(sort_value(record.get(f)) for f in order_by)
+            records.sort(key=sort_key, reverse=descending)
+            if after is not None:
+                after = tuple(after)
+                records = [r for r in records if (sort_key(r) < after if descending else sort_key(r) > after)]
+        return records[:limit] if limit is not None else records
+
+    def release(self):
+        """请求结束时调用，归还当前线程（协程）占用的资源"""
+        pass
+
+    def close(self):
+        pass
+
+
+class JsonFileBackend(StorageBackend):
+    """
+    每个集合一个JSON文件，读取结果缓存在内存中，文件被其他进程修改时自动失效
+    分区集合每个用户一个文件：<data_dir>/<集合名>/<user_id>.json
+    journal_collections 中的集合使用追加日志存储：写入时只追加差异记录，日志过大时后台压缩为快照
+    observer(key, cache_hit, bytes_read): 每次加载后回调，用于指标统计
+    """
+
+    def __init__(self, data_files, data_dir, journal_collections=(), compact_records=1000, observer=None,
+                 partitioned=()):
+        super().__init__(data_files, data_dir, partitioned)
+        self.data_files = data_files
+        self.data_dir = data_dir
+        self.observer = observer
+        self.cache = CollectionCache()
+        self.journal_collections = set(journal_collections)
+        self.compact_records = compact_records
+
+        # 每个集合的持久化ID序列（<data_dir>/<集合名>.seq）
+        self.id_sequences = {
+            key: IdSequence(os.path.join(data_dir, f'{key}.seq'), initial=lambda key=key: self._max_id(key))
+            for key in data_files
+        }
+
+        for key in self.partitioned:
+            self._split_legacy(key)
+
+        # 日志存储实例，启动时重放日志完成恢复；分区的日志存储在首次访问时创建并恢复
+        self.journal_stores = {}
+        self._journal_guard = threading.Lock()
+        for key in self.journal_collections - self.partitioned:
+            self._journal_store(key)
+
+    def path(self, key):
+        """存储键对应的JSON文件路径"""
+        collection, user_id = split_partition(key)
+        if user_id is None:
+            return self.data_files[key]
+        return os.path.join(self.data_dir, collection, f'{user_id}.json')
+
+    def _journal_store(self, key):
+        """返回存储键的日志存储，集合不使用日志存储时返回None"""
+        if split_partition(key)[0] not in self.journal_collections:
+            return None
+        store = self.journal_stores.get(key)
+        if store is None:
+            with self._journal_guard:
+                store = self.journal_stores.get(key)
+                if store is None:
+                    store = JournalStore(self.path(key), compact_records=self.compact_records,
+                                         collection_lock=self.lock(key))
+                    with self.lock(key):
+                        store.recover()
+                    self.journal_stores[key] = store
+        return store
+
+    def _split_legacy(self, key):
+        """
+        把分区之前的整个集合文件（含日志）按 user_id 拆分为每个用户一个文件，只在升级后首次启动时执行
+        没有 user_id 的旧记录归属 LEGACY_USER_ID；原文件重命名为 .migrated 保留（空集合直接删除）
+        """
+        legacy_path = self.data_files[key]
+        journal_path = journal_path_for(legacy_path)
+        with self.lock(key):
+            if not (os.path.exists(legacy_path) or os.path.exists(journal_path)):
+                return
+            store = JournalStore(legacy_path)
+            store.recover()
+            records = store.load()
+            groups = {}
+            for record in records:
+                if record.get('user_id') is None:
+                    record = {**record, 'user_id': LEGACY_USER_ID}
+                groups.setdefault(record['user_id'], []).append(record)
+            os.makedirs(os.path.join(self.data_dir, key), exist_ok=True)
+            for user_id, items in groups.items():
+                name = partition_name(key, user_id)
+                with self.lock(name):
+                    # 按id合并，上次拆分中途失败后重新执行不会产生重复记录
+                    merged = {record['id']: record for record in self._load_file(name)}
+                    merged.update((record['id'], record) for record in items)
+                    write_json_atomic(self.path(name), list(merged.values()))
+            for path in (legacy_path, journal_path):
+                if not os.path.exists(path):
+                    continue
+                if records:
+                    os.replace(path, path + '.migrated')
+                else:
+                    os.remove(path)
+            logger.info(f"{key} 已按用户拆分为 {len(groups)} 个分区（{len(records)} 条记录）")
+
+    def _load_file(self, key):
+        """直接读取存储键的JSON文件（不经过缓存），文件不存在时返回空列表"""
+        try:
+            with open(self.path(key), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return []
+
+    def partitions(self, key):
+        directory = os.path.join(self.data_dir, key)
+        if not os.path.isdir(directory):
+            return []
+        # 使用日志存储的分区在压缩前可能只有日志文件
+        user_ids = {
+            int(name.split('.', 1)[0]) for name in os.listdir(directory)
+            if name.split('.', 1)[0].isdigit() and (name.endswith('.json') or name.endswith('.journal.jsonl'))
+        }
+        return sorted(user_ids)
+
+    def _observe(self, key, cache_hit, bytes_read=0):
+        if self.observer is not None:
+            self.observer(key, cache_hit, bytes_read)
+
+    def load(self, key):
+        file_path = self.path(key)
+        store = self._journal_store(key)
+        if store is not None:
+            try:
+                return store.load()
+            except Exception as e:
+                logger.error(f"加载数据失败: {str(e)}")
+                return []
+        signature, data = self.cache.lookup(key, file_path)
+        if data is not None:
+            self._observe(key, True)
+            return list(data)
+        if signature is None:
+            return []
+        try:
+            with open(file_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except json.JSONDecodeError:
+            logger.error(f"JSON解码错误: {file_path}")
+            return []
+        except Exception as e:
+            logger.error(f"加载数据失败: {str(e)}")
+            return []
+        self._observe(key, False, signature[1])
+        self.cache.store(key, signature, data)
+        return list(data)
+
+    def save(self, key, data):
+        file_path = self.path(key)
+        store = self._journal_store(key)
+        if store is not None:
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            return store.save(data)
+        try:
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            write_json_atomic(file_path, data)
+        except Exception:
+            # 写入失败时文件内容不确定，丢弃缓存
+            self.cache.invalidate(key)
+            raise
+        self.cache.store_written(key, file_path, list(data))
+        return os.path.getsize(file_path)
+
+    def version(self, key):
+        store = self._journal_store(key)
+        if store is not None:
+            return store.version
+        return self.cache.version(key, self.path(key))
+
+    def signature(self, key):
+        store = self._journal_store(key)
+        if store is not None:
+            return (file_signature(store.snapshot_path), file_signature(store.journal_path))
+        return file_signature(self.path(key))
+
+    def _max_id(self, key):
+        """集合中已使用的最大ID，仅在序列文件不存在时用于初始化"""
+        if key not in self.partitioned:
+            return max((item['id'] for item in self.load(key)), default=0)
+        return max(
+            (item['id'] for user_id in self.partitions(key) for item in self.load(partition_name(key, user_id))),
+            default=0
+        )
+
+    def reserve_ids(self, key, count):
+        return self.id_sequences[key].reserve(count)
+
+    def next_id(self, key):
+        return self.id_sequences[key].next()
@@ -0,0 +1,59 @@
+"""
+stale-while-revalidate 缓存
+过期但仍在可用期内的结果立即返回并在后台刷新；同一个键的并发未命中只触发一次上游请求
+"""
+
+import time
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class StaleWhileRevalidate:
+    """
+    cache: LLMCache实例，其ttl即结果最长可用时间
+    executor: 执行上游请求的线程池
+    fresh_for: 结果保持新鲜的秒数，超过后返回旧结果并在后台刷新
+    """
+
+    def __init__(self, cache, executor, fresh_for=3600):
+        self.cache = cache
+        self.executor = executor
+        self.fresh_for = fresh_for
+        self._lock = threading.Lock()
+        self._inflight = {}  # key -> Future
+
+    def _run(self, key, fetch):
+        value = fetch()
+        self.cache.set(key, {'value': value, 'fetched_at': time.time()})
+        return value
+
+    def _done(self, key, future):
+        with self._lock:
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+        if not future.cancelled() and future.exception() is not None:
+            logger.warning(f"刷新缓存失败: {future.exception()}")
+
+    def refresh(self, key, fetch):
+        """发起（或加入正在进行的）上游请求，返回Future"""
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is None:
+                future = self.executor.submit(self._run, key, fetch)
+                self._inflight[key] = future
+                future.add_done_callback(lambda f: self._done(key, f))
+            return future
+
+    def get(self, key, fetch, timeout=None):
+        """
+        返回缓存结果，必要时调用fetch()
+        无可用缓存时等待上游结果（最多timeout秒），失败时抛出异常
+        """
+        hit, entry = self.cache.get(key)
+        if hit and entry is not None:
+            if time.time() - entry['fetched_at'] >= self.fresh_for:
+                self.refresh(key, fetch)
+            return entry['value']
+        return self.refresh(key, fetch).result(timeout=timeout)
@@ -0,0 +1,121 @@
+"""
+访问令牌管理
+按 expires_in 缓存令牌并在过期前主动刷新；并发调用共享同一次刷新；
+令牌持久化到文件，重启或多进程之间可以复用
+"""
+
+import os
+import json
+import time
+import logging
+import threading
+
+from journal_store import write_json_atomic
+
+logger = logging.getLogger(__name__)
+
+
+class TokenManager:
+    """
+    fetch() 返回 (token, expires_in秒)
+    剩余有效期少于 refresh_ratio * 有效期 时在后台刷新，过期后同步刷新
+    """
+
+    def __init__(self, fetch, cache_path=None, refresh_ratio=0.1, min_margin=60):
+        self.fetch = fetch
+        self.cache_path = cache_path
+        self.refresh_ratio = refresh_ratio
+        self.min_margin = min_margin
+
+        self._lock = threading.Lock()          # 保护令牌状态
+        self._refresh_lock = threading.Lock()  # 同一时间只有一个刷新请求
+        self._token = None
+        self._expires_at = 0
+        self._refresh_at = 0
+        self._load_cached()
+
+    # --- 持久化 ---
+
+    def _load_cached(self):
+        """从缓存文件读取令牌（其他进程或上次运行时获取的）"""
+        if not self.cache_path or not os.path.exists(self.cache_path):
+            return
+        try:
+            with open(self.cache_path, 'r', encoding='utf-8') as f:
+                cached = json.load(f)
+            self._set(cached['access_token'], cached['expires_at'], cached['refresh_at'])
+        except Exception as e:
+            logger.warning(f"读取令牌缓存失败: {e}")
+
+    def _persist(self):
+        if not self.cache_path:
+            return
+        try:
+            write_json_atomic(self.cache_path, {
+                'access_token': self._token,
+                'expires_at': self._expires_at,
+                'refresh_at': self._refresh_at
+            })
+        except Exception as e:
+            logger.warning(f"保存令牌缓存失败: {e}")
+
+    def _set(self, token, expires_at, refresh_at):
+        with self._lock:
+            self._token = token
+            self._expires_at = expires_at
+            self._refresh_at = refresh_at
+
+    # --- 刷新 ---
+
+    def _refresh(self):
+        """调用fetch获取新令牌（需持有_refresh_lock）"""
+        token, expires_in = self.fetch()
+        now = time.time()
+        margin = max(expires_in * self.refresh_ratio, self.min_margin)
+        self._set(token, now + expires_in, now + max(expires_in - margin, 0))
+        self._persist()
+        logger.info(f"访问令牌已刷新，有效期 {expires_in} 秒")
+
+    def _refresh_in_background(self):
+        if not self._refresh_lock.acquire(blocking=False):
+            return  # 已有刷新在进行
+        try:
+            if time.time() < self._refresh_at:
+                return
+            self._refresh()
+        except Exception as e:
+            logger.warning(f"后台刷新令牌失败，继续使用当前令牌: {e}")
+        finally:
+            self._refresh_lock.release()
+
+    def get_token(self):
+        """返回有效令牌，必要时刷新"""
+        now = time.time()
+        with self._lock:
+            token, expires_at, refresh_at = self._token, self._expires_at, self._refresh_at
+        if token and now < expires_at:
+            if now >= refresh_at:
+                threading.Thread(target=self._refresh_in_background, daemon=True).start()
+            return token
+
+        # 令牌不存在或已过期：同步刷新，并发调用方等待同一次刷新的结果
+        with self._refresh_lock:
+            self._load_cached()  # 其他进程可能已经刷新
+            with self._lock:
+                if self._token and time.time() < self._expires_at:
+                    return self._token
+            self._refresh()
+            with self._lock:
+                return self._token
+
+    def invalidate(self):
+        """丢弃当前令牌（如上游返回鉴权失败），下次调用时重新获取"""
+        with self._lock:
+            self._token = None
+            self._expires_at = 0
+            self._refresh_at = 0
+        if self.cache_path and os.path.exists(self.cache_path):
+            try:
+                os.remove(self.cache_path)
+            except OSError:
+                pass
@@ -0,0 +1,125 @@
+"""
+上游HTTP客户端
+共享Session，按主机维护keep-alive连接池，统一超时设置和带抖动的退避重试
+"""
+
+import time
+import random
+import logging
+
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+# 可重试的响应状态码（仅对幂等请求重试）
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class UpstreamClient:
+    """
+    pool_connections: 缓存的主机连接池数量
+    pool_maxsize: 每个主机连接池保留的最大连接数
+    connect_timeout/read_timeout: 默认连接/读取超时（秒）
+    retries: 失败后的最大重试次数；backoff: 退避基准时间（秒）
+    observer: 每次调用结束（含重试）后回调 observer(name, 耗时秒数, 结果)，
+              结果为HTTP状态码字符串或异常类名
+    """
+
+    def __init__(self, pool_connections=10, pool_maxsize=20, connect_timeout=3.05,
+                 read_timeout=60, retries=2, backoff=0.3, observer=None):
+        self.observer = observer
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.retries = retries
+        self.backoff = backoff
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def _sleep_before_retry(self, attempt, response=None):
+        """指数退避 + 全抖动；上游给出 Retry-After 时以其为下限"""
+        delay = random.uniform(0, self.backoff * (2 ** attempt))
+        if response is not None:
+            retry_after = response.headers.get('Retry-After', '')
+            if retry_after.isdigit():
+                delay = max(delay, int(retry_after))
+        time.sleep(delay)
+
+    def request(self, method, url, idempotent=False, timeout=None, name=None, **kwargs):
+        """
+        发送请求
+        连接超时（请求尚未发出）总是重试；连接中断、读超时和 RETRY_STATUSES 只在 idempotent=True 时重试
+        timeout: 读取超时（秒）或 (连接超时, 读取超时)，默认使用客户端配置
+        name: 指标统计中的上游名称，默认为主机名
+        """
+        start = time.perf_counter()
+        outcome = 'error'
+        try:
+            response = self._request(method, url, idempotent, timeout, **kwargs)
+            outcome = str(response.status_code)
+            return response
+        except Exception as e:
+            outcome = type(e).__name__
+            raise
+        finally:
+            if self.observer is not None:
+                self.observer(name or urlparse(url).hostname, time.perf_counter() - start, outcome)
+
+    def _request(self, method, url, idempotent, timeout, **kwargs):
+        if timeout is None:
+            timeout = (self.connect_timeout, self.read_timeout)
+        elif not isinstance(timeout, tuple):
+            timeout = (self.connect_timeout, timeout)
+
+        attempt = 0
+        while True:
+            try:
+                response = self.session.request(method, url, timeout=timeout, **kwargs)
+            except requests.exceptions.ConnectTimeout as e:
+                # 连接超时说明请求尚未发出，任何请求都可以安全重试
+                if attempt >= self.retries:
+                    raise
+                logger.warning(f"上游连接超时，准备重试({attempt + 1}/{self.retries}): {url}: {e}")
+            except (requests.exceptions.ConnectionError, requests.exceptions.ReadTimeout) as e:
+                # 连接中断或读超时时请求可能已被处理，只重试幂等请求
+                if not idempotent or attempt >= self.retries:
+                    raise
+                logger.warning(f"上游请求失败，准备重试({attempt + 1}/{self.retries}): {url}: {e}")
+            else:
+                if not (idempotent and response.status_code in RETRY_STATUSES and attempt < self.retries):
+                    return response
+                logger.warning(f"上游返回 {response.status_code}，准备重试({attempt + 1}/{self.retries}): {url}")
+                response.close()
+                self._sleep_before_retry(attempt, response)
+                attempt += 1
+                continue
+            self._sleep_before_retry(attempt)
+            attempt += 1
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+
+class SizedStream:
+    """
+    为文件对象附带长度，使requests以Content-Length（而非chunked）流式上传请求体
+    数据边读边发，不会整体读入内存
+    """
+
+    def __init__(self, stream, length):
+        self.stream = stream
+        self.length = length
+
+    def __len__(self):
+        return self.length
+
+    def read(self, size=-1):
+        return self.stream.read(size)
@@ -0,0 +1,134 @@
+"""
+按用户分组的有序索引
+每个用户的记录按 (时间字段, id) 保持有序，列表接口按时间倒序分页时无需过滤和排序整个集合
+"""
+
+import json
+import base64
+import bisect
+import threading
+from collections import OrderedDict
+
+
+def encode_cursor(sort_key):
+    """把 (时间, id) 编码为不透明的分页游标"""
+    raw = json.dumps(list(sort_key), ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """解析分页游标，格式不正确时抛出 ValueError"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        timestamp, record_id = json.loads(raw)
+    except Exception:
+        raise ValueError('无效的分页游标')
+    if not isinstance(timestamp, str) or not isinstance(record_id, int):
+        raise ValueError('无效的分页游标')
+    return timestamp, record_id
+
+
+class UserOrderedIndex:
+    """
+    user_id -> 按 (sort_field, id) 升序排列的键列表，插入时用二分查找保持有序
+    version记录索引对应的集合版本；保存后通过sync增量更新，版本不一致时由调用方重建
+    """
+
+    def __init__(self, sort_field):
+        self.sort_field = sort_field
+        self._lock = threading.Lock()
+        self.version = None
+        self._keys = {}     # user_id -> [(时间, id), ...]
+        self._records = {}  # id -> 记录
+
+    def _sort_key(self, record):
+        return (record.get(self.sort_field) or '', record['id'])
+
+    def _add(self, record):
+        self._records[record['id']] = record
+        bisect.insort(self._keys.setdefault(record.get('user_id'), []), self._sort_key(record))
+
+    def _remove(self, record_id):
+        record = self._records.pop(record_id)
+        keys = self._keys[record.get('user_id')]
+        del keys[bisect.bisect_left(keys, self._sort_key(record))]
+
+    def rebuild(self, records, version):
+        """根据完整集合重建索引"""
+        with self._lock:
+            self._keys = {}
+            self._records = {}
+            for record in records:
+                self._records[record['id']] = record
+                self._keys.setdefault(record.get('user_id'), []).append(self._sort_key(record))
+            for keys in self._keys.values():
+                keys.sort()
+            self.version = version
+
+    def sync(self, records, from_version, to_version):
+        """
+        保存后的增量更新：新增、替换和删除的记录按对象身份识别（记录只替换不原地修改）
+        只有索引正好处于写入前的版本时才更新，否则保持过期状态等待重建
+        """
+        with self._lock:
+            if self.version != from_version:
+                return False
+            current_ids = set()
+            for record in records:
+                record_id = record['id']
+                current_ids.add(record_id)
+                existing = self._records.get(record_id)
+                if existing is record:
+                    continue
+                if existing is not None:
+                    self._remove(record_id)
+                self._add(record)
+            if len(current_ids) != len(self._records):
+                for record_id in [i for i in self._records if i not in current_ids]:
+                    self._remove(record_id)
+            self.version = to_version
+            return True
+
+    def page(self, user_id, limit=None, cursor=None):
+        """
+        按时间倒序返回用户的一页记录和下一页游标（没有更多时为None）
+        cursor为上一页返回的游标；limit为None时返回游标之后的全部记录
+        """
+        after = None if cursor is None else decode_cursor(cursor)
+        with self._lock:
+            keys = self._keys.get(user_id, [])
+            end = len(keys) if after is None else bisect.bisect_left(keys, after)
+            start = 0 if limit is None else max(end - limit, 0)
+            items = [self._records[record_id] for _, record_id in reversed(keys[start:end])]
+            next_cursor = encode_cursor(keys[start]) if start > 0 else None
+        return items, next_cursor
+
+
+class PartitionedUserIndex:
+    """
+    分区集合的有序索引：每个用户分区一个 UserOrderedIndex，按最近使用保留至多 max_partitions 个
+    被淘汰的分区下次访问时按分区数据重建
+    """
+
+    def __init__(self, sort_field, max_partitions=4096):
+        self.sort_field = sort_field
+        self.max_partitions = max_partitions
+        self._lock = threading.Lock()
+        self._indexes = OrderedDict()  # user_id -> UserOrderedIndex
+
+    def get(self, user_id):
+        with self._lock:
+            index = self._indexes.get(user_id)
+            if index is None:
+                index = self._indexes[user_id] = UserOrderedIndex(self.sort_field)
+                if len(self._indexes) > self.max_partitions:
+                    self._indexes.popitem(last=False)
+            else:
+                self._indexes.move_to_end(user_id)
+            return index
+
+    def sync(self, user_id, records, from_version, to_version):
+        """分区保存后的增量更新，索引不在内存中时跳过"""
+        with self._lock:
+            index = self._indexes.get(user_id)
+        return index is not None and index.sync(records, from_version, to_version)
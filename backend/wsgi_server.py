@@ -0,0 +1,63 @@
+"""
+自托管部署用的WSGI服务器（由 serve.py 和压测服务进程使用）
+gevent模式下必须先调用 serve.patch_for_gevent() 再导入本模块和 app
+"""
+
+import sys
+import signal
+import socket
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.serving import BaseWSGIServer
+
+
+class PooledWSGIServer(BaseWSGIServer):
+    """固定线程数的WSGI服务器：请求数超过线程数时在线程池队列中等待（与同步worker的行为一致）"""
+
+    multithread = True
+
+    def __init__(self, host, port, wsgi_app, threads):
+        super().__init__(host, port, wsgi_app)
+        self._executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='http')
+
+    def process_request(self, request, client_address):
+        self._executor.submit(self._process_request, request, client_address)
+
+    def _process_request(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+
+def make_server(wsgi_app, host, port, worker='threads', threads=16, max_connections=1000):
+    """
+    创建WSGI服务器，调用 serve_forever() 开始处理请求
+    gevent模式下 max_connections 为同时处理的连接数上限（0为不限制）
+    """
+    if worker == 'gevent':
+        from gevent.pool import Pool
+        from gevent.pywsgi import WSGIServer
+
+        class NoDelayWSGIServer(WSGIServer):
+            def handle(self, sock, address):
+                # 响应头和响应体分开写出，开启Nagle算法时与客户端的延迟确认叠加，每个请求多等约40ms
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                super().handle(sock, address)
+
+        spawn = Pool(max_connections) if max_connections else 'default'
+        return NoDelayWSGIServer((host, port), wsgi_app, spawn=spawn, log=None)
+    return PooledWSGIServer(host, port, wsgi_app, threads)
+
+
+def exit_on_sigterm(server, worker='threads'):
+    """收到SIGTERM时结束 serve_forever() 正常退出，执行退出钩子（停止后台任务、搜索索引写盘等）"""
+    if worker == 'gevent':
+        import gevent
+        # 信号处理函数可能在任意协程（包括hub）中执行，在其中抛出SystemExit不一定能结束进程；
+        # 改为在新协程中停止服务器，serve_forever() 在主协程中返回
+        gevent.signal_handler(signal.SIGTERM, lambda: gevent.spawn(server.stop))
+    else:
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
@@ -2,6 +2,17 @@
 class APIUtils {
     constructor() {
         this.baseURL = '/api';
+        // 当前用户ID，通过 X-User-Id 请求头传给后端；未设置时后端使用默认用户
+        this.userId = localStorage.getItem('forbites_user_id');
+    }
+
+    setUserId(userId) {
+        this.userId = userId ? String(userId) : null;
+        if (this.userId) {
+            localStorage.setItem('forbites_user_id', this.userId);
+        } else {
+            localStorage.removeItem('forbites_user_id');
+        }
     }
 
     // 通用请求方法
@@ -10,6 +21,7 @@ class APIUtils {
         const defaultOptions = {
             headers: {
                 'Content-Type': 'application/json',
+                ...(this.userId ? { 'X-User-Id': this.userId } : {}),
             },
         };
         
@@ -27,6 +39,91 @@ class APIUtils {
         }
     }
 
+    // 分页请求：返回一页数据 { items, nextCursor }，nextCursor 为 null 表示没有更多
+    async getPage(endpoint, { limit = 20, cursor = null } = {}) {
+        const params = new URLSearchParams({ limit });
+        if (cursor) {
+            params.set('cursor', cursor);
+        }
+        const result = await this.request(`${endpoint}?${params}`);
+        return { items: result.items, nextCursor: result.next_cursor };
+    }
+
+    // 懒加载分页：每次调用 next() 才请求下一页
+    // const pager = api.pages('/knowledge/items'); const { value, done } = await pager.next();
+    // 或 for await (const items of api.pages('/knowledge/items')) { ... }
+    async *pages(endpoint, limit = 20) {
+        let cursor = null;
+        do {
+            const page = await this.getPage(endpoint, { limit, cursor });
+            yield page.items;
+            cursor = page.nextCursor;
+        } while (cursor);
+    }
+
+    // 全文搜索：菜谱、家乡菜谱和知识库，按相关度排序
+    // 返回 { items: [{ type, score, item }], total, nextCursor }；types 如 ['recipe', 'knowledge']
+    async search(query, { types = null, limit = 20, cursor = null } = {}) {
+        const params = new URLSearchParams({ q: query, limit });
+        if (types) {
+            params.set('type', types.join(','));
+        }
+        if (cursor) {
+            params.set('cursor', cursor);
+        }
+        const result = await this.request(`/search?${params}`);
+        return { items: result.items, total: result.total, nextCursor: result.next_cursor };
+    }
+
+    // 批量请求：多个接口合并为一次往返，路径写法与 request() 相同
+    // const [tips, filters] = await api.batch([{ path: '/tips?type=oil' }, { path: '/recipe/filters' }]);
+    // 每项返回 { status, body, etag }，顺序与请求一致；连续的GET并发执行，写请求按顺序执行
+    async batch(requests) {
+        const result = await this.request('/batch', {
+            method: 'POST',
+            body: JSON.stringify({
+                requests: requests.map(({ method = 'GET', path, body, headers }) => ({
+                    method,
+                    path: `${this.baseURL}${path}`,
+                    ...(body !== undefined ? { body } : {}),
+                    ...(headers ? { headers } : {}),
+                }))
+            })
+        });
+        return result.responses;
+    }
+
+    // 后台任务：耗时的大模型/语音识别请求提交后立即返回，结果稍后获取
+    // 可提交的接口：/baidu/asr、/recipe/ai_generate、/pantry/storage_tips、/community/questions
+    // idempotencyKey 相同的重复提交（如网络重试）返回同一个任务，不会重复生成菜谱
+    async submitJob(path, body = undefined, { idempotencyKey = null } = {}) {
+        return await this.request('/jobs', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+                ...(this.userId ? { 'X-User-Id': this.userId } : {}),
+                ...(idempotencyKey ? { 'Idempotency-Key': idempotencyKey } : {}),
+            },
+            body: JSON.stringify({ path: `${this.baseURL}${path}`, ...(body !== undefined ? { body } : {}) })
+        });
+    }
+
+    // 查询任务；wait > 0 时服务端最多等待 wait 秒（不超过30），状态变化后立即返回
+    async getJob(jobId, wait = 0) {
+        return await this.request(`/jobs/${jobId}${wait ? `?wait=${wait}` : ''}`);
+    }
+
+    // 提交任务并长轮询直到完成，返回完成的任务 { status: 'succeeded' | 'failed', result: { status, body }, error }
+    // const job = await api.runJob('/recipe/ai_generate', { ingredients }, { onStatus: job => ... });
+    async runJob(path, body = undefined, { idempotencyKey = crypto.randomUUID(), onStatus = null } = {}) {
+        let job = await this.submitJob(path, body, { idempotencyKey });
+        while (job.status !== 'succeeded' && job.status !== 'failed') {
+            if (onStatus) onStatus(job);
+            job = await this.getJob(job.id, 30);
+        }
+        return job;
+    }
+
     // 用户位置管理
     // async getUserLocation() {
     //     try {
@@ -62,6 +159,11 @@ class APIUtils {
         }
     }
 
+    // 按创建时间倒序逐页加载知识库项目
+    getKnowledgeItemPages(limit = 20) {
+        return this.pages('/knowledge/items', limit);
+    }
+
     async createKnowledgeItem(item) {
         try {
             const result = await this.request('/knowledge/items', {
@@ -98,6 +200,11 @@ class APIUtils {
         }
     }
 
+    // 按创建时间倒序逐页加载家乡菜谱
+    getHometownRecipePages(limit = 20) {
+        return this.pages('/hometown/recipes', limit);
+    }
+
     async createHometownRecipe(recipe) {
         try {
             const result = await this.request('/hometown/recipes', {
@@ -134,6 +241,11 @@ class APIUtils {
         }
     }
 
+    // 按添加时间倒序逐页加载用户食材
+    getUserIngredientPages(limit = 20) {
+        return this.pages('/user/ingredients', limit);
+    }
+
     async addUserIngredients(ingredients) {
         try {
             console.log('添加用户食材:', ingredients);
@@ -236,6 +348,45 @@ class APIUtils {
         }
     }
 
+    // AI菜谱生成（SSE流式）- handlers: { onField(field, value), onItem(field, index, value) }
+    // 菜谱名称和前几个步骤生成后即可展示，最终返回保存后的完整菜谱
+    async generateAIRecipeStream(ingredients, handlers = {}) {
+        const response = await fetch(`${this.baseURL}/recipe/ai_generate?stream=1`, {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+                'Accept': 'text/event-stream'
+            },
+            body: JSON.stringify({ ingredients })
+        });
+        if (!response.ok) {
+            throw new Error(`HTTP error! status: ${response.status}`);
+        }
+
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder('utf-8');
+        let buffer = '';
+        while (true) {
+            const { done, value } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+
+            // 每条SSE消息以空行结束
+            let boundary;
+            while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                const message = buffer.slice(0, boundary);
+                buffer = buffer.slice(boundary + 2);
+                const event = (message.match(/^event: (.*)$/m) || [])[1];
+                const data = JSON.parse((message.match(/^data: (.*)$/m) || [])[1] || 'null');
+                if (event === 'field' && handlers.onField) handlers.onField(data.field, data.value);
+                if (event === 'item' && handlers.onItem) handlers.onItem(data.field, data.index, data.value);
+                if (event === 'done') return data;
+                if (event === 'error') throw new Error(data.error);
+            }
+        }
+        throw new Error('菜谱生成中断');
+    }
+
     // 获取百度语音识别Access Token
     async getBaiduAccessToken() {
         try {
@@ -267,31 +418,16 @@ class APIUtils {
     // 语音识别 - 调用百度云API
 async recognizeVoice(audioBlob) {
     try {
-        // 读取音频文件并转换为Base64
-        const reader = new FileReader();
-        const audioData = await new Promise((resolve, reject) => {
-            reader.onloadend = () => resolve(reader.result.split(',')[1]);
-            reader.onerror = reject;
-            reader.readAsDataURL(audioBlob);
-        });
-        
         // 修正日志中的硬编码rate，与实际发送值一致
         console.log(`发送的语音识别参数: rate=16000, format=pcm, 音频大小=${audioBlob.size}字节`);
         
-        // 发送请求到后端代理接口
-        const response = await fetch('/api/baidu/asr', {
+        // 以二进制请求体直接上传PCM音频，无需转换为Base64
+        const response = await fetch('/api/baidu/asr?rate=16000&cuid=forbites', {
             method: 'POST',
             headers: {
-                'Content-Type': 'application/json'
+                'Content-Type': 'application/octet-stream'
             },
-            body: JSON.stringify({
-                format: 'pcm',
-                rate: 16000,
-                channel: 1,
-                cuid: 'forbites',
-                speech: audioData,
-                len: audioBlob.size
-            })
+            body: audioBlob
         });
         
         const result = await response.json();
@@ -386,11 +522,19 @@ const localStorageCompat = {
         return await api.deleteKnowledgeItem(itemId);
     },
 
+    getKnowledgeItemPages(limit) {
+        return api.getKnowledgeItemPages(limit);
+    },
+
     // 家乡菜谱
     async getHometownRecipes() {
         return await api.getHometownRecipes();
     },
 
+    getHometownRecipePages(limit) {
+        return api.getHometownRecipePages(limit);
+    },
+
     async saveHometownRecipe(recipe) {
         return await api.createHometownRecipe(recipe);
     },